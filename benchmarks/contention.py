@@ -0,0 +1,92 @@
+"""Stress test of concurrent patches that edit relatives of the same citizens.
+
+Every edit replaces relatives of a random citizen of a small import with a few other random citizens, so concurrent
+edits overlap and often add each other as relatives. Edits are made by concurrent tasks with connections of one
+pool, one citizen per call or in batches of bulk patches. Prints throughput, number of failed edits by error and of
+deadlocks detected by server, and checks that aggregates of import are consistent after all edits. Database
+connection is configured with the same environment variables as the application.
+
+Usage:
+    PYTHONPATH=ecommerce_analyzer/ python benchmarks/contention.py --citizens 50 --edits 5000 --concurrency 32
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from typing import List
+
+from dotenv import load_dotenv
+
+load_dotenv("env/.env")
+
+import analyzer  # noqa: E402
+from api.scheme import CitizenPatchItem  # noqa: E402
+from databases import Database  # noqa: E402
+from db.settings import DataBaseSettings  # noqa: E402
+from ingest import make_import  # noqa: E402
+
+DEADLOCKS_QUERY = "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()"
+
+
+def make_edits(citizens_num: int, edits_num: int, seed: int) -> List[CitizenPatchItem]:
+    """Random edits of relatives."""
+    rnd = random.Random(seed)
+    return [
+        CitizenPatchItem(
+            citizen_id=rnd.randrange(citizens_num), relatives=rnd.sample(range(citizens_num), rnd.randrange(1, 4))
+        )
+        for _ in range(edits_num)
+    ]
+
+
+async def main(citizens_num: int, edits_num: int, concurrency: int, batch: int) -> None:
+    """Run stress test and print results."""
+    database = Database(DataBaseSettings().dsn(), min_size=concurrency, max_size=concurrency)
+    await database.connect()
+    errors: Counter = Counter()
+    try:
+        # Connection of `databases` is bound to the task and inherited by tasks created later, so workers can't be
+        # created by the task that has used the database.
+        import_id = await asyncio.create_task(
+            analyzer.save_import(make_import(citizens_num, citizens_num // 2), database)
+        )
+
+        async def worker(worker_id: int) -> None:
+            edits = make_edits(citizens_num, edits_num // concurrency, worker_id)
+            for start in range(0, len(edits), batch):
+                try:
+                    if batch == 1:
+                        await analyzer.patch_citizen(import_id, edits[start].citizen_id, edits[start], database)
+                    else:
+                        await analyzer.patch_citizens(import_id, edits[start : start + batch], database)
+                except Exception as e:
+                    errors[type(e).__name__] += len(edits[start : start + batch])
+
+        deadlocks = await asyncio.create_task(database.fetch_val(DEADLOCKS_QUERY))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(worker_id) for worker_id in range(concurrency)))
+        seconds = time.perf_counter() - started
+
+        edits_done = edits_num // concurrency * concurrency
+        failed = sum(errors.values())
+        print(f"edits: {edits_done}, seconds: {seconds:.2f}, edits/sec: {edits_done / seconds:.0f}")
+        print(f"failed: {failed} ({failed / edits_done:.2%})", dict(errors))
+        print("deadlocks detected by server:", await database.fetch_val(DEADLOCKS_QUERY) - deadlocks)
+        difference = await analyzer.check_aggregates(import_id, database)
+        print("aggregates consistent:", not difference.presents and not difference.birth_dates)
+        await analyzer.drop_import(import_id, database)
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--citizens", type=int, default=50)
+    parser.add_argument("--edits", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch", type=int, default=1, help="edits per call, bulk patch is used if more than one")
+    args = parser.parse_args()
+    asyncio.run(main(args.citizens, args.edits, args.concurrency, args.batch))
@@ -0,0 +1,84 @@
+"""Benchmark of bulk ingest methods used by `analyzer.save_import`.
+
+Measures wall-clock time and rows per second of every ingest method for imports of different sizes, and time
+to drop the import. Parallel method is measured for every number of connections given. Database connection is
+configured with the same environment variables as the application.
+
+Usage:
+    PYTHONPATH=ecommerce_analyzer/ python benchmarks/ingest.py --citizens 10000 100000 1000000 --connections 1 2 4 8
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from datetime import date, timedelta
+from typing import List
+
+from dotenv import load_dotenv
+
+load_dotenv("env/.env")
+
+from analyzer import IngestMethod, drop_import, save_import  # noqa: E402
+from api.scheme import Citizen, Import  # noqa: E402
+from databases import Database  # noqa: E402
+from db.settings import DataBaseSettings  # noqa: E402
+
+
+def make_import(citizens_num: int, relations_num: int) -> Import:
+    """Build a valid import without running pydantic validation, so that only ingest is measured."""
+    relatives: List[List[int]] = [[] for _ in range(citizens_num)]
+    for citizen_id in range(0, min(relations_num * 2, citizens_num) - 1, 2):
+        relatives[citizen_id].append(citizen_id + 1)
+        relatives[citizen_id + 1].append(citizen_id)
+    data = [
+        Citizen.construct(
+            citizen_id=citizen_id,
+            town=f"Город {citizen_id % 20}",
+            street="Улица",
+            building="1к2",
+            apartment=citizen_id % 120 + 1,
+            name="Иванов Иван Иванович",
+            birth_date=date(1950, 1, 1) + timedelta(days=citizen_id % 25000),
+            gender="female" if citizen_id % 2 else "male",
+            relatives=relatives[citizen_id],
+        )
+        for citizen_id in range(citizens_num)
+    ]
+    return Import.construct(data=data)
+
+
+async def main(
+    citizens_nums: List[int], relations_ratio: float, methods: List[IngestMethod], connections_nums: List[int]
+) -> None:
+    """Run benchmark and print results table."""
+    database = Database(DataBaseSettings().dsn(), min_size=1, max_size=max(connections_nums) + 1)
+    await database.connect()
+    print(f"{'method':<10}{'conns':>6}{'citizens':>10}{'seconds':>10}{'rows/sec':>12}{'drop s':>8}")
+    try:
+        for citizens_num in citizens_nums:
+            import_obj = make_import(citizens_num, int(citizens_num * relations_ratio))
+            for method in methods:
+                for connections in connections_nums if method == IngestMethod.parallel else [1]:
+                    started = time.perf_counter()
+                    import_id = await save_import(import_obj, database, method=method, connections=connections)
+                    elapsed = time.perf_counter() - started
+                    started = time.perf_counter()
+                    await drop_import(import_id, database)
+                    dropped = time.perf_counter() - started
+                    print(
+                        f"{method.value:<10}{connections:>6}{citizens_num:>10}"
+                        f"{elapsed:>10.2f}{citizens_num / elapsed:>12.0f}{dropped:>8.2f}"
+                    )
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--citizens", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--relations-ratio", type=float, default=0.1, help="relations per citizen")
+    parser.add_argument("--methods", type=IngestMethod, nargs="+", default=list(IngestMethod))
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8], help="for parallel method")
+    args = parser.parse_args()
+    asyncio.run(main(args.citizens, args.relations_ratio, args.methods, args.connections))
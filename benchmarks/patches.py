@@ -0,0 +1,73 @@
+"""Benchmark of patching many citizens one by one and by one bulk patch.
+
+Applies the same edits to two copies of import: with `analyzer.patch_citizen` called for every edit, as clients of
+the per-citizen endpoint do, and with one call of `analyzer.patch_citizens`. Every edit renames a random citizen,
+every third one also replaces its relatives. Prints wall-clock time and edits per second. Database connection is
+configured with the same environment variables as the application.
+
+Usage:
+    PYTHONPATH=ecommerce_analyzer/ python benchmarks/patches.py --citizens 10000 100000 --edits 1000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import time
+from typing import List
+
+from dotenv import load_dotenv
+
+load_dotenv("env/.env")
+
+import analyzer  # noqa: E402
+from api.scheme import CitizenPatchItem  # noqa: E402
+from databases import Database  # noqa: E402
+from db.settings import DataBaseSettings  # noqa: E402
+from ingest import make_import  # noqa: E402
+
+
+def make_edits(citizens_num: int, edits_num: int) -> List[CitizenPatchItem]:
+    """Random edits of citizens, the same for the same arguments."""
+    rnd = random.Random(0)
+    edits = []
+    for edit in range(edits_num):
+        values = {"name": f"Иванов {edit}"}
+        if edit % 3 == 0:
+            values["relatives"] = rnd.sample(range(citizens_num), 2)
+        edits.append(CitizenPatchItem(citizen_id=rnd.randrange(citizens_num), **values))
+    return edits
+
+
+async def main(citizens_nums: List[int], relations_ratio: float, edits_num: int) -> None:
+    """Run benchmark and print results table."""
+    database = Database(DataBaseSettings().dsn())
+    await database.connect()
+    print(f"{'mode':<10}{'citizens':>10}{'edits':>8}{'seconds':>10}{'edits/sec':>12}")
+    try:
+        for citizens_num in citizens_nums:
+            import_obj = make_import(citizens_num, int(citizens_num * relations_ratio))
+            edits = make_edits(citizens_num, edits_num)
+            for mode in ("single", "bulk"):
+                import_id = await analyzer.save_import(import_obj, database)
+                await database.execute("ANALYZE")
+                started = time.perf_counter()
+                if mode == "single":
+                    for edit in edits:
+                        await analyzer.patch_citizen(import_id, edit.citizen_id, edit, database)
+                else:
+                    await analyzer.patch_citizens(import_id, edits, database)
+                seconds = time.perf_counter() - started
+                print(f"{mode:<10}{citizens_num:>10}{edits_num:>8}{seconds:>10.3f}{edits_num / seconds:>12.0f}")
+                await analyzer.drop_import(import_id, database)
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--citizens", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--relations-ratio", type=float, default=0.1, help="relations per citizen")
+    parser.add_argument("--edits", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.citizens, args.relations_ratio, args.edits))
@@ -0,0 +1,126 @@
+"""Load test of connection pools of several application processes sharing one connection budget.
+
+Starts processes like gunicorn workers, each with its own `api.pool.MonitoredDatabase` pool. The first process gets
+`--busy` concurrent tasks and the rest get `--idle` tasks, every task runs queries that hold connection for
+`--query-seconds`, as queries waiting for disk or locks do. Prints queries per second and latency of queries
+including waits for connections by process, final limits of pools and the maximum number of connections of all
+processes sampled from `pg_stat_activity`. Database connection is configured with the same environment variables as
+the application.
+
+Usage:
+    PYTHONPATH=ecommerce_analyzer/ python benchmarks/pool.py --processes 5 --max-size 20
+    PYTHONPATH=ecommerce_analyzer/ python benchmarks/pool.py --processes 5 --max-size 80 --adaptive --budget 100
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import multiprocessing
+import statistics
+import time
+from typing import List
+
+from dotenv import load_dotenv
+
+load_dotenv("env/.env")
+
+from api.pool import APPLICATION_NAME, MonitoredDatabase  # noqa: E402
+from databases import Database  # noqa: E402
+from db.settings import DataBaseSettings  # noqa: E402
+
+COUNT_CONNECTIONS = "SELECT count(*) FROM pg_stat_activity WHERE starts_with(application_name, :prefix)"
+
+
+async def run_process(args: argparse.Namespace, tasks_num: int) -> dict:
+    """Run queries of one process and return its results."""
+    database = MonitoredDatabase(
+        DataBaseSettings().dsn(),
+        "primary",
+        min_size=args.min_size,
+        max_size=args.max_size,
+        adaptive=args.adaptive,
+        budget=args.budget,
+        interval=args.interval,
+    )
+    await database.connect()
+    latencies: List[float] = []
+    deadline = time.perf_counter() + args.seconds
+
+    async def task() -> None:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await database.execute(f"SELECT pg_sleep({args.query_seconds})")
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        await asyncio.gather(*(task() for _ in range(tasks_num)))
+        limit = database.pool.limit
+    finally:
+        await database.disconnect()
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "tasks": tasks_num,
+        "qps": len(latencies) / args.seconds,
+        "p50": quantiles[49],
+        "p99": quantiles[98],
+        "limit": limit,
+    }
+
+
+def process_main(args: argparse.Namespace, tasks_num: int, results: multiprocessing.Queue) -> None:
+    """Entry point of process."""
+    results.put(asyncio.run(run_process(args, tasks_num)))
+
+
+async def sample_connections(seconds: float) -> int:
+    """Maximum number of connections of application processes."""
+    database = Database(DataBaseSettings().dsn())
+    await database.connect()
+    try:
+        samples = []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            samples.append(await database.fetch_val(COUNT_CONNECTIONS, {"prefix": f"{APPLICATION_NAME}:"}))
+            await asyncio.sleep(0.1)
+        return max(samples)
+    finally:
+        await database.disconnect()
+
+
+def main(args: argparse.Namespace) -> None:
+    """Run processes and print results."""
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=process_main, args=(args, args.busy if i == 0 else args.idle, results))
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    max_connections = asyncio.run(sample_connections(args.seconds))
+    stats = sorted((results.get() for _ in processes), key=lambda s: -s["tasks"])
+    for process in processes:
+        process.join()
+
+    mode = f"adaptive, budget {args.budget}" if args.adaptive else "fixed"
+    print(f"pools: {mode}, min size {args.min_size}, max size {args.max_size}")
+    for s in stats:
+        print(
+            f"tasks: {s['tasks']:3}, queries/sec: {s['qps']:6.0f}, latency p50: {s['p50'] * 1e3:6.1f} ms, "
+            f"p99: {s['p99'] * 1e3:6.1f} ms, final limit: {s['limit']}"
+        )
+    print("max connections of all processes:", max_connections)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=5)
+    parser.add_argument("--busy", type=int, default=60, help="concurrent tasks of the first process")
+    parser.add_argument("--idle", type=int, default=2, help="concurrent tasks of other processes")
+    parser.add_argument("--query-seconds", type=float, default=0.02)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--min-size", type=int, default=5)
+    parser.add_argument("--max-size", type=int, default=20)
+    parser.add_argument("--adaptive", action="store_true")
+    parser.add_argument("--budget", type=int, default=None)
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between adjustments of pools")
+    main(parser.parse_args())
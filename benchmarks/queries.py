@@ -0,0 +1,70 @@
+"""Benchmark of read and patch queries of `analyzer` for imports of different sizes.
+
+Prints median and 99th percentile of wall-clock time of every operation in milliseconds. Database connection is
+configured with the same environment variables as the application.
+
+Usage:
+    PYTHONPATH=ecommerce_analyzer/ python benchmarks/queries.py --citizens 10000 100000 --repeat 10
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from math import ceil
+from typing import Awaitable, Callable, Dict, List
+
+from dotenv import load_dotenv
+
+load_dotenv("env/.env")
+
+import analyzer  # noqa: E402
+from api.scheme import CitizenPatch  # noqa: E402
+from databases import Database  # noqa: E402
+from db.settings import DataBaseSettings  # noqa: E402
+from ingest import make_import  # noqa: E402
+
+
+def make_operations(import_id: int, database: Database) -> Dict[str, Callable[[int], Awaitable]]:
+    """Operations to measure, every one gets the number of the run."""
+    return {
+        "get_citizens": lambda run: analyzer.get_citizens(import_id, database),
+        "get_birthdays": lambda run: analyzer.get_birthdays(import_id, database),
+        "get_age_statistics": lambda run: analyzer.get_age_statistics(import_id, database),
+        "patch_citizen": lambda run: analyzer.patch_citizen(
+            import_id, 0, CitizenPatch(name=f"Иванов {run}", relatives=[1, 3] if run % 2 else [1]), database
+        ),
+    }
+
+
+async def main(citizens_nums: List[int], relations_ratio: float, repeat: int) -> None:
+    """Run benchmark and print results table."""
+    database = Database(DataBaseSettings().dsn())
+    await database.connect()
+    print(f"{'operation':<20}{'citizens':>10}{'median ms':>12}{'p99 ms':>10}")
+    try:
+        for citizens_num in citizens_nums:
+            import_obj = make_import(citizens_num, int(citizens_num * relations_ratio))
+            import_id = await analyzer.save_import(import_obj, database)
+            await database.execute("ANALYZE")
+            for name, operation in make_operations(import_id, database).items():
+                timings = []
+                for run in range(repeat):
+                    started = time.perf_counter()
+                    await operation(run)
+                    timings.append(time.perf_counter() - started)
+                p99 = sorted(timings)[ceil(len(timings) * 0.99) - 1]
+                print(f"{name:<20}{citizens_num:>10}{statistics.median(timings) * 1000:>12.1f}{p99 * 1000:>10.1f}")
+            await analyzer.drop_import(import_id, database)
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--citizens", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--relations-ratio", type=float, default=0.1, help="relations per citizen")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.citizens, args.relations_ratio, args.repeat))
@@ -0,0 +1,91 @@
+"""Check of read-your-writes reads routed to streaming replica.
+
+Every iteration patches name of a random citizen on primary and reads the citizen back at once: directly from
+replica, as reads routed to replica without version check would do, and from database chosen by
+`api.replicas.ReplicaRouter` for the version of import created by the patch. Prints share of reads that didn't see
+the patch, share of routed reads served by replica and median time of choosing database. Primary is configured with
+the same environment variables as the application, replica with `POSTGRES_REPLICA_HOST` and `POSTGRES_REPLICA_PORT`.
+Lagging replica can be simulated with `SELECT pg_wal_replay_pause()` on it after the import is replayed.
+
+Usage:
+    PYTHONPATH=ecommerce_analyzer/ POSTGRES_REPLICA_HOST=127.0.0.1 POSTGRES_REPLICA_PORT=5433 \\
+        python benchmarks/replicas.py --citizens 10000 --edits 1000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv("env/.env")
+
+import analyzer  # noqa: E402
+from analyzer.analyzer import _get_citizen  # noqa: E402
+from api.replicas import ReplicaRouter  # noqa: E402
+from api.scheme import CitizenPatch  # noqa: E402
+from databases import Database  # noqa: E402
+from db.settings import DataBaseSettings  # noqa: E402
+from ingest import make_import  # noqa: E402
+
+
+async def get_name(import_id: int, citizen_id: int, database: Database) -> Optional[str]:
+    """Name of citizen or None if import isn't replayed yet."""
+    try:
+        return (await _get_citizen(import_id, citizen_id, database))["name"]
+    except ValueError:
+        return None
+
+
+async def main(citizens_num: int, edits_num: int, max_wait: float) -> None:
+    """Run check and print results."""
+    settings = DataBaseSettings()
+    if settings.replica_dsn() is None:
+        raise SystemExit("POSTGRES_REPLICA_HOST is not set")
+    primary, replica = Database(settings.dsn()), Database(settings.replica_dsn())
+    router = ReplicaRouter(replica, max_wait)
+    await primary.connect()
+    await router.connect()
+    try:
+        import_id = await analyzer.save_import(make_import(citizens_num, citizens_num // 10), primary)
+        while await analyzer.get_import_version(import_id, replica) is None:
+            await asyncio.sleep(0.01)
+        rnd = random.Random(0)
+        stale = {"replica": 0, "routed": 0}
+        routed_to_replica = 0
+        timings = []
+        for edit in range(edits_num):
+            citizen_id, name = rnd.randrange(citizens_num), f"Иванов {edit}"
+            await analyzer.patch_citizen(import_id, citizen_id, CitizenPatch(name=name), primary)
+            version = await analyzer.get_import_version(import_id, primary)
+            if await get_name(import_id, citizen_id, replica) != name:
+                stale["replica"] += 1
+            started = time.perf_counter()
+            reader = await router.choose(import_id, version, primary)
+            timings.append(time.perf_counter() - started)
+            routed_to_replica += reader is replica
+            if await get_name(import_id, citizen_id, reader) != name:
+                stale["routed"] += 1
+
+        print(f"edits: {edits_num}, max wait: {max_wait}s")
+        print(f"stale reads from replica: {stale['replica'] / edits_num:.1%}")
+        print(f"stale routed reads: {stale['routed'] / edits_num:.1%}")
+        print(f"routed reads served by replica: {routed_to_replica / edits_num:.1%}")
+        print(f"median time of choosing database: {statistics.median(timings) * 1e3:.2f} ms")
+        await analyzer.drop_import(import_id, primary)
+    finally:
+        await router.disconnect()
+        await primary.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--citizens", type=int, default=10_000)
+    parser.add_argument("--edits", type=int, default=1000)
+    parser.add_argument("--max-wait", type=float, default=0.5, help="seconds to wait for replica to catch up")
+    args = parser.parse_args()
+    asyncio.run(main(args.citizens, args.edits, args.max_wait))
@@ -0,0 +1,127 @@
+"""Benchmark of rendering response bodies of read endpoints.
+
+Compares ways to render body of every endpoint:
+
+* `validated` - body of citizens validated by `Import` model, as FastAPI renders `response_model`;
+* `python` - rows decoded by asyncpg and rendered in Python, citizens are streamed from server-side cursor;
+* `database` - document built by PostgreSQL and passed through as bytes.
+
+`page` endpoint is a page of citizens with a few fields from the middle of import.
+
+Prints median time to the first chunk and to the whole body, CPU time of this process per request in milliseconds,
+and peak memory allocated by Python while body is rendered (measured in separate run with `tracemalloc`). Database
+connection is configured with the same environment variables as the application.
+
+Usage:
+    PYTHONPATH=ecommerce_analyzer/ python benchmarks/responses.py --citizens 10000 100000 --repeat 5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv("env/.env")
+
+import analyzer  # noqa: E402
+from api.application import render_response  # noqa: E402
+from api.scheme import Import, Percentiles, Presents  # noqa: E402
+from api.streaming import iter_citizens_json  # noqa: E402
+from databases import Database  # noqa: E402
+from db.settings import DataBaseSettings  # noqa: E402
+from ingest import make_import  # noqa: E402
+
+PAGE_SIZE = 100
+PAGE_FIELDS = {"citizen_id", "name", "birth_date"}
+
+
+def make_renderers(
+    import_id: int, database: Database, page_after_citizen_id: int
+) -> Dict[Tuple[str, str], Callable[[], AsyncIterator[bytes]]]:
+    """Ways to render response bodies by endpoint and mode, every one yields chunks of body."""
+    page = (PAGE_FIELDS, page_after_citizen_id, PAGE_SIZE)
+
+    def rendered(get: Callable[[], Awaitable[bytes]]) -> Callable[[], AsyncIterator[bytes]]:
+        async def render() -> AsyncIterator[bytes]:
+            yield await get()
+
+        return render
+
+    async def validated_citizens() -> bytes:
+        return render_response(Import, {"data": await analyzer.get_citizens(import_id, database)})
+
+    async def python_birthdays() -> bytes:
+        return render_response(Presents, {"data": await analyzer.get_birthdays(import_id, database)})
+
+    async def python_age_statistics() -> bytes:
+        return render_response(Percentiles, {"data": await analyzer.get_age_statistics(import_id, database)})
+
+    return {
+        ("citizens", "validated"): rendered(validated_citizens),
+        ("citizens", "python"): lambda: iter_citizens_json(analyzer.iter_citizens(import_id, database)),
+        ("citizens", "database"): lambda: analyzer.iter_citizens_document(import_id, database),
+        ("page", "python"): lambda: iter_citizens_json(analyzer.iter_citizens(import_id, database, *page)),
+        ("page", "database"): lambda: analyzer.iter_citizens_document(import_id, database, *page),
+        ("birthdays", "python"): rendered(python_birthdays),
+        ("birthdays", "database"): rendered(lambda: analyzer.get_birthdays_document(import_id, database)),
+        ("age", "python"): rendered(python_age_statistics),
+        ("age", "database"): rendered(lambda: analyzer.get_age_statistics_document(import_id, database)),
+    }
+
+
+async def measure(render: Callable[[], AsyncIterator[bytes]]) -> tuple:
+    """Return seconds to the first chunk, to the whole body, CPU seconds and size of body."""
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    first_chunk = None
+    size = 0
+    async for chunk in render():
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - started
+        size += len(chunk)
+    return first_chunk, time.perf_counter() - started, time.process_time() - cpu_started, size
+
+
+async def main(citizens_nums: List[int], relations_ratio: float, repeat: int) -> None:
+    """Run benchmark and print results table."""
+    database = Database(DataBaseSettings().dsn())
+    await database.connect()
+    print(
+        f"{'endpoint':<10}{'mode':<10}{'citizens':>10}{'first ms':>10}{'total ms':>10}{'cpu ms':>10}"
+        f"{'body MB':>9}{'peak MB':>9}"
+    )
+    try:
+        for citizens_num in citizens_nums:
+            import_obj = make_import(citizens_num, int(citizens_num * relations_ratio))
+            import_id = await analyzer.save_import(import_obj, database)
+            del import_obj
+            await database.execute("ANALYZE")
+            for (endpoint, mode), render in make_renderers(import_id, database, citizens_num // 2).items():
+                results = [await measure(render) for _ in range(repeat)]
+                tracemalloc.start()
+                await measure(render)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                first_chunk, total, cpu = (statistics.median(r[i] for r in results) * 1000 for i in range(3))
+                size = results[0][3] / 2 ** 20
+                print(
+                    f"{endpoint:<10}{mode:<10}{citizens_num:>10}{first_chunk:>10.1f}{total:>10.1f}{cpu:>10.1f}"
+                    f"{size:>9.1f}{peak / 2 ** 20:>9.1f}"
+                )
+            await analyzer.drop_import(import_id, database)
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--citizens", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--relations-ratio", type=float, default=0.1, help="relations per citizen")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.citizens, args.relations_ratio, args.repeat))
@@ -0,0 +1,97 @@
+"""Microbenchmark of per-call overhead of prepared statements of `analyzer.statements`.
+
+Compares `_get_citizen` and `get_birthdays` with the same queries built by SQLAlchemy and executed through
+`databases` on every call, as analyzer did before. Prints median wall-clock and CPU time of this process per call
+in microseconds, for birthdays of small import the time is dominated by per-call overhead. Database connection is
+configured with the same environment variables as the application.
+
+Usage:
+    PYTHONPATH=ecommerce_analyzer/ python benchmarks/statements.py --citizens 100 10000 --repeat 2000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv("env/.env")
+
+import analyzer  # noqa: E402
+from analyzer.analyzer import _get_citizen  # noqa: E402
+from databases import Database  # noqa: E402
+from db import citizens, presents  # noqa: E402
+from db.settings import DataBaseSettings  # noqa: E402
+from ingest import make_import  # noqa: E402
+from sqlalchemy import and_, select  # noqa: E402
+
+
+async def built_get_citizen(import_id: int, citizen_id: int, database: Database) -> dict:
+    """`_get_citizen` with query built and compiled on every call."""
+    query = select([citizens]).where(and_(citizens.c.citizen_id == citizen_id, citizens.c.import_id == import_id))
+    return dict(await database.fetch_one(query))
+
+
+async def built_get_birthdays(import_id: int, database: Database) -> dict:
+    """`get_birthdays` with query built and compiled on every call."""
+    query = (
+        select([presents.c.month, presents.c.citizen_id, presents.c.presents])
+        .where(and_(presents.c.import_id == import_id, presents.c.presents > 0))
+        .order_by(presents.c.citizen_id)
+    )
+    res = {str(i): [] for i in range(1, 13)}
+    for row in await database.fetch_all(query):
+        res[str(row[0])].append({"citizen_id": row[1], "presents": row[2]})
+    return res
+
+
+def make_operations(import_id: int, database: Database) -> Dict[Tuple[str, str], Callable[[], Awaitable]]:
+    """Operations to measure by name and mode."""
+    return {
+        ("_get_citizen", "built"): lambda: built_get_citizen(import_id, 1, database),
+        ("_get_citizen", "prepared"): lambda: _get_citizen(import_id, 1, database),
+        ("get_birthdays", "built"): lambda: built_get_birthdays(import_id, database),
+        ("get_birthdays", "prepared"): lambda: analyzer.get_birthdays(import_id, database),
+    }
+
+
+async def main(citizens_nums: List[int], relations_ratio: float, repeat: int) -> None:
+    """Run benchmark and print results table."""
+    database = Database(DataBaseSettings().dsn(), min_size=1, max_size=1)
+    await database.connect()
+    print(f"{'operation':<15}{'mode':<10}{'citizens':>10}{'median us':>12}{'cpu us':>10}")
+    try:
+        for citizens_num in citizens_nums:
+            import_obj = make_import(citizens_num, int(citizens_num * relations_ratio))
+            import_id = await analyzer.save_import(import_obj, database)
+            await database.execute("ANALYZE")
+            # Connection is held by the task, so only query overhead is measured.
+            async with database.connection():
+                for (name, mode), operation in make_operations(import_id, database).items():
+                    assert await operation() is not None
+                    timings = []
+                    cpu_started = time.process_time()
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        await operation()
+                        timings.append(time.perf_counter() - started)
+                    cpu = (time.process_time() - cpu_started) / repeat
+                    print(
+                        f"{name:<15}{mode:<10}{citizens_num:>10}"
+                        f"{statistics.median(timings) * 1e6:>12.0f}{cpu * 1e6:>10.0f}"
+                    )
+            await analyzer.drop_import(import_id, database)
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--citizens", type=int, nargs="+", default=[100, 10_000])
+    parser.add_argument("--relations-ratio", type=float, default=0.1, help="relations per citizen")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.citizens, args.relations_ratio, args.repeat))
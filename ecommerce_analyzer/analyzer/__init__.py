@@ -1,3 +1,56 @@
 """Module with Analyzer class that implements database CRUD operations and high-level business logic."""
-__all__ = ["save_import", "get_citizens", "get_birthdays", "get_age_statistics", "patch_citizen"]
-from .analyzer import get_age_statistics, get_birthdays, get_citizens, patch_citizen, save_import
+__all__ = [
+    "IMPORTS_CHANNEL",
+    "IMPORT_DROPPED",
+    "CitizenNotFoundError",
+    "IngestMethod",
+    "ImportProgress",
+    "save_import",
+    "save_import_stream",
+    "clone_import",
+    "drop_import",
+    "check_aggregates",
+    "get_import_version",
+    "get_citizens",
+    "iter_citizens",
+    "iter_changes",
+    "get_birthdays",
+    "get_age_statistics",
+    "patch_citizen",
+    "patch_citizens",
+    "iter_citizens_document",
+    "get_birthdays_document",
+    "get_age_statistics_document",
+    "SummaryPart",
+    "iter_summary_document",
+    "CONFLICT_ERRORS",
+    "ConflictError",
+]
+from .analyzer import (
+    IMPORT_DROPPED,
+    IMPORTS_CHANNEL,
+    CitizenNotFoundError,
+    ImportProgress,
+    IngestMethod,
+    check_aggregates,
+    clone_import,
+    drop_import,
+    get_age_statistics,
+    get_birthdays,
+    get_citizens,
+    get_import_version,
+    iter_changes,
+    iter_citizens,
+    patch_citizen,
+    patch_citizens,
+    save_import,
+    save_import_stream,
+)
+from .documents import (
+    SummaryPart,
+    get_age_statistics_document,
+    get_birthdays_document,
+    iter_citizens_document,
+    iter_summary_document,
+)
+from .retries import CONFLICT_ERRORS, ConflictError
@@ -0,0 +1,78 @@
+"""Aggregates of import that answer analytical queries without scanning its citizens."""
+from __future__ import annotations
+
+from bisect import bisect_right
+from collections import Counter
+from datetime import date
+from itertools import accumulate
+from math import ceil, floor
+from typing import Any, Iterable, Iterator, List, Sequence, Tuple
+
+PERCENTILES = {"p50": 0.5, "p75": 0.75, "p99": 0.99}
+
+
+class ImportAggregates:
+    """Presents citizens buy by months and number of citizens by town and birth date.
+
+    Counters may be negative, which allows to use the object as a difference between two states of import.
+    """
+
+    def __init__(self: ImportAggregates) -> None:
+        """Initialize empty aggregates."""
+        # (citizen_id, month) -> presents
+        self.presents: Counter = Counter()
+        # (town, birth_date) -> citizens
+        self.birth_dates: Counter = Counter()
+
+    def add(self: ImportAggregates, town: str, birth_date: date, relatives: Iterable[int], count: int = 1) -> None:
+        """Account citizen, every relative buys it a present in the month of its birthday."""
+        for relative_id in relatives:
+            self.presents[relative_id, birth_date.month] += count
+        self.birth_dates[town, birth_date] += count
+
+    def add_present(self: ImportAggregates, citizen_id: int, relative_birth_date: date, count: int = 1) -> None:
+        """Account present citizen buys to its relative."""
+        self.presents[citizen_id, relative_birth_date.month] += count
+
+    def track(self: ImportAggregates, citizens_list: Iterable[Any]) -> Iterator[Any]:
+        """Account citizens as they are consumed."""
+        for citizen in citizens_list:
+            self.add(citizen.town, citizen.birth_date, citizen.relatives)
+            yield citizen
+
+    def presents_rows(self: ImportAggregates, import_id: int) -> List[Tuple[int, int, int, int]]:
+        """Rows of `presents` table, zero counters are skipped."""
+        return [(import_id, *key, count) for key, count in self.presents.items() if count]
+
+    def birth_dates_rows(self: ImportAggregates, import_id: int) -> List[Tuple[int, str, date, int]]:
+        """Rows of `town_birth_dates` table, zero counters are skipped."""
+        return [(import_id, *key, count) for key, count in self.birth_dates.items() if count]
+
+
+def percentiles_cont(values: Sequence[Tuple[float, int]], fractions: Iterable[float]) -> List[float]:
+    """Continuous percentiles of values given with their counts, computed the same way as PostgreSQL does it.
+
+    Takes O(len(values)) time to accumulate counts, positions are found by binary search.
+
+    Args:
+        values: sorted pairs of value and number of its occurrences.
+        fractions: percentiles, between 0 and 1.
+    """
+    # Values with cumulative counts less or equal to index are before it in sorted list.
+    cumulative = list(accumulate(count for _, count in values))
+
+    def value_at(index: int) -> float:
+        return values[bisect_right(cumulative, index)][0]
+
+    result = []
+    for fraction in fractions:
+        position = fraction * (cumulative[-1] - 1)
+        lower, upper = floor(position), ceil(position)
+        first = value_at(lower)
+        result.append(first if lower == upper else first + (value_at(upper) - first) * (position - lower))
+    return result
+
+
+def percentile_cont(values: Sequence[Tuple[float, int]], fraction: float) -> float:
+    """Continuous percentile of values given with their counts, see `percentiles_cont`."""
+    return percentiles_cont(values, [fraction])[0]
@@ -1,221 +1,1000 @@
 """Analyzer class implements database CRUD operations and high-level business logic."""
 from __future__ import annotations
 
-from typing import List, Union
+import asyncio
+import contextvars
+import json
+from datetime import date
+from enum import Enum
+from itertools import chain
+from operator import attrgetter
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from aiomisc import chunk_list
-from api.scheme import CitizenPatch, Import
+from api.columns import ImportColumns
+from api.scheme import Citizen, CitizenPatch, CitizenPatchItem, Import, JobPhase
 from databases import Database
-from db import citizens, imports, relations
+from db import citizen_changes, citizens, import_jobs, imports, presents, town_birth_dates
 from db.settings import MAX_QUERY_ARGS
-from sqlalchemy import Integer, and_, cast, func, or_
-from sqlalchemy.dialects.postgresql import ARRAY
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.sql import select
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    Integer,
+    String,
+    Table,
+    and_,
+    any_,
+    bindparam,
+    case,
+    cast,
+    column,
+    func,
+    literal,
+    literal_column,
+    true,
+    union,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, array, insert
+from sqlalchemy.sql import Alias, Select, TableClause, select
+from sqlalchemy.sql import table as sa_table
+from sqlalchemy.sql.elements import BindParameter
 
+from .aggregates import PERCENTILES, ImportAggregates, percentiles_cont
+from .metrics import timed
+from .retries import ConflictError, retry_conflicts
+from .statements import Statement
 
-def make_citizens_rows(import_obj: Import, import_id: int) -> List[dict]:
-    """Generate ready for insert citizens objects."""
-    for citizen in import_obj.data:
-        citizen_obj = citizen.dict(exclude_none=True)
-        del citizen_obj["relatives"]
-        citizen_obj["import_id"] = import_id
-        yield citizen_obj
+# Channel of notifications `<import_id>:<version>` sent when import is changed and `<import_id>:<IMPORT_DROPPED>`
+# sent when it is deleted.
+IMPORTS_CHANNEL = "imports"
+IMPORT_DROPPED = "dropped"
+# Classes of transaction-level advisory locks: publishing of imports is serialized, import is locked by id in shared
+# mode while it is cloned and in exclusive mode while it is dropped.
+PUBLISH_LOCK = 1
+IMPORT_LOCK = 2
 
 
-def make_relations_rows(import_obj: Import, import_id: int) -> List[dict]:
-    """Generate ready for insert relations objects."""
-    for citizen in import_obj.data:
-        for relative in citizen.relatives:
-            relation_obj = dict(import_id=import_id, citizen=citizen.citizen_id, relative=relative)
-            yield relation_obj
+class CitizenNotFoundError(ValueError):
+    """There is no citizen with such id in import."""
 
 
-async def save_import(import_obj: Import, database: Database) -> Union[int, None]:
-    """Create import and corresponding citizens and relations."""
+class IngestMethod(str, Enum):
+    """Strategy used to write import rows into the database."""
+
+    copy = "copy"
+    insert = "insert"
+    parallel = "parallel"
+
+
+class ImportProgress:
+    """Progress of import that is being saved, updated by `save_import` as rows are written."""
+
+    def __init__(self: ImportProgress) -> None:
+        """Initialize progress of not yet started import."""
+        self.phase = JobPhase.queued
+        self.rows_written = 0
+
+    def track(self: ImportProgress, phase: JobPhase, rows: Iterable[tuple]) -> Iterable[tuple]:
+        """Switch to the phase and count rows as they are consumed by writer."""
+        self.phase = phase
+        for row in rows:
+            self.rows_written += 1
+            yield row
+
+
+CITIZENS_COLUMNS = [column.name for column in citizens.columns]
+get_citizen_fields = attrgetter(*[column for column in CITIZENS_COLUMNS if column != "import_id"])
+
+
+def make_citizens_rows(citizens_list: Iterable[Citizen], import_id: int) -> Iterable[Tuple[Any, ...]]:
+    """Generate ready for insert citizens rows, values are ordered as `CITIZENS_COLUMNS`."""
+    for citizen in citizens_list:
+        yield (import_id, *get_citizen_fields(citizen))
+
+
+async def _insert_rows(table: Any, rows: Iterable[tuple], database: Database) -> None:
+    """Write rows with chunked multi-row INSERT statements."""
+    columns = [column.name for column in table.columns]
+    max_rows_per_insert = MAX_QUERY_ARGS // len(columns)
+    insert_query = table.insert()
+    for chunk in chunk_list(rows, max_rows_per_insert):
+        await database.execute(insert_query.values([dict(zip(columns, row)) for row in chunk]))
+
+
+async def _copy_rows(table: Any, rows: Iterable[tuple], database: Database) -> None:
+    """Stream rows to the table through the binary COPY protocol."""
+    columns = [column.name for column in table.columns]
+    connection = database.connection().raw_connection
+    await connection.copy_records_to_table(table.name, records=rows, columns=columns)
+
+
+async def _supports_copy(database: Database) -> bool:
+    """Check that database backend connection is able to COPY records (asyncpg)."""
+    async with database.connection() as connection:
+        return hasattr(connection.raw_connection, "copy_records_to_table")
+
+
+async def _get_rows_writer(database: Database, method: IngestMethod) -> Callable:
+    """Choose rows writer for ingest method, COPY falls back to INSERT if backend can't do it."""
+    if method != IngestMethod.insert and await _supports_copy(database):
+        return _copy_rows
+    return _insert_rows
+
+
+# Tables that have a partition per import, in the order they are locked.
+PARTITIONED_TABLES = (citizens, presents, town_birth_dates, citizen_changes)
+# Tables with state of import, changes of import are not copied to its clones, which start from version 0.
+STATE_TABLES = PARTITIONED_TABLES[:-1]
+
+
+def _partition(table: Table, import_id: int) -> TableClause:
+    """Partition of the table that holds rows of the import."""
+    return sa_table(f"{table.name}_{import_id}", *[column(c.name, c.type) for c in table.columns])
+
+
+async def _reserve_import_id(database: Database) -> int:
+    query = select([func.nextval(func.pg_get_serial_sequence(imports.name, imports.c.import_id.name))])
+    return await database.fetch_val(query)
+
+
+async def _create_partitions(import_id: int, database: Database) -> None:
+    """Create tables for rows of the import, they become partitions when import is published.
+
+    Tables are created without indexes, primary keys are built by `_publish_import` after rows are loaded.
+    """
+    for table in PARTITIONED_TABLES:
+        partition = _partition(table, import_id)
+        await database.execute(f"CREATE TABLE {partition.name} (LIKE {table.name} INCLUDING DEFAULTS)")
+
+
+async def _drop_partitions(import_id: int, database: Database, if_exists: bool = False) -> None:
+    partitions = ", ".join(_partition(table, import_id).name for table in PARTITIONED_TABLES)
+    await database.execute(f"DROP TABLE {'IF EXISTS ' if if_exists else ''}{partitions}")
+
+
+async def _index_partitions(import_id: int, database: Database) -> None:
+    """Build primary keys of partitions and check their import id, so that attaching them builds and scans nothing."""
+    for table in PARTITIONED_TABLES:
+        partition = _partition(table, import_id)
+        primary_key = ", ".join(c.name for c in table.primary_key.columns)
+        await database.execute(f"ALTER TABLE {partition.name} ADD PRIMARY KEY ({primary_key})")
+        await database.execute(
+            f"ALTER TABLE {partition.name} ADD CONSTRAINT {partition.name}_import_id CHECK (import_id = {import_id})"
+        )
+
+
+async def _publish_import(import_id: int, database: Database) -> None:
+    """Create import and attach its partitions, must be called in transaction.
+
+    Attaching partition with a foreign key to `imports` locks it in SHARE ROW EXCLUSIVE mode till the end of
+    transaction, so that concurrent publishing deadlocks and updates of versions of other imports wait. Primary keys
+    are built before that, imports are published one by one under advisory lock, which doesn't conflict with
+    updates, and attaching only validates foreign keys.
+    """
+    await _index_partitions(import_id, database)
+    await database.execute(select([func.pg_advisory_xact_lock(PUBLISH_LOCK, 0)]))
+    await database.execute(imports.insert().values(import_id=import_id))
+    for table in PARTITIONED_TABLES:
+        partition = _partition(table, import_id)
+        await database.execute(
+            f"ALTER TABLE {table.name} ATTACH PARTITION {partition.name} FOR VALUES IN ({import_id})"
+        )
+        await database.execute(f"ALTER TABLE {partition.name} DROP CONSTRAINT {partition.name}_import_id")
+
+
+async def _write_aggregates(
+    import_id: int, aggregates: ImportAggregates, write_rows: Callable, database: Database
+) -> None:
+    await write_rows(_partition(presents, import_id), aggregates.presents_rows(import_id), database)
+    await write_rows(_partition(town_birth_dates, import_id), aggregates.birth_dates_rows(import_id), database)
+
+
+def _split(items: Sequence, parts: int) -> List[Sequence]:
+    """Split sequence into at most `parts` slices of equal size."""
+    size = max(-(-len(items) // parts), 1)
+    return [items[start : start + size] for start in range(0, len(items), size)]
+
+
+async def _gather_isolated(coros: Iterable[Awaitable]) -> None:
+    """Run coroutines concurrently, each in a task with empty context and hence with its own database connection.
+
+    If one of coroutines fails, the rest are cancelled.
+    """
+    tasks = [contextvars.Context().run(asyncio.ensure_future, coro) for coro in coros]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _copy_isolated(table: TableClause, rows: Iterable[tuple], database: Database) -> None:
+    async with database.connection():
+        await _copy_rows(table, rows, database)
+
+
+async def _save_import_parallel(
+    import_obj: Import, database: Database, connections: int, progress: Optional[ImportProgress]
+) -> int:
+    """Load import into its partitions over several connections, then publish it in one transaction.
+
+    Partitions are committed empty before load, so slices of rows are copied into them concurrently. Until import
+    is published they are not attached and invisible to readers, so import is still all-or-nothing.
+    """
+    import_id = await _reserve_import_id(database)
+    await _create_partitions(import_id, database)
+    track = progress.track if progress is not None else lambda phase, rows: rows
+    aggregates = ImportAggregates()
+    try:
+        await _gather_isolated(
+            _copy_isolated(
+                _partition(citizens, import_id),
+                track(JobPhase.citizens, make_citizens_rows(aggregates.track(part), import_id)),
+                database,
+            )
+            for part in _split(import_obj.data, connections)
+        )
+
+        async with database.transaction():
+            await _write_aggregates(import_id, aggregates, _copy_rows, database)
+            await _publish_import(import_id, database)
+    except BaseException:
+        await _drop_partitions(import_id, database, if_exists=True)
+        raise
+
+    return import_id
+
+
+@timed
+async def save_import(
+    import_obj: Import,
+    database: Database,
+    method: IngestMethod = IngestMethod.copy,
+    progress: Optional[ImportProgress] = None,
+    connections: int = 4,
+) -> Union[int, None]:
+    """Create import and corresponding citizens.
+
+    Rows are written with binary COPY when the backend supports it, multi-row INSERT is used otherwise.
+    Parallel method loads rows using up to `connections` pool connections. Aggregates of import are computed
+    while citizens rows are produced.
+    """
+    if method == IngestMethod.parallel and await _supports_copy(database):
+        return await _save_import_parallel(import_obj, database, connections, progress)
+
     async with database.transaction():
-        insert_import_query = imports.insert().values().returning(imports.c.import_id)
-        import_id = await database.fetch_val(insert_import_query)
+        import_id = await _reserve_import_id(database)
+        await _create_partitions(import_id, database)
 
         if import_obj:
+            write_rows = await _get_rows_writer(database, method)
+            aggregates = ImportAggregates()
+            citizens_rows = make_citizens_rows(aggregates.track(import_obj.data), import_id)
+            if progress is not None:
+                citizens_rows = progress.track(JobPhase.citizens, citizens_rows)
+            await write_rows(_partition(citizens, import_id), citizens_rows, database)
+            await _write_aggregates(import_id, aggregates, write_rows, database)
 
-            max_citizens_per_insert = MAX_QUERY_ARGS // len(citizens.columns)
-            citizens_rows = make_citizens_rows(import_obj, import_id)
-            chunked_citizens = chunk_list(citizens_rows, max_citizens_per_insert)
-            insert_citizens_query = citizens.insert()
-            for chunk in chunked_citizens:
-                await database.execute(insert_citizens_query.values(list(chunk)))
+        await _publish_import(import_id, database)
 
-            max_relations_per_insert = MAX_QUERY_ARGS // len(relations.columns)
-            relations_rows = make_relations_rows(import_obj, import_id)
-            chunked_relations = chunk_list(relations_rows, max_relations_per_insert)
-            insert_relations_query = relations.insert()
-            for chunk in chunked_relations:
-                await database.execute(insert_relations_query.values(list(chunk)))
+    return import_id
+
+
+@timed
+async def save_import_stream(
+    batches: AsyncIterable[List[Citizen]], database: Database, method: IngestMethod = IngestMethod.copy
+) -> int:
+    """Create import from citizens that arrive in batches.
+
+    Citizens are written as soon as their batch arrives, only their columnar representation and aggregates are
+    kept. Relations are validated after the last batch. Any exception raised by `batches` rolls the whole import
+    back.
+
+    Raises:
+        ValueError: if citizen ids are not unique or relations are not mutual.
+    """
+    async with database.transaction():
+        import_id = await _reserve_import_id(database)
+        await _create_partitions(import_id, database)
+        write_rows = await _get_rows_writer(database, method)
+        columns = ImportColumns()
+        aggregates = ImportAggregates()
+        async for batch in batches:
+            columns.extend(batch)
+            citizens_rows = make_citizens_rows(aggregates.track(batch), import_id)
+            await write_rows(_partition(citizens, import_id), citizens_rows, database)
+        columns.validate()
+        await _write_aggregates(import_id, aggregates, write_rows, database)
+        await _publish_import(import_id, database)
 
     return import_id
 
 
+@timed
+async def clone_import(import_id: int, database: Database) -> Optional[int]:
+    """Create a copy of import with new id, rows are copied between partitions by the database.
+
+    Tables of import are copied by one statement with data-modifying CTEs, so they are read from one snapshot and
+    the copy is consistent while the source import is patched.
+
+    Returns:
+        Id of the new import or None if there is no such import.
+    """
+    async with database.transaction():
+        await database.execute(select([func.pg_advisory_xact_lock_shared(IMPORT_LOCK, import_id)]))
+        if await get_import_version(import_id, database) is None:
+            return None
+        new_import_id = await _reserve_import_id(database)
+        await _create_partitions(new_import_id, database)
+        copies = []
+        for table in STATE_TABLES:
+            columns = [literal(new_import_id).label("import_id")]
+            columns.extend(c for c in table.columns if c.name != "import_id")
+            rows_query = select(columns).where(table.c.import_id == import_id)
+            partition = _partition(table, new_import_id)
+            copy = partition.insert().from_select([c.name for c in table.columns], rows_query)
+            copies.append(select([func.count()]).select_from(copy.returning(partition.c.import_id).cte()))
+        await database.execute(union_all(*copies))
+        await _publish_import(new_import_id, database)
+    return new_import_id
+
+
+async def _notify_import_changed(import_id: int, version: int, database: Database) -> None:
+    """Notify listeners of `IMPORTS_CHANNEL` about new version of import, it is delivered on commit."""
+    await database.execute(select([func.pg_notify(IMPORTS_CHANNEL, f"{import_id}:{version}")]))
+
+
+async def _notify_import_dropped(import_id: int, database: Database) -> None:
+    """Notify listeners of `IMPORTS_CHANNEL` that import is deleted, it is delivered on commit."""
+    await database.execute(select([func.pg_notify(IMPORTS_CHANNEL, f"{import_id}:{IMPORT_DROPPED}")]))
+
+
+GET_IMPORT_VERSION = Statement(select([imports.c.version]).where(imports.c.import_id == bindparam("import_id")))
+
+
+@timed
+async def get_import_version(import_id: int, database: Database) -> Optional[int]:
+    """Get version of import or None if there is no such import."""
+    return await GET_IMPORT_VERSION.fetchval(database, import_id=import_id)
+
+
+@timed
+async def drop_import(import_id: int, database: Database) -> bool:
+    """Delete import by dropping its partitions.
+
+    Listeners are notified that import is dropped, so that they forget it. Dropping partitions locks
+    partitioned tables, they are locked before `imports` in the same order as other transactions lock them.
+
+    Returns:
+        False if there is no such import.
+    """
+    async with database.transaction():
+        await database.execute(select([func.pg_advisory_xact_lock(IMPORT_LOCK, import_id)]))
+        partitioned_tables = ", ".join(table.name for table in PARTITIONED_TABLES)
+        await database.execute(f"LOCK TABLE {partitioned_tables} IN ACCESS EXCLUSIVE MODE")
+        await database.execute(f"LOCK TABLE {imports.name} IN SHARE ROW EXCLUSIVE MODE")
+        version = await get_import_version(import_id, database)
+        if version is None:
+            return False
+        await database.execute(import_jobs.update().where(import_jobs.c.import_id == import_id).values(import_id=None))
+        await _drop_partitions(import_id, database)
+        await database.execute(imports.delete().where(imports.c.import_id == import_id))
+        await _notify_import_dropped(import_id, database)
+    return True
+
+
+GET_CITIZENS = Statement(select([citizens]).where(citizens.c.import_id == bindparam("import_id")))
+
+
+@timed
 async def get_citizens(import_id: int, database: Database) -> List[dict]:
     """Get all citizens from particular import."""
-    agg_relatives = func.array_remove(func.array_agg(relations.c.relative, type_=ARRAY(Integer)), None).label(
-        "relatives"
+    rows = await GET_CITIZENS.fetch(database, import_id=import_id)
+    return [dict(row) for row in rows]
+
+
+def citizens_query(
+    import_id: int,
+    fields: Optional[Collection[str]] = None,
+    after_citizen_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> Select:
+    """Build query of citizens of particular import, page of citizens is ordered by primary key.
+
+    Args:
+        import_id: import to select citizens from.
+        fields: columns to select, `citizen_id` is always selected, all columns are selected if not given.
+        after_citizen_id: select only citizens with greater ids.
+        limit: maximum number of citizens.
+    """
+    columns = [
+        c
+        for c in citizens.columns
+        if c.name != "import_id" and (fields is None or c.name in fields or c.name == citizens.c.citizen_id.name)
+    ]
+    query = select(columns).where(citizens.c.import_id == import_id)
+    if after_citizen_id is not None:
+        query = query.where(citizens.c.citizen_id > after_citizen_id)
+    if after_citizen_id is not None or limit is not None:
+        query = query.order_by(citizens.c.citizen_id).limit(limit)
+    return query
+
+
+@timed
+async def iter_citizens(
+    import_id: int,
+    database: Database,
+    fields: Optional[Collection[str]] = None,
+    after_citizen_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> AsyncIterator[Mapping[str, Any]]:
+    """Iterate over citizens of particular import with server-side cursor, rows are not collected in memory.
+
+    Arguments are the same as of `citizens_query`.
+    """
+    async for row in database.iterate(citizens_query(import_id, fields, after_citizen_id, limit)):
+        yield row
+
+
+GET_CITIZEN = Statement(
+    select([citizens]).where(
+        and_(citizens.c.citizen_id == bindparam("citizen_id"), citizens.c.import_id == bindparam("import_id"))
     )
-    query = (
-        select([citizens, agg_relatives])
+)
+
+
+async def _get_citizen(import_id: int, citizen_id: int, database: Database) -> dict:
+    """Get one citizen from particular import."""
+    row = await GET_CITIZEN.fetchrow(database, import_id=import_id, citizen_id=citizen_id)
+    if row is None:
+        raise CitizenNotFoundError(f"Citizen {citizen_id} not found in import {import_id}")
+    return dict(row)
+
+
+def _actual_presents_query(import_id: int) -> Select:
+    """Build query of presents computed by joining citizens to their relatives."""
+    relative = citizens.alias("relative")
+    relative_id = func.unnest(citizens.c.relatives).alias("relative_id")
+    month = func.date_part("month", relative.c.birth_date)
+    return (
+        select([citizens.c.citizen_id, cast(month, Integer).label("month"), func.count().label("presents")])
         .select_from(
-            citizens.outerjoin(
-                relations,
-                and_(relations.c.import_id == citizens.c.import_id, relations.c.citizen == citizens.c.citizen_id),
+            citizens.join(relative_id, literal(True)).join(
+                relative,
+                and_(relative.c.import_id == citizens.c.import_id, relative.c.citizen_id == column(relative_id.name)),
             )
         )
         .where(citizens.c.import_id == import_id)
-        .group_by(citizens.c.import_id, citizens.c.citizen_id)
+        .group_by(citizens.c.citizen_id, month)
     )
-    rows = await database.fetch_all(query)
-    result = []
-    for row in rows:
-        result.append(dict(row))
-    return result
 
 
-async def _get_citizen(import_id: int, citizen_id: int, database: Database) -> dict:
-    """Get one citizen from particular import."""
-    agg_relatives = func.array_remove(func.array_agg(relations.c.relative, type_=ARRAY(Integer)), None).label(
-        "relatives"
+def _actual_birth_dates_query(import_id: int) -> Select:
+    """Build query of numbers of citizens by town and birth date computed from citizens."""
+    return (
+        select([citizens.c.town, citizens.c.birth_date, func.count().label("citizens")])
+        .where(citizens.c.import_id == import_id)
+        .group_by(citizens.c.town, citizens.c.birth_date)
     )
-    query = (
-        select([citizens, agg_relatives])
-        .select_from(
-            citizens.outerjoin(
-                relations,
-                and_(citizens.c.import_id == relations.c.import_id, citizens.c.citizen_id == relations.c.citizen),
-            )
-        )
-        .where(and_(citizens.c.citizen_id == citizen_id, citizens.c.import_id == import_id))
-        .group_by(citizens.c.import_id, citizens.c.citizen_id)
+
+
+@timed
+async def check_aggregates(import_id: int, database: Database) -> ImportAggregates:
+    """Compare stored aggregates of import with ones computed from its citizens by joins.
+
+    Both are read from one snapshot, so the check may run while import is changed.
+
+    Returns:
+        difference between stored and actual counters, it is empty if aggregates are consistent.
+    """
+    difference = ImportAggregates()
+    checks = (
+        (presents, presents.c.presents, _actual_presents_query(import_id), difference.presents),
+        (town_birth_dates, town_birth_dates.c.citizens, _actual_birth_dates_query(import_id), difference.birth_dates),
     )
-    row = await database.fetch_one(query)
-    return dict(row)
+    async with database.transaction(isolation="repeatable_read", readonly=True):
+        for table, counter, actual_query, counters in checks:
+            stored = select(table.columns).where(table.c.import_id == import_id).alias("stored")
+            actual = actual_query.alias("actual")
+            keys = [c.name for c in table.primary_key.columns if c.name != "import_id"]
+            stored_count = func.coalesce(stored.c[counter.name], 0)
+            actual_count = func.coalesce(actual.c[counter.name], 0)
+            query = (
+                select([*(func.coalesce(stored.c[key], actual.c[key]) for key in keys), stored_count - actual_count])
+                .select_from(
+                    stored.outerjoin(actual, and_(*(stored.c[key] == actual.c[key] for key in keys)), full=True)
+                )
+                .where(stored_count != actual_count)
+            )
+            for row in await database.fetch_all(query):
+                counters[tuple(row[i] for i in range(len(keys)))] = row[len(keys)]
+    return difference
 
 
-async def _add_relatives(import_id: int, citizen_id: int, relatives: List[int], database: Database) -> None:
-    relations_rows = []
-    for relative in relatives:
-        relations_rows.append(dict(import_id=import_id, citizen=citizen_id, relative=relative))
-        if relative != citizen_id:
-            relations_rows.append(dict(import_id=import_id, citizen=relative, relative=citizen_id))
-    try:
-        query = relations.insert().values(relations_rows)
-        await database.execute(query)
-    except IntegrityError:
-        raise ValueError("Can't save relatives, some of provided relatives don't exists")
+def _month(birth_date: Any) -> Any:
+    return cast(func.date_part("month", birth_date), Integer)
 
 
-async def _remove_relatives(import_id: int, citizen_id: int, relatives: List[int], database: Database) -> None:
-    for relative in relatives:
-        query = relations.delete().where(
-            or_(
-                and_(
-                    relations.c.import_id == import_id,
-                    relations.c.citizen == citizen_id,
-                    relations.c.relative == relative,
-                ),
-                and_(
-                    relations.c.import_id == import_id,
-                    relations.c.citizen == relative,
-                    relations.c.relative == citizen_id,
+def _count(count: int) -> Any:
+    return literal_column(str(count), Integer).label("count")
+
+
+def _unnest(relatives: Any) -> Select:
+    return select([func.unnest(relatives).label("citizen_id")])
+
+
+def _patch_citizen_query() -> Select:
+    """Build query that patches citizen, its relatives, aggregates and version of import in one statement.
+
+    Parameters are `import_id`, `citizen_id` and new values of citizen columns, None keeps the current value.
+    Changes of citizens are logged in `citizen_changes`, the query returns their number in `logged` column.
+    Nothing is changed if some of added relatives don't exist or were not locked, the query returns false in
+    `relatives_exist` or `relatives_locked` column then. The query returns no rows if there is no such citizen.
+    """
+    import_id, citizen_id = bindparam("import_id", type_=Integer), bindparam("citizen_id", type_=Integer)
+    values = {
+        c.name: bindparam(c.name, type_=c.type) for c in citizens.columns if c.name not in ("import_id", "citizen_id")
+    }
+
+    # Citizen and all its former and new relatives are locked in order of ids before they are changed, so that
+    # concurrent patches of related citizens don't deadlock. Former relatives are taken from snapshot before lock.
+    # Ids are collected by one subquery, so that rows are found by primary key. Types of parameters are not inferred
+    # from `unnest`, they are cast.
+    former = citizens.alias("former")
+    locked_ids = union(
+        select([citizen_id.label("citizen_id")]),
+        _unnest(cast(values["relatives"], ARRAY(Integer))),
+        _unnest(former.c.relatives).where(and_(former.c.import_id == import_id, former.c.citizen_id == citizen_id)),
+    )
+    locked = (
+        select([citizens])
+        .where(and_(citizens.c.import_id == import_id, citizens.c.citizen_id.in_(locked_ids)))
+        .order_by(citizens.c.citizen_id)
+        .with_for_update()
+        .cte("locked")
+    )
+    old = select(list(locked.columns)).where(locked.c.citizen_id == citizen_id).cte("old_citizen")
+    new = select([func.coalesce(value, old.c[name]).label(name) for name, value in values.items()]).cte("new_citizen")
+    added_ids = _unnest(new.c.relatives).except_(_unnest(old.c.relatives)).cte("added_ids")
+    removed_ids = _unnest(old.c.relatives).except_(_unnest(new.c.relatives)).cte("removed_ids")
+    # Checks read all locked rows before any row is changed, so all of them are locked by then. Citizen could get
+    # new relatives after snapshot was taken, they are not locked and the query should be run again then.
+    existing = select([func.count()]).where(locked.c.citizen_id.in_(select([added_ids.c.citizen_id])))
+    unlocked = select([func.count()]).where(removed_ids.c.citizen_id.notin_(select([locked.c.citizen_id])))
+    checked = (
+        select(
+            [
+                (existing.as_scalar() == select([func.count()]).select_from(added_ids).as_scalar()).label(
+                    "relatives_exist"
                 ),
-            )
+                (unlocked.as_scalar() == 0).label("relatives_locked"),
+            ]
         )
-        await database.execute(query)
-
+        .select_from(old)
+        .cte("checked")
+    )
+    ok = select([and_(checked.c.relatives_exist, checked.c.relatives_locked)]).as_scalar()
 
-async def _update_citizen(import_id: int, citizen_id: int, citizen_patch: CitizenPatch, database: Database) -> None:
-    new_citizen_data = citizen_patch.dict(exclude_none=True)
-    try:
-        new_citizen_data.pop("relatives")
-    except KeyError:
-        pass
-    if len(new_citizen_data) > 0:
-        query = (
+    # Relation is stored in both citizens, relatives return their birth dates to account presents citizen buys them.
+    def update_relatives(ids: Any, relatives: Any, name: str) -> Any:
+        return (
             citizens.update()
-            .where(and_(citizens.c.import_id == import_id, citizens.c.citizen_id == citizen_id))
-            .values(new_citizen_data)
+            .where(
+                and_(
+                    citizens.c.import_id == import_id,
+                    citizens.c.citizen_id.in_(select([ids.c.citizen_id])),
+                    citizens.c.citizen_id != citizen_id,
+                    ok,
+                )
+            )
+            .values(relatives=relatives)
+            .returning(citizens.c.citizen_id, citizens.c.birth_date)
+            .cte(name)
         )
-        await database.execute(query)
 
+    added = update_relatives(added_ids, func.array_append(citizens.c.relatives, citizen_id), "added")
+    removed = update_relatives(removed_ids, func.array_remove(citizens.c.relatives, citizen_id), "removed")
+    patched = (
+        citizens.update()
+        .where(and_(citizens.c.import_id == import_id, citizens.c.citizen_id == citizen_id, ok))
+        .values({name: func.coalesce(value, citizens.c[name]) for name, value in values.items()})
+        .returning(*citizens.columns)
+        .cte("patched")
+    )
 
-async def patch_citizen(import_id: int, citizen_id: int, citizen_patch: CitizenPatch, database: Database) -> dict:
-    """Update citizen."""
-    async with database.transaction():
-        await _update_citizen(import_id, citizen_id, citizen_patch, database)
+    # Aggregates are changed by the difference between old and new state of citizen, see `ImportAggregates.add`.
+    presents_delta = union_all(
+        select([func.unnest(old.c.relatives).label("citizen_id"), _month(old.c.birth_date).label("month"), _count(-1)]),
+        select([func.unnest(new.c.relatives), _month(new.c.birth_date), _count(1)]),
+        select([citizen_id, _month(added.c.birth_date), _count(1)]),
+        select([citizen_id, _month(removed.c.birth_date), _count(-1)]),
+    ).alias("presents_delta")
+    birth_dates_delta = union_all(
+        select([old.c.town, old.c.birth_date, _count(-1)]),
+        select([new.c.town, new.c.birth_date, _count(1)]),
+    ).alias("birth_dates_delta")
+    upserted = []
+    for table, delta, counter in (
+        (presents, presents_delta, presents.c.presents),
+        (town_birth_dates, birth_dates_delta, town_birth_dates.c.citizens),
+    ):
+        keys = [c for c in delta.columns if c.name != "count"]
+        total = func.sum(delta.c.count)
+        # Rows are inserted and locked in order of primary key.
+        rows = select([import_id, *keys, total]).where(ok).group_by(*keys).having(total != 0).order_by(*keys)
+        query = insert(table).from_select([c.name for c in table.columns], rows)
+        query = query.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns), set_={counter.name: counter + query.excluded[counter.name]}
+        )
+        upserted.append(query.returning(counter).cte(f"{table.name}_upserted"))
+
+    # Upserted rows are counted before version is incremented, so that import row is locked after all other rows and
+    # concurrent patches of one import don't deadlock on it.
+    upserted_counted = [select([func.count()]).select_from(cte).as_scalar() >= 0 for cte in upserted]
+    version = (
+        imports.update()
+        .where(and_(imports.c.import_id == import_id, ok, *upserted_counted))
+        .values(version=imports.c.version + 1)
+        .returning(imports.c.version)
+        .cte("version")
+    )
 
-        if isinstance(citizen_patch.relatives, list):
-            curr_relatives_query = select([relations]).where(
-                and_(relations.c.import_id == import_id, relations.c.citizen == citizen_id)
+    # Changes are logged with the new version: given values of citizen and ids added to and removed from relatives
+    # of citizen and of its relatives. Parameters are cast, so that their types are known to `jsonb_build_object`.
+    fields = func.jsonb_strip_nulls(
+        func.jsonb_build_object(
+            *chain.from_iterable(
+                (literal_column(f"'{name}'"), cast(value, citizens.c[name].type))
+                for name, value in values.items()
+                if name != "relatives"
             )
-            current_relatives = await database.fetch_all(curr_relatives_query)
-            current_relatives = [r["relative"] for r in current_relatives]
-            relatives_to_add = [r for r in citizen_patch.relatives if r not in current_relatives]
-            if relatives_to_add:
-                await _add_relatives(import_id, citizen_id, relatives_to_add, database)
+        )
+    )
+    no_fields, no_ids = literal_column("'{}'::jsonb"), cast(array([]), ARRAY(Integer))
+    changes = union_all(
+        select(
+            [
+                citizen_id.label("citizen_id"),
+                fields.label("fields"),
+                func.array(select([added_ids.c.citizen_id]).as_scalar()).label("relatives_added"),
+                func.array(select([removed_ids.c.citizen_id]).as_scalar()).label("relatives_removed"),
+            ]
+        ),
+        select([added.c.citizen_id, no_fields, array([citizen_id]), no_ids]),
+        select([removed.c.citizen_id, no_fields, no_ids, array([citizen_id])]),
+    ).alias("changes")
+    logged = (
+        insert(citizen_changes)
+        .from_select(
+            [c.name for c in citizen_changes.columns],
+            select([import_id, version.c.version, *changes.columns]).select_from(version.join(changes, true())),
+        )
+        .returning(citizen_changes.c.citizen_id)
+        .cte("logged")
+    )
 
-            relatives_to_remove = [r for r in current_relatives if r not in citizen_patch.relatives]
-            if relatives_to_remove:
-                await _remove_relatives(import_id, citizen_id, relatives_to_remove, database)
+    payload = cast(import_id, String) + ":" + cast(version.c.version, String)
+    notified = case([(version.c.version.isnot(None), func.pg_notify(IMPORTS_CHANNEL, payload))])
+    return select(
+        [
+            checked.c.relatives_exist,
+            checked.c.relatives_locked,
+            *patched.columns,
+            notified.label("notified"),
+            select([func.count()]).select_from(logged).as_scalar().label("logged"),
+        ]
+    ).select_from(checked.outerjoin(patched, true()).outerjoin(version, true()))
 
-    citizen = await _get_citizen(import_id=import_id, citizen_id=citizen_id, database=database)
-    return citizen
 
+PATCH_CITIZEN = Statement(_patch_citizen_query())
 
-async def get_birthdays(import_id: int, database: Database) -> dict:
-    """Get number of birthdays by every month for particular import."""
-    agg_presents = func.count(relations.c.relative).label("presents")
 
-    month = func.date_part("month", citizens.c.birth_date)
-    month = cast(month, Integer).label("month")
+@timed
+@retry_conflicts()
+async def patch_citizen(import_id: int, citizen_id: int, citizen_patch: CitizenPatch, database: Database) -> dict:
+    """Update citizen.
+
+    Relation is stored in both citizens, so relatives that are added or removed are updated as well. Aggregates
+    of import are updated with the difference between old and new state of citizen, version of import is
+    incremented. Everything is done by one statement, see `_patch_citizen_query`, it is retried after deadlock.
+
+    Raises:
+        CitizenNotFoundError: if there is no such citizen in import.
+        ValueError: if some of relatives don't exist.
+    """
+    values = citizen_patch.dict(exclude={"citizen_id"})
+    row = await PATCH_CITIZEN.fetchrow(database, import_id=import_id, citizen_id=citizen_id, **values)
+    if row is None:
+        raise CitizenNotFoundError(f"Citizen {citizen_id} not found in import {import_id}")
+    if not row["relatives_locked"]:
+        raise ConflictError(f"Relatives of citizen {citizen_id} were changed by concurrent transaction")
+    if not row["relatives_exist"]:
+        raise ValueError("Can't save relatives, some of provided relatives don't exists")
+    return {c.name: row[c.name] for c in citizens.columns}
+
+
+def _json_rows(table: Table, name: str) -> Alias:
+    """Build subquery of rows of table given as JSON array of objects by parameter `name`, absent keys are NULL."""
+    rows = func.jsonb_populate_recordset(literal_column(f"NULL::{table.name}"), bindparam(name))
+    return select([column(c.name, c.type) for c in table.columns]).select_from(rows).alias(name)
+
+
+def _encode_rows(rows: Iterable[Mapping[str, Any]]) -> str:
+    return json.dumps([dict(row) for row in rows], ensure_ascii=False, default=str)
+
+
+_former = citizens.alias("former")
+# Citizens and relatives of patched ones are locked in order of ids, so that concurrent patches don't deadlock.
+LOCK_CITIZENS = Statement(
+    select([citizens])
+    .where(
+        and_(
+            citizens.c.import_id == bindparam("import_id"),
+            citizens.c.citizen_id.in_(
+                union(
+                    _unnest(cast(bindparam("citizen_ids"), ARRAY(Integer))),
+                    _unnest(_former.c.relatives).where(
+                        and_(
+                            _former.c.import_id == bindparam("import_id"),
+                            _former.c.citizen_id == any_(bindparam("patched_ids", type_=ARRAY(Integer))),
+                        )
+                    ),
+                )
+            ),
+        )
+    )
+    .order_by(citizens.c.citizen_id)
+    .with_for_update()
+)
+_citizens_rows = _json_rows(citizens, "rows")
+UPDATE_CITIZENS = Statement(
+    citizens.update()
+    .where(and_(citizens.c.import_id == bindparam("import_id"), citizens.c.citizen_id == _citizens_rows.c.citizen_id))
+    .values({c.name: _citizens_rows.c[c.name] for c in citizens.columns if c.name not in ("import_id", "citizen_id")})
+    .returning(*citizens.columns)
+)
+
+
+def _upsert_counters(table: Table, counter: Column) -> Statement:
+    """Build statement that adds counters given by JSON rows to stored ones, rows are locked in order of key."""
+    rows = _json_rows(table, "rows")
+    ordered = select(list(rows.columns)).order_by(*(rows.c[c.name] for c in table.primary_key.columns))
+    query = insert(table).from_select([c.name for c in table.columns], ordered)
+    query = query.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns), set_={counter.name: counter + query.excluded[counter.name]}
+    )
+    return Statement(query)
+
+
+UPSERT_PRESENTS = _upsert_counters(presents, presents.c.presents)
+UPSERT_BIRTH_DATES = _upsert_counters(town_birth_dates, town_birth_dates.c.citizens)
+INCREMENT_VERSION = Statement(
+    imports.update()
+    .where(imports.c.import_id == bindparam("import_id"))
+    .values(version=imports.c.version + 1)
+    .returning(imports.c.version)
+)
+LOG_CHANGES = Statement(
+    insert(citizen_changes).from_select(
+        [c.name for c in citizen_changes.columns], select(list(_json_rows(citizen_changes, "rows").columns))
+    )
+)
+
+
+def _apply_patches(
+    patches: Iterable[CitizenPatchItem], patched: Mapping[int, dict]
+) -> Tuple[Dict[int, List[int]], Dict[int, List[int]]]:
+    """Apply patches to states of patched citizens in the given order, as if citizens were patched one by one.
+
+    Other citizens are changed only by relations with patched citizens, relation is mutual, so their final relations
+    are given by final relatives of patched citizens.
+
+    Returns:
+        Ids of patched citizens added to and removed from relatives of other citizens by ids of other citizens.
+    """
+    original = {citizen_id: set(citizen["relatives"]) for citizen_id, citizen in patched.items()}
+    for patch in patches:
+        citizen = patched[patch.citizen_id]
+        values = patch.dict(exclude_none=True, exclude={"citizen_id"})
+        if "relatives" in values:
+            current, relatives = set(citizen["relatives"]), set(values["relatives"])
+            for relative_id in relatives - current - {patch.citizen_id}:
+                if relative_id in patched:
+                    patched[relative_id]["relatives"].append(patch.citizen_id)
+            for relative_id in current - relatives - {patch.citizen_id}:
+                if relative_id in patched:
+                    patched[relative_id]["relatives"].remove(patch.citizen_id)
+        citizen.update(values)
+
+    added: Dict[int, List[int]] = {}
+    removed: Dict[int, List[int]] = {}
+    for citizen_id, citizen in patched.items():
+        relatives = set(citizen["relatives"])
+        for relative_id in relatives - original[citizen_id]:
+            if relative_id not in patched:
+                added.setdefault(relative_id, []).append(citizen_id)
+        for relative_id in original[citizen_id] - relatives:
+            if relative_id not in patched:
+                removed.setdefault(relative_id, []).append(citizen_id)
+    return added, removed
+
+
+def _changes_rows(
+    import_id: int, version: int, patches: Iterable[CitizenPatchItem], old: Mapping[int, dict], new: Mapping[int, dict]
+) -> Iterable[dict]:
+    """Generate `citizen_changes` rows of all changed citizens, given values of patched ones are merged in order."""
+    fields: Dict[int, dict] = {citizen_id: {} for citizen_id in new}
+    for patch in patches:
+        fields[patch.citizen_id].update(patch.dict(exclude_none=True, exclude={"citizen_id", "relatives"}))
+    for citizen_id, citizen in new.items():
+        before, after = set(old[citizen_id]["relatives"]), set(citizen["relatives"])
+        yield {
+            "import_id": import_id,
+            "version": version,
+            "citizen_id": citizen_id,
+            "fields": fields[citizen_id],
+            "relatives_added": sorted(after - before),
+            "relatives_removed": sorted(before - after),
+        }
 
-    query = (
-        select([month, relations.c.citizen.label("citizen_id"), agg_presents])
-        .select_from(
-            citizens.join(
-                relations,
-                and_(relations.c.import_id == citizens.c.import_id, relations.c.relative == citizens.c.citizen_id,),
-            )
+
+async def _update_aggregates(import_id: int, aggregates: ImportAggregates, database: Database) -> None:
+    """Add difference of aggregates to stored ones."""
+    for table, statement, rows in (
+        (presents, UPSERT_PRESENTS, aggregates.presents_rows(import_id)),
+        (town_birth_dates, UPSERT_BIRTH_DATES, aggregates.birth_dates_rows(import_id)),
+    ):
+        if rows:
+            columns = [c.name for c in table.columns]
+            await statement.fetch(database, rows=_encode_rows(dict(zip(columns, row)) for row in rows))
+
+
+@timed
+@retry_conflicts()
+async def patch_citizens(import_id: int, patches: Sequence[CitizenPatchItem], database: Database) -> List[dict]:
+    """Update many citizens in one transaction, result is the same as if patches were applied one by one.
+
+    Patched citizens and their former and new relatives are locked and read by one query, new states of patched
+    citizens and of citizens whose relatives change are computed in Python and written by one statement.
+    Aggregates of import are updated with the difference between old and new states of all changed citizens,
+    version of import is incremented once and all changes are logged with it. Transaction is retried after deadlock.
+
+    Returns:
+        Patched citizens in order of their first patches.
+    """
+    citizen_ids = list(dict.fromkeys(patch.citizen_id for patch in patches))
+    # Relatives already stored exist, so it is enough to check all relatives given by patches.
+    given = {relative_id for patch in patches for relative_id in patch.relatives or ()}
+    async with database.transaction():
+        rows = await LOCK_CITIZENS.fetch(
+            database, import_id=import_id, citizen_ids=[*citizen_ids, *given], patched_ids=citizen_ids
         )
-        .where(relations.c.import_id == import_id)
-        .group_by(month, relations.c.citizen,)
+        stored = {row["citizen_id"]: row for row in rows}
+        for citizen_id in citizen_ids:
+            if citizen_id not in stored:
+                raise CitizenNotFoundError(f"Citizen {citizen_id} not found in import {import_id}")
+        if not given.issubset(stored):
+            raise ValueError("Can't save relatives, some of provided relatives don't exists")
+        old = {citizen_id: dict(stored[citizen_id]) for citizen_id in citizen_ids}
+        new = {citizen_id: {**citizen, "relatives": list(citizen["relatives"])} for citizen_id, citizen in old.items()}
+        added, removed = _apply_patches(patches, new)
+
+        # Relatives to lock are read from snapshot, patched citizens could get new ones before they were locked.
+        if not stored.keys() >= removed.keys():
+            raise ConflictError("Relatives of patched citizens were changed by concurrent transaction")
+        for citizen_id in added.keys() | removed.keys():
+            old[citizen_id] = dict(stored[citizen_id])
+            removed_ids = removed.get(citizen_id, ())
+            relatives = [r for r in old[citizen_id]["relatives"] if r not in removed_ids] + added.get(citizen_id, [])
+            new[citizen_id] = {**old[citizen_id], "relatives": relatives}
+
+        aggregates = ImportAggregates()
+        for citizen_id, citizen in new.items():
+            aggregates.add(old[citizen_id]["town"], old[citizen_id]["birth_date"], old[citizen_id]["relatives"], -1)
+            aggregates.add(citizen["town"], citizen["birth_date"], citizen["relatives"])
+        rows = await UPDATE_CITIZENS.fetch(database, import_id=import_id, rows=_encode_rows(new.values()))
+        await _update_aggregates(import_id, aggregates, database)
+        version = await INCREMENT_VERSION.fetchval(database, import_id=import_id)
+        changes = _changes_rows(import_id, version, patches, old, new)
+        await LOG_CHANGES.fetch(database, rows=_encode_rows(changes))
+        await _notify_import_changed(import_id, version, database)
+
+    updated = {row["citizen_id"]: dict(row) for row in rows}
+    return [updated[citizen_id] for citizen_id in citizen_ids]
+
+
+@timed
+async def iter_changes(import_id: int, database: Database, since: int = 0) -> AsyncIterator[Mapping[str, Any]]:
+    """Iterate over changes of citizens of import made after its version `since`, in order of versions.
+
+    Changes are read with server-side cursor, so they are not collected in memory. Changes made by one patch have
+    the same version, which is greater than versions of earlier patches.
+    """
+    query = (
+        select([c for c in citizen_changes.columns if c.name != "import_id"])
+        .where(and_(citizen_changes.c.import_id == import_id, citizen_changes.c.version > since))
+        .order_by(citizen_changes.c.version, citizen_changes.c.citizen_id)
     )
-    res = {str(i): [] for i in range(1, 13)}
     async for row in database.iterate(query):
+        yield row
+
+
+GET_BIRTHDAYS = Statement(
+    select([presents.c.month, presents.c.citizen_id, presents.c.presents])
+    .where(and_(presents.c.import_id == bindparam("import_id"), presents.c.presents > 0))
+    .order_by(presents.c.citizen_id)
+)
+
+
+@timed
+async def get_birthdays(import_id: int, database: Database) -> dict:
+    """Get number of birthdays by every month for particular import.
+
+    Every citizen buys a present to each of its relatives in the month of relative's birthday.
+    """
+    res = {str(i): [] for i in range(1, 13)}
+    for row in await GET_BIRTHDAYS.fetch(database, import_id=import_id):
         month = str(row[0])
         res[month].append({"citizen_id": row[1], "presents": row[2]})
     return res
 
 
-async def get_age_statistics(import_id: int, database: Database) -> List[dict]:
-    """Get age percentiles by each town."""
-    age = func.date_part("year", func.age(citizens.c.birth_date)).label("age")
-    query = (
-        select(
-            [
-                citizens.c.town,
-                func.percentile_cont(0.5).within_group(age).label("p50"),
-                func.percentile_cont(0.75).within_group(age).label("p75"),
-                func.percentile_cont(0.99).within_group(age).label("p99"),
-            ]
+def ages_query(import_id: Union[int, BindParameter], as_of: Union[date, BindParameter]) -> Select:
+    """Build query of number of citizens by town and age at `as_of` date, arguments can be bound parameters.
+
+    Ages are computed from numbers of citizens by birth dates, which don't change over time, so the query reads
+    at most one row per distinct birth date of town. Citizens born after `as_of` are skipped.
+    """
+    birth_date = town_birth_dates.c.birth_date
+    # Date is cast explicitly, so that its parameter has the same type in both places it is used.
+    as_of_date = cast(as_of, Date)
+    age = func.date_part("year", func.age(cast(as_of_date, DateTime), cast(birth_date, DateTime)))
+    return (
+        select([town_birth_dates.c.town, age.label("age"), func.sum(town_birth_dates.c.citizens).label("citizens")])
+        .where(
+            and_(town_birth_dates.c.import_id == import_id, town_birth_dates.c.citizens > 0, birth_date <= as_of_date)
         )
-        .where(citizens.c.import_id == import_id)
-        .group_by(citizens.c.town)
+        .group_by(town_birth_dates.c.town, age)
     )
+
+
+_ages_query = ages_query(bindparam("import_id"), bindparam("as_of"))
+GET_AGES = Statement(_ages_query.order_by(_ages_query.c.town, _ages_query.c.age))
+
+
+@timed
+async def get_age_statistics(import_id: int, database: Database, as_of: Optional[date] = None) -> List[dict]:
+    """Get age percentiles by each town.
+
+    Args:
+        import_id: import to get statistics of.
+        database: database to query.
+        as_of: date to compute ages at, today by default.
+    """
+    ages_by_town = {}
+    for row in await GET_AGES.fetch(database, import_id=import_id, as_of=as_of or date.today()):
+        ages_by_town.setdefault(row[0], []).append((row[1], row[2]))
     res = []
-    async for row in database.iterate(query):
-        obj = {
-            "town": row[0],
-            "p50": row[1],
-            "p75": row[2],
-            "p99": row[3],
-        }
+    for town, ages in ages_by_town.items():
+        obj = {"town": town, **dict(zip(PERCENTILES, percentiles_cont(ages, PERCENTILES.values())))}
         res.append(obj)
     return res
@@ -0,0 +1,197 @@
+"""Response documents of read endpoints built by the database.
+
+Documents are rendered to JSON text and encoded by PostgreSQL, so rows are not decoded into Python objects and
+documents are sent to clients as they are. They are equal to documents rendered from `api.scheme` models, but
+numbers without fractional part don't have trailing `.0`.
+"""
+from __future__ import annotations
+
+from datetime import date
+from enum import Enum
+from typing import AsyncIterator, Collection, Iterable, Optional
+
+from databases import Database
+from db import presents
+from sqlalchemy import Float, Integer, LargeBinary, Text, and_, cast, func, literal, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.sql import ColumnElement, Select, select
+
+from .aggregates import PERCENTILES
+from .analyzer import ages_query, citizens_query
+from .metrics import timed
+
+
+class SummaryPart(str, Enum):
+    """Results of read endpoints that can be requested in summary of import."""
+
+    citizens = "citizens"
+    birthdays = "birthdays"
+    age_statistics = "age_statistics"
+
+
+# Citizens are read in chunks by keyset pagination, so the first chunk is sent before the whole document is built.
+CITIZENS_CHUNK_SIZE = 5000
+
+
+def _utf8(text: ColumnElement) -> ColumnElement:
+    """Encode text in the database, asyncpg returns bytes as they are."""
+    return func.convert_to(text, literal("UTF8"), type_=LargeBinary)
+
+
+def _join(items: ColumnElement, order_by: Iterable[ColumnElement]) -> ColumnElement:
+    """Aggregate JSON texts into comma separated list."""
+    return func.string_agg(items, aggregate_order_by(literal(","), *order_by), type_=Text)
+
+
+async def _iter_citizens_items(
+    import_id: int,
+    database: Database,
+    fields: Optional[Collection[str]],
+    after_citizen_id: Optional[int],
+    limit: Optional[int],
+    chunk_size: int,
+) -> AsyncIterator[bytes]:
+    """Iterate over chunks of comma separated citizens, must be called in transaction to read one snapshot."""
+    separator = b""
+    while limit is None or limit > 0:
+        size = chunk_size if limit is None else min(chunk_size, limit)
+        rows = citizens_query(import_id, fields, after_citizen_id, size).alias("citizen")
+        item = cast(func.row_to_json(literal_column(rows.name)), Text)
+        query = select(
+            [_utf8(_join(item, [rows.c.citizen_id])), func.max(rows.c.citizen_id), func.count()]
+        ).select_from(rows)
+        row = await database.fetch_one(query)
+        if row[0] is not None:
+            yield separator + row[0]
+            separator = b","
+        if row[2] < size:
+            break
+        after_citizen_id = row[1]
+        limit = None if limit is None else limit - size
+
+
+@timed
+async def iter_citizens_document(
+    import_id: int,
+    database: Database,
+    fields: Optional[Collection[str]] = None,
+    after_citizen_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    chunk_size: int = CITIZENS_CHUNK_SIZE,
+) -> AsyncIterator[bytes]:
+    """Iterate over chunks of `{"data": [...]}` document with citizens of particular import.
+
+    Chunks are read in order of citizen ids in one repeatable read transaction, so the document is consistent.
+    Other arguments are the same as of `analyzer.citizens_query`.
+    """
+    yield b'{"data":['
+    async with database.transaction(isolation="repeatable_read", readonly=True):
+        async for chunk in _iter_citizens_items(import_id, database, fields, after_citizen_id, limit, chunk_size):
+            yield chunk
+    yield b"]}"
+
+
+def _birthdays_json(import_id: int) -> Select:
+    """Build query of JSON object with presents bought in every month."""
+    item = func.format('{"citizen_id":%s,"presents":%s}', presents.c.citizen_id, presents.c.presents)
+    by_month = (
+        select([presents.c.month, _join(item, [presents.c.citizen_id]).label("citizens")])
+        .where(and_(presents.c.import_id == import_id, presents.c.presents > 0))
+        .group_by(presents.c.month)
+        .alias("by_month")
+    )
+    months = select([func.generate_series(cast(1, Integer), cast(12, Integer)).label("month")]).alias("months")
+    month = func.format('"%s":[%s]', months.c.month, func.coalesce(by_month.c.citizens, ""))
+    document = literal("{") + _join(month, [months.c.month]) + literal("}")
+    return select([document]).select_from(months.outerjoin(by_month, by_month.c.month == months.c.month))
+
+
+def _age_statistics_json(import_id: int, as_of: date) -> Select:
+    """Build query of JSON list with age percentiles of every town.
+
+    Percentiles are interpolated from numbers of citizens by age the same way as `aggregates.percentiles_cont`
+    does it, with the same floating point operations.
+    """
+    ages = ages_query(import_id, as_of).alias("ages")
+    # Citizens of the age take positions from `first` in sorted list of ages of the town.
+    passed = func.sum(ages.c.citizens).over(partition_by=ages.c.town, order_by=ages.c.age)
+    ranges = select(
+        [
+            ages.c.town,
+            ages.c.age,
+            (passed - ages.c.citizens).label("first"),
+            func.sum(ages.c.citizens).over(partition_by=ages.c.town).label("total"),
+        ]
+    ).alias("ranges")
+
+    def percentile(fraction: float) -> ColumnElement:
+        # Without cast fraction is passed as numeric and position is computed precisely, unlike in Python.
+        position = cast(fraction, Float) * (ranges.c.total - 1)
+        lower = func.max(ranges.c.age).filter(ranges.c.first <= func.floor(position))
+        upper = func.max(ranges.c.age).filter(ranges.c.first <= func.ceil(position))
+        return lower + (upper - lower) * func.max(position - func.floor(position))
+
+    towns = (
+        select([ranges.c.town, *[percentile(fraction).label(name) for name, fraction in PERCENTILES.items()]])
+        .group_by(ranges.c.town)
+        .alias("towns")
+    )
+    item = cast(func.row_to_json(literal_column(towns.name)), Text)
+    return select([literal("[") + func.coalesce(_join(item, [towns.c.town]), "") + literal("]")]).select_from(towns)
+
+
+@timed
+async def get_birthdays_document(import_id: int, database: Database) -> bytes:
+    """Get `{"data": {"1": [...], ..., "12": [...]}}` document with presents bought in every month."""
+    document = literal('{"data":') + _birthdays_json(import_id).as_scalar() + literal("}")
+    return await database.fetch_val(select([_utf8(document)]))
+
+
+@timed
+async def get_age_statistics_document(import_id: int, database: Database, as_of: Optional[date] = None) -> bytes:
+    """Get `{"data": [...]}` document with age percentiles of every town.
+
+    Arguments are the same as of `analyzer.get_age_statistics`.
+    """
+    document = literal('{"data":') + _age_statistics_json(import_id, as_of or date.today()).as_scalar() + literal("}")
+    return await database.fetch_val(select([_utf8(document)]))
+
+
+@timed
+async def iter_summary_document(
+    import_id: int,
+    database: Database,
+    parts: Collection[SummaryPart],
+    as_of: Optional[date] = None,
+    chunk_size: int = CITIZENS_CHUNK_SIZE,
+) -> AsyncIterator[bytes]:
+    """Iterate over chunks of `{"data": {"citizens": [...], "birthdays": {...}, "age_statistics": [...]}}` document.
+
+    Only requested parts are present in the document, they are read from one snapshot of import on one connection.
+    Birthdays and age statistics are read by one query after citizens.
+
+    Args:
+        import_id: import to summarize.
+        database: database to query.
+        parts: parts of summary.
+        as_of: date to compute ages at, today by default.
+        chunk_size: number of citizens read by one query.
+    """
+    separator = b""
+    yield b'{"data":{'
+    async with database.transaction(isolation="repeatable_read", readonly=True):
+        if SummaryPart.citizens in parts:
+            yield b'"citizens":['
+            async for chunk in _iter_citizens_items(import_id, database, None, None, None, chunk_size):
+                yield chunk
+            yield b"]"
+            separator = b","
+        documents = []
+        if SummaryPart.birthdays in parts:
+            documents.append(literal('"birthdays":') + _birthdays_json(import_id).as_scalar())
+        if SummaryPart.age_statistics in parts:
+            age_statistics = _age_statistics_json(import_id, as_of or date.today()).as_scalar()
+            documents.append(literal('"age_statistics":') + age_statistics)
+        if documents:
+            yield separator + await database.fetch_val(select([_utf8(func.concat_ws(",", *documents))]))
+    yield b"}}"
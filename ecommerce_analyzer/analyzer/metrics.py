@@ -0,0 +1,47 @@
+"""Prometheus metrics of analyzer functions."""
+from __future__ import annotations
+
+import inspect
+from functools import wraps
+from typing import Any, AsyncIterator, Callable, TypeVar, cast
+
+from prometheus_client import Histogram
+
+CALL_DURATION = Histogram(
+    "analyzer_call_duration_seconds",
+    "Duration of calls of analyzer functions, including waits for connections and retries.",
+    ["function"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def timed(function: F) -> F:
+    """Observe duration of calls of coroutine function or async generator function by its name.
+
+    Async generator is timed from its first step to its end, so the time its consumer spends between steps is
+    included. It is closed explicitly when the consumer stops early, so its transaction ends in the same task.
+    """
+    duration = CALL_DURATION.labels(function.__name__)
+
+    if inspect.isasyncgenfunction(function):
+
+        @wraps(function)
+        async def iterate(*args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+            items = function(*args, **kwargs)
+            with duration.time():
+                try:
+                    async for item in items:
+                        yield item
+                finally:
+                    await items.aclose()
+
+        return cast(F, iterate)
+
+    @wraps(function)
+    async def call(*args: Any, **kwargs: Any) -> Any:
+        with duration.time():
+            return await function(*args, **kwargs)
+
+    return cast(F, call)
@@ -0,0 +1,45 @@
+"""Retries of transactions that failed because of concurrent transactions."""
+from __future__ import annotations
+
+import asyncio
+import random
+from functools import wraps
+from typing import Any, Awaitable, Callable, TypeVar, cast
+
+from asyncpg import DeadlockDetectedError, SerializationError
+
+
+class ConflictError(Exception):
+    """Transaction can't be completed because of concurrent transactions and should be run again."""
+
+
+# Errors after which the whole transaction can be run again and succeed.
+CONFLICT_ERRORS = (ConflictError, DeadlockDetectedError, SerializationError)
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+def retry_conflicts(attempts: int = 10, backoff: float = 0.01) -> Callable[[F], F]:
+    """Make decorator that calls coroutine function again after deadlock, serialization failure or `ConflictError`.
+
+    Delays between attempts are random and their upper bound grows exponentially, so that conflicting transactions
+    don't collide again. Decorated function must run the whole transaction, it can't be retried inside outer one.
+
+    Args:
+        attempts: maximum number of calls, error of the last one is raised.
+        backoff: upper bound of delay before the second call in seconds, it doubles for every next call.
+    """
+
+    def decorator(function: F) -> F:
+        @wraps(function)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            for attempt in range(attempts - 1):
+                try:
+                    return await function(*args, **kwargs)
+                except CONFLICT_ERRORS:
+                    await asyncio.sleep(random.uniform(0, backoff * 2**attempt))
+            return await function(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
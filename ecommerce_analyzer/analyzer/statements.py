@@ -0,0 +1,58 @@
+"""Analyzer queries compiled once and executed as prepared statements of pooled asyncpg connections.
+
+`databases` compiles query on every call and wraps every row into its own record type. Queries of this module are
+compiled when analyzer is imported, so only their arguments are passed on every call. SQL text of statement is
+the same on every call, so asyncpg prepares it once per connection and takes it from statement cache of connection
+later, rows are returned as `asyncpg.Record`, which can be converted to dict directly.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncpg
+from databases import Database
+from sqlalchemy.dialects.postgresql import pypostgresql
+from sqlalchemy.sql import ClauseElement
+
+# Same dialect as `databases` compiles queries with.
+_dialect = pypostgresql.dialect(paramstyle="pyformat")
+_dialect.implicit_returning = True
+_dialect.supports_native_enum = True
+
+
+class Statement:
+    """Query compiled to SQL with positional parameters.
+
+    Parameters of query are given by `sqlalchemy.bindparam` with names, other bound values of query are constant.
+    """
+
+    def __init__(self: Statement, query: ClauseElement) -> None:
+        """Compile query."""
+        compiled = query.compile(dialect=_dialect)
+        self._names = sorted(compiled.params)
+        self._constants = {name: value for name, value in compiled.params.items() if not compiled.binds[name].required}
+        self._processors: Dict[str, Callable[[Any], Any]] = compiled._bind_processors
+        self.sql = compiled.string % {name: f"${i}" for i, name in enumerate(self._names, start=1)}
+
+    def _args(self: Statement, values: Dict[str, Any]) -> List[Any]:
+        args = [values[name] if name in values else self._constants[name] for name in self._names]
+        if self._processors:
+            args = [
+                self._processors[name](arg) if name in self._processors else arg for name, arg in zip(self._names, args)
+            ]
+        return args
+
+    async def fetch(self: Statement, database: Database, **values: Any) -> List[asyncpg.Record]:
+        """Fetch all rows, connection (and transaction) of current task is used if there is one."""
+        async with database.connection() as connection:
+            return await connection.raw_connection.fetch(self.sql, *self._args(values))
+
+    async def fetchrow(self: Statement, database: Database, **values: Any) -> Optional[asyncpg.Record]:
+        """Fetch the first row."""
+        async with database.connection() as connection:
+            return await connection.raw_connection.fetchrow(self.sql, *self._args(values))
+
+    async def fetchval(self: Statement, database: Database, **values: Any) -> Any:
+        """Fetch value of the first column of the first row."""
+        async with database.connection() as connection:
+            return await connection.raw_connection.fetchval(self.sql, *self._args(values))
@@ -1,44 +1,220 @@
 """API service."""
 from __future__ import annotations
 
+import asyncio
 import os
-from typing import Dict, Union
+from datetime import date
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
 import analyzer
 from databases import Database
-from fastapi import Depends, FastAPI, Request, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from pydantic import ValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError, parse_obj_as
 from starlette_prometheus import PrometheusMiddleware, metrics
 
-from .dependencies import database
-from .scheme import Citizen, CitizenPatch, Import, Percentiles, Presents, SavedImport
+from .cache import encode_etag, etag_matches, make_etag
+from .compression import prepend, read_head
+from .dependencies import database, dsn, import_jobs_pool, replicas, response_cache, response_compression, settings
+from .scheme import (
+    Citizen,
+    CitizenPatch,
+    CitizensPatch,
+    Import,
+    ImportChanges,
+    PatchedCitizens,
+    Percentiles,
+    Presents,
+    PresentsByMonth,
+    SavedImport,
+    SavedImportJob,
+    Summary,
+    TownPercentiles,
+)
+from .settings import RenderMethod
+from .streaming import import_validation_error, iter_changes_json, iter_citizens_batches, iter_citizens_json
 
 app = FastAPI(title="Ecommerce Analyzer", version="1.0", description="Provides analytical information about citizens")
 app.add_middleware(PrometheusMiddleware)
 app.add_route("/metrics", metrics)
 
+# Header with version of import changed by write endpoint, it is passed as `min_version` to read endpoints.
+VERSION_HEADER = "Import-Version"
+MIN_VERSION = Query(
+    None,
+    ge=0,
+    description=f"Version of import from `{VERSION_HEADER}` header of write endpoint, response reflects its changes",
+)
+
 
 def get_db() -> Database:
     """Get database."""
     return database
 
 
+async def get_version_headers(
+    import_id: int, database: Database, *key: Hashable, min_version: Optional[int] = None
+) -> Tuple[Optional[int], Dict[str, str]]:
+    """Get version of import and headers with ETag of response built from it, headers are empty if there is no import.
+
+    Args:
+        import_id: import the response is built from.
+        database: database to get version from.
+        key: other values the response depends on, besides URL.
+        min_version: version client has got from write endpoint.
+    """
+    version = await response_cache.get_version(import_id, database)
+    if min_version is not None and (version is None or version < min_version):
+        # Version known by this process lags behind changes made through other processes.
+        version = await response_cache.refresh(import_id, database)
+    if version is None:
+        return None, {}
+    return version, {"ETag": make_etag(import_id, version, *key)}
+
+
+def is_not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """Check whether client already has the response with ETag from headers, compressed or not.
+
+    Response is compressed by encoding accepted by client only if it is large enough, so both ETags are checked and
+    the matched one is put into headers.
+    """
+    if "ETag" not in headers:
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    encoding = response_compression.choose_encoding(request.headers.get("accept-encoding"))
+    etags = [headers["ETag"]]
+    if encoding is not None:
+        etags.insert(0, encode_etag(headers["ETag"], encoding))
+    for etag in etags:
+        if etag_matches(if_none_match, etag):
+            headers["ETag"] = etag
+            return True
+    return False
+
+
+def encoded_headers(headers: Dict[str, str], encoding: str) -> Dict[str, str]:
+    """Headers of response compressed by encoding, its ETag differs from ETag of uncompressed one."""
+    headers = {**headers, "Content-Encoding": encoding}
+    if "ETag" in headers:
+        headers["ETag"] = encode_etag(headers["ETag"], encoding)
+    return headers
+
+
+async def send_rendered(
+    request: Request,
+    endpoint: str,
+    import_id: int,
+    version: Optional[int],
+    headers: Dict[str, str],
+    render: Callable[[], Awaitable[bytes]],
+    *key: Hashable,
+) -> Response:
+    """Send rendered body compressed by encoding accepted by client, both bodies are cached.
+
+    Arguments are the same as of `ResponseCache.get_or_render`, `headers` are added to response.
+    """
+    body = await response_cache.get_or_render(endpoint, import_id, version, render, *key)
+    encoding = response_compression.choose_encoding(request.headers.get("accept-encoding"))
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if encoding is None or len(body) < response_compression.min_size:
+        return Response(body, media_type="application/json", headers=headers)
+
+    async def compress() -> bytes:
+        return response_compression.compress(body, encoding)
+
+    body = await response_cache.get_or_render(endpoint, import_id, version, compress, *key, encoding)
+    return Response(body, media_type="application/json", headers=encoded_headers(headers, encoding))
+
+
+async def send_streamed(
+    request: Request,
+    endpoint: str,
+    import_id: int,
+    version: Optional[int],
+    headers: Dict[str, str],
+    stream: Callable[[], AsyncIterator[bytes]],
+    *key: Hashable,
+) -> Response:
+    """Send streamed body compressed by encoding accepted by client, compressed chunks are sent as they are ready.
+
+    Size of body is not known in advance, so it is compressed unless the whole body is read before the size
+    threshold is reached. Arguments are the same as of `ResponseCache.get_or_stream`.
+    """
+    encoding = response_compression.choose_encoding(request.headers.get("accept-encoding"))
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if encoding is not None:
+        compressed = response_cache.get(endpoint, import_id, version, *key, encoding)
+        if compressed is not None:
+            return Response(compressed, media_type="application/json", headers=encoded_headers(headers, encoding))
+    body = response_cache.get_or_stream(endpoint, import_id, version, stream, *key)
+    if encoding is None:
+        return StreamingResponse(body, media_type="application/json", headers=headers)
+    head, finished = await read_head(body, response_compression.min_size)
+    if finished and len(head) < response_compression.min_size:
+        return Response(head, media_type="application/json", headers=headers)
+    chunks = response_compression.compress_stream(prepend(head, body), encoding)
+    return StreamingResponse(
+        response_cache.tee(endpoint, import_id, version, chunks, *key, encoding),
+        media_type="application/json",
+        headers=encoded_headers(headers, encoding),
+    )
+
+
+def render_response(model: Type[BaseModel], response: dict) -> bytes:
+    """Validate and serialize response body the same way as FastAPI does it for `response_model`."""
+    return JSONResponse(content=jsonable_encoder(model.parse_obj(response))).body
+
+
+def render_json(type_: Any, value: Any) -> bytes:
+    """Validate and serialize value of any type the same way as `render_response` does it."""
+    return JSONResponse(content=jsonable_encoder(parse_obj_as(type_, value))).body
+
+
 @app.on_event("startup")
 async def startup_event() -> None:
-    """Start connection pool and clear environment variables on application startup."""
+    """Start connection pools and responses cache, fail abandoned import jobs, clear environment variables."""
     os.environ.clear()
     await database.connect()
+    await import_jobs_pool.fail_abandoned(database)
+    await replicas.connect()
+    await response_cache.start(dsn)
 
 
 @app.on_event("shutdown")
 async def disconnect_from_database() -> None:
-    """Close connection pool on application shutdown."""
+    """Stop background import jobs and responses cache, close connection pools on application shutdown."""
+    await import_jobs_pool.stop()
+    await response_cache.stop()
+    await replicas.disconnect()
     await database.disconnect()
 
 
+@app.middleware("http")
+async def limit_import_size(request: Request, call_next: Callable) -> Response:
+    """Reject imports larger than allowed size before reading their body."""
+    content_length = request.headers.get("content-length", "")
+    if request.method == "POST" and content_length.isdigit() and int(content_length) > settings.max_import_size:
+        return JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, content={"detail": "Import is too large"}
+        )
+    return await call_next(request)
+
+
 @app.exception_handler(RequestValidationError)
 def validation_exception_handler(request: Request, exc: RequestValidationError) -> JSONResponse:
     """Return HTTP_400_BAD_REQUEST if data don't pass validation."""
@@ -47,6 +223,15 @@ def validation_exception_handler(request: Request, exc: RequestValidationError)
     )
 
 
+def conflict_exception_handler(request: Request, exc: Exception) -> JSONResponse:
+    """Return HTTP_409_CONFLICT if transaction failed because of concurrent ones after all retries."""
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={"detail": str(exc)})
+
+
+for _error in analyzer.CONFLICT_ERRORS:
+    app.add_exception_handler(_error, conflict_exception_handler)
+
+
 @app.get("/healthcheck")
 def health_check() -> Dict[str, str]:
     """Return 200 if ok."""
@@ -54,16 +239,82 @@ def health_check() -> Dict[str, str]:
 
 
 @app.post("/imports", response_model=SavedImport, status_code=status.HTTP_201_CREATED)
-async def save_import(request: Import, database: Database = Depends(get_db)) -> Union[dict, SavedImport, JSONResponse]:
-    """Save import to database."""
-    import_id = await analyzer.save_import(request, database)
-    response = {"data": {"import_id": import_id}}
+async def save_import(
+    request: Import, response: Response, database: Database = Depends(get_db)
+) -> Union[dict, SavedImport, JSONResponse]:
+    """Save import to database, new import has version 0."""
+    import_id = await analyzer.save_import(
+        request, database, method=settings.ingest_method, connections=settings.ingest_connections
+    )
+    response.headers[VERSION_HEADER] = "0"
+    return {"data": {"import_id": import_id}}
+
+
+@app.post("/imports/stream", response_model=SavedImport, status_code=status.HTTP_201_CREATED)
+async def save_import_stream(
+    request: Request, response: Response, database: Database = Depends(get_db)
+) -> Union[dict, SavedImport]:
+    """Save import to database parsing and validating its body incrementally."""
+    batches = iter_citizens_batches(request, settings.import_batch_size, settings.max_import_size)
+    try:
+        import_id = await analyzer.save_import_stream(batches, database, method=settings.ingest_method)
+    except ValueError as e:
+        raise import_validation_error(e)
+    response.headers[VERSION_HEADER] = "0"
+    return {"data": {"import_id": import_id}}
+
+
+@app.post("/imports/jobs", response_model=SavedImportJob, status_code=status.HTTP_202_ACCEPTED)
+async def create_import_job(
+    request: Import, database: Database = Depends(get_db)
+) -> Union[dict, SavedImportJob, JSONResponse]:
+    """Validate import and save it to database in background."""
+    try:
+        job = await import_jobs_pool.submit(request, database)
+    except asyncio.QueueFull:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Too many pending imports"},
+            headers={"Retry-After": "1"},
+        )
+    response = {"data": job}
     return response
 
 
+@app.get("/imports/jobs/{job_id}", response_model=SavedImportJob, status_code=200)
+async def get_import_job(job_id: int, database: Database = Depends(get_db)) -> Union[dict, SavedImportJob]:
+    """Get state of background import job."""
+    job = await import_jobs_pool.get(job_id, database)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import job not found")
+    response = {"data": job}
+    return response
+
+
+@app.post("/imports/{import_id}/clone", response_model=SavedImport, status_code=status.HTTP_201_CREATED)
+async def clone_import(
+    import_id: int, response: Response, database: Database = Depends(get_db)
+) -> Union[dict, SavedImport]:
+    """Create a copy of import, it has version 0."""
+    new_import_id = await analyzer.clone_import(import_id, database)
+    if new_import_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import not found")
+    response.headers[VERSION_HEADER] = "0"
+    return {"data": {"import_id": new_import_id}}
+
+
+@app.delete("/imports/{import_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def drop_import(import_id: int, database: Database = Depends(get_db)) -> Response:
+    """Delete import with all its citizens."""
+    if not await analyzer.drop_import(import_id, database):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import not found")
+    response_cache.drop(import_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
 @app.patch("/imports/{import_id}/citizens/{citizen_id}", response_model=Citizen, status_code=200)
 async def patch_citizen(
-    import_id: int, citizen_id: int, request: CitizenPatch, database: Database = Depends(get_db)
+    import_id: int, citizen_id: int, request: CitizenPatch, response: Response, database: Database = Depends(get_db)
 ) -> Union[dict, JSONResponse]:
     """Patch citizen."""
     try:
@@ -72,28 +323,208 @@ async def patch_citizen(
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST, content=jsonable_encoder({"detail": e.errors(), "body": e.json()})
         )
+    except analyzer.CitizenNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response.headers[VERSION_HEADER] = str(await response_cache.refresh(import_id, database))
     return patched_citizen
 
 
+@app.patch("/imports/{import_id}/citizens", response_model=PatchedCitizens, status_code=200)
+async def patch_citizens(
+    import_id: int, request: CitizensPatch, response: Response, database: Database = Depends(get_db)
+) -> dict:
+    """Patch many citizens in one transaction, patches are applied in the given order."""
+    try:
+        patched_citizens = await analyzer.patch_citizens(import_id, request.data, database=database)
+    except analyzer.CitizenNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response.headers[VERSION_HEADER] = str(await response_cache.refresh(import_id, database))
+    return {"data": patched_citizens}
+
+
+def parse_fields(fields: Optional[str]) -> Optional[FrozenSet[str]]:
+    """Parse comma separated fields of citizens.
+
+    Raises:
+        HTTPException: if some field is unknown.
+    """
+    if fields is None:
+        return None
+    parsed = frozenset(field.strip() for field in fields.split(","))
+    unknown = parsed.difference(Citizen.__fields__)
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+    return parsed
+
+
 @app.get("/imports/{import_id}/citizens", response_model=Import, status_code=200)
-async def get_citizens(import_id: int, database: Database = Depends(get_db)) -> Union[dict, Import]:
-    """Get citizen."""
-    citizens = await analyzer.get_citizens(import_id, database)
-    response = {"data": citizens}
-    return response
+async def get_citizens(
+    request: Request,
+    import_id: int,
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of citizens, they are ordered by id"),
+    after_citizen_id: Optional[int] = Query(None, description="Return citizens with greater ids"),
+    fields: Optional[str] = Query(None, description="Comma separated fields, `citizen_id` is always returned"),
+    min_version: Optional[int] = MIN_VERSION,
+    database: Database = Depends(get_db),
+) -> StreamingResponse:
+    """Get citizens, rows are sent as they are read from database."""
+    parsed_fields = parse_fields(fields)
+    version, headers = await get_version_headers(import_id, database, min_version=min_version)
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    async def stream() -> AsyncIterator[bytes]:
+        reader = await replicas.choose(import_id, version, database)
+        if settings.render_method == RenderMethod.database:
+            chunks = analyzer.iter_citizens_document(import_id, reader, parsed_fields, after_citizen_id, limit)
+        else:
+            rows = analyzer.iter_citizens(import_id, reader, parsed_fields, after_citizen_id, limit)
+            chunks = iter_citizens_json(rows)
+        async for chunk in chunks:
+            yield chunk
+
+    return await send_streamed(
+        request, "citizens", import_id, version, headers, stream, parsed_fields, after_citizen_id, limit
+    )
+
+
+@app.get("/imports/{import_id}/changes", response_model=ImportChanges, status_code=200)
+async def get_changes(
+    request: Request,
+    import_id: int,
+    since: int = Query(0, ge=0, description="Return changes made after this version of import"),
+    min_version: Optional[int] = MIN_VERSION,
+    database: Database = Depends(get_db),
+) -> Response:
+    """Get changes of citizens in order of versions, consumers apply them to a copy of import made at `since`."""
+    version, headers = await get_version_headers(import_id, database, since, min_version=min_version)
+    if version is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import not found")
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    async def stream() -> AsyncIterator[bytes]:
+        reader = await replicas.choose(import_id, version, database)
+        async for chunk in iter_changes_json(analyzer.iter_changes(import_id, reader, since)):
+            yield chunk
+
+    return await send_streamed(request, "changes", import_id, version, headers, stream, since)
 
 
 @app.get("/imports/{import_id}/citizens/birthdays", response_model=Presents, status_code=200)
-async def get_number_of_birthdays(import_id: int, database: Database = Depends(get_db)) -> Union[dict, Presents]:
+async def get_number_of_birthdays(
+    request: Request,
+    import_id: int,
+    min_version: Optional[int] = MIN_VERSION,
+    database: Database = Depends(get_db),
+) -> Response:
     """Get number of birthdays by months."""
-    presents_by_month = await analyzer.get_birthdays(import_id, database)
-    response = {"data": presents_by_month}
-    return response
+    version, headers = await get_version_headers(import_id, database, min_version=min_version)
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    async def render() -> bytes:
+        reader = await replicas.choose(import_id, version, database)
+        if settings.render_method == RenderMethod.database:
+            return await analyzer.get_birthdays_document(import_id, reader)
+        presents_by_month = await analyzer.get_birthdays(import_id, reader)
+        return render_response(Presents, {"data": presents_by_month})
+
+    return await send_rendered(request, "birthdays", import_id, version, headers, render)
 
 
 @app.get("/imports/{import_id}/towns/stat/percentile/age", response_model=Percentiles, status_code=200)
-async def get_age_statistics(import_id: int, database: Database = Depends(get_db)) -> Union[dict, Percentiles]:
-    """Get age percentiles by each town."""
-    age_stats = await analyzer.get_age_statistics(import_id, database)
-    response = {"data": age_stats}
-    return response
+async def get_age_statistics(
+    request: Request,
+    import_id: int,
+    as_of: Optional[date] = Query(None, description="Date to compute ages at, today by default"),
+    min_version: Optional[int] = MIN_VERSION,
+    database: Database = Depends(get_db),
+) -> Response:
+    """Get age percentiles by each town, ages depend on the date, so it is a part of cache key and ETag."""
+    as_of = as_of or date.today()
+    version, headers = await get_version_headers(import_id, database, as_of, min_version=min_version)
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    async def render() -> bytes:
+        reader = await replicas.choose(import_id, version, database)
+        if settings.render_method == RenderMethod.database:
+            return await analyzer.get_age_statistics_document(import_id, reader, as_of)
+        age_stats = await analyzer.get_age_statistics(import_id, reader, as_of)
+        return render_response(Percentiles, {"data": age_stats})
+
+    return await send_rendered(request, "age_statistics", import_id, version, headers, render, as_of)
+
+
+def parse_summary_parts(include: Optional[str]) -> FrozenSet[analyzer.SummaryPart]:
+    """Parse comma separated parts of summary, all parts are included by default.
+
+    Raises:
+        HTTPException: if some part is unknown.
+    """
+    if include is None:
+        return frozenset(analyzer.SummaryPart)
+    names = {name.strip() for name in include.split(",")}
+    unknown = names.difference(part.value for part in analyzer.SummaryPart)
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown parts: {', '.join(unknown)}")
+    return frozenset(analyzer.SummaryPart(name) for name in names)
+
+
+async def iter_summary_json(
+    import_id: int, database: Database, parts: FrozenSet[analyzer.SummaryPart], as_of: Optional[date]
+) -> AsyncIterator[bytes]:
+    """Render summary document from rows decoded in Python, it is the same as `analyzer.iter_summary_document`."""
+    separator = b""
+    yield b'{"data":{'
+    async with database.transaction(isolation="repeatable_read", readonly=True):
+        if analyzer.SummaryPart.citizens in parts:
+            rows = analyzer.iter_citizens(import_id, database)
+            async for chunk in iter_citizens_json(rows, prefix='"citizens":[', suffix="]"):
+                yield chunk
+            separator = b","
+        if analyzer.SummaryPart.birthdays in parts:
+            presents_by_month = await analyzer.get_birthdays(import_id, database)
+            yield separator + b'"birthdays":' + render_json(PresentsByMonth, presents_by_month)
+            separator = b","
+        if analyzer.SummaryPart.age_statistics in parts:
+            age_stats = await analyzer.get_age_statistics(import_id, database, as_of)
+            yield separator + b'"age_statistics":' + render_json(List[TownPercentiles], age_stats)
+    yield b"}}"
+
+
+@app.get("/imports/{import_id}/summary", response_model=Summary, response_model_exclude_none=True, status_code=200)
+async def get_summary(
+    request: Request,
+    import_id: int,
+    include: Optional[str] = Query(
+        None, description="Comma separated parts: citizens, birthdays, age_statistics, all by default"
+    ),
+    as_of: Optional[date] = Query(None, description="Date to compute ages at, today by default"),
+    min_version: Optional[int] = MIN_VERSION,
+    database: Database = Depends(get_db),
+) -> Response:
+    """Get results of other read endpoints in one response, they are read from one snapshot of import."""
+    parts = parse_summary_parts(include)
+    # Ages depend on the date, other parts don't.
+    as_of = (as_of or date.today()) if analyzer.SummaryPart.age_statistics in parts else None
+    key = () if as_of is None else (as_of,)
+    version, headers = await get_version_headers(import_id, database, *key, min_version=min_version)
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    async def stream() -> AsyncIterator[bytes]:
+        reader = await replicas.choose(import_id, version, database)
+        if settings.render_method == RenderMethod.database:
+            chunks = analyzer.iter_summary_document(import_id, reader, parts, as_of)
+        else:
+            chunks = iter_summary_json(import_id, reader, parts, as_of)
+        async for chunk in chunks:
+            yield chunk
+
+    return await send_streamed(request, "summary", import_id, version, headers, stream, parts, as_of)
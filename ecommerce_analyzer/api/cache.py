@@ -0,0 +1,319 @@
+"""Cache of GET responses and their ETags driven by versions of imports."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+import analyzer
+import asyncpg
+from databases import Database
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+CACHE_HITS = Counter("response_cache_hits_total", "Responses served from cache.", ["endpoint"])
+CACHE_MISSES = Counter("response_cache_misses_total", "Responses rendered and put into cache.", ["endpoint"])
+CACHE_EVICTIONS = Counter(
+    "response_cache_evictions_total",
+    "Responses removed from cache by its size, new version of import or number of known imports.",
+    ["reason"],
+)
+CACHE_SIZE = Gauge("response_cache_bytes", "Size of cached response bodies.")
+
+
+def make_etag(import_id: int, version: int, *key: Hashable) -> str:
+    """Build ETag of response from version of import.
+
+    ETag is weak, documents rendered by different `RenderMethod` are equal, but not byte-for-byte.
+    """
+    return 'W/"' + "-".join(map(str, (import_id, version, *key))) + '"'
+
+
+def encode_etag(etag: str, encoding: str) -> str:
+    """Build ETag of response compressed by encoding from ETag of its uncompressed body."""
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check whether `If-None-Match` header matches ETag using weak comparison."""
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque_tag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """LRU cache of response bodies bounded by their total size in bytes.
+
+    Bodies are keyed by endpoint, import and version of import. Every process keeps versions of imports it has
+    seen and updates them by notifications of `analyzer.IMPORTS_CHANNEL`, so change of import made by any process
+    invalidates responses cached by all of them. Notifications that are sent while listener connection is down
+    are lost, so cache is used only while it is listening and is cleared when connection is lost.
+
+    Dropped imports are kept as tombstones, so that versions read before the drop don't bring them back. Versions
+    and tombstones are kept in LRU order, the least recently used ones are forgotten with their responses above
+    `max_imports`.
+    """
+
+    def __init__(self: ResponseCache, max_size: int, check_interval: float = 5.0, max_imports: int = 100_000) -> None:
+        """Initialize empty cache, it is not used until `start` is called.
+
+        Args:
+            max_size: maximum total size of cached bodies, cache is disabled if it is not positive.
+            check_interval: seconds between checks of listener connection and attempts to reconnect.
+            max_imports: maximum number of imports whose versions are kept.
+        """
+        self.max_size = max_size
+        self.max_imports = max_imports
+        self.check_interval = check_interval
+        self.size = 0
+        self.listening = False
+        self._entries: OrderedDict[Tuple[Hashable, ...], bytes] = OrderedDict()
+        self._keys_by_import: Dict[int, Set[Tuple[Hashable, ...]]] = {}
+        # Versions of imports, None is the tombstone of dropped import.
+        self._versions: OrderedDict[int, Optional[int]] = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self: ResponseCache, dsn: str) -> None:
+        """Start listening to changes of imports in background."""
+        if self.max_size > 0 and self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._listen(dsn))
+
+    async def stop(self: ResponseCache) -> None:
+        """Stop listening and clear cache."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def version(self: ResponseCache, import_id: int) -> Optional[int]:
+        """Get version of import known by this process."""
+        return self._versions.get(import_id)
+
+    def is_dropped(self: ResponseCache, import_id: int) -> bool:
+        """Check whether this process knows that import is dropped."""
+        return import_id in self._versions and self._versions[import_id] is None
+
+    async def get_version(self: ResponseCache, import_id: int, database: Database) -> Optional[int]:
+        """Get version of import or None if there is no such import.
+
+        While cache is listening to changes, known version or tombstone is returned without querying database.
+        """
+        if self.listening and import_id in self._versions:
+            self._versions.move_to_end(import_id)
+            return self._versions[import_id]
+        version = await analyzer.get_import_version(import_id, database)
+        if version is not None and self.listening:
+            self._set_version(import_id, version)
+            version = self._versions[import_id]
+        return version
+
+    async def get_or_render(
+        self: ResponseCache,
+        endpoint: str,
+        import_id: int,
+        version: Optional[int],
+        render: Callable[[], Awaitable[bytes]],
+        *key: Hashable,
+    ) -> bytes:
+        """Get cached response body or render it and put into cache.
+
+        Rendered body reflects state of import at least as new as the version it is cached with: version is known
+        only after its changes are committed, and rendering starts after that.
+
+        Args:
+            endpoint: name of endpoint.
+            import_id: import the response is built from.
+            version: version of import got by `get_version` before rendering, response is not cached if it is None.
+            render: coroutine function that builds response body.
+            key: other values the response depends on.
+        """
+        body = self.get(endpoint, import_id, version, *key)
+        if body is None:
+            body = await render()
+            self.put(endpoint, import_id, version, body, *key)
+        return body
+
+    async def get_or_stream(
+        self: ResponseCache,
+        endpoint: str,
+        import_id: int,
+        version: Optional[int],
+        stream: Callable[[], AsyncIterator[bytes]],
+        *key: Hashable,
+    ) -> AsyncIterator[bytes]:
+        """Yield cached response body or chunks of streamed one, body is put into cache if it fits.
+
+        Same as `get_or_render`, but body is sent while it is rendered and only chunks of it are kept in memory
+        unless it can be cached.
+        """
+        body = self.get(endpoint, import_id, version, *key)
+        if body is not None:
+            yield body
+            return
+        async for chunk in self.tee(endpoint, import_id, version, stream(), *key):
+            yield chunk
+
+    def get(
+        self: ResponseCache, endpoint: str, import_id: int, version: Optional[int], *key: Hashable
+    ) -> Optional[bytes]:
+        """Get cached response body, arguments are the same as of `get_or_render`."""
+        entry_key = self._entry_key(endpoint, import_id, version, key)
+        if entry_key is None:
+            return None
+        body = self._entries.get(entry_key)
+        if body is None:
+            CACHE_MISSES.labels(endpoint).inc()
+            return None
+        self._entries.move_to_end(entry_key)
+        CACHE_HITS.labels(endpoint).inc()
+        return body
+
+    def put(
+        self: ResponseCache, endpoint: str, import_id: int, version: Optional[int], body: bytes, *key: Hashable
+    ) -> None:
+        """Put response body into cache, arguments are the same as of `get_or_render`."""
+        self._put(self._entry_key(endpoint, import_id, version, key), body)
+
+    async def tee(
+        self: ResponseCache,
+        endpoint: str,
+        import_id: int,
+        version: Optional[int],
+        chunks: AsyncIterator[bytes],
+        *key: Hashable,
+    ) -> AsyncIterator[bytes]:
+        """Yield chunks of response body and put the whole body into cache if it fits."""
+        entry_key = self._entry_key(endpoint, import_id, version, key)
+        cached: Optional[List[bytes]] = [] if entry_key is not None else None
+        size = 0
+        async for chunk in chunks:
+            yield chunk
+            if cached is not None:
+                size += len(chunk)
+                if size <= self.max_size:
+                    cached.append(chunk)
+                else:
+                    cached = None
+        if cached is not None:
+            self._put(entry_key, b"".join(cached))
+
+    async def refresh(self: ResponseCache, import_id: int, database: Database) -> Optional[int]:
+        """Update version of import changed by this or other process without waiting for notification.
+
+        Returns:
+            Version of import read from database or None if there is no such import or it is dropped.
+        """
+        version = await analyzer.get_import_version(import_id, database)
+        if not self.listening:
+            return version
+        if version is None:
+            self.drop(import_id)
+        else:
+            self._set_version(import_id, version)
+        return self._versions.get(import_id)
+
+    def drop(self: ResponseCache, import_id: int) -> None:
+        """Replace version of dropped import with tombstone and remove its responses."""
+        self._versions[import_id] = None
+        self._evict_import(import_id, "version")
+        self._touch(import_id)
+
+    def clear(self: ResponseCache) -> None:
+        """Remove all versions and responses."""
+        self._versions.clear()
+        self._keys_by_import.clear()
+        self._entries.clear()
+        self.size = 0
+        CACHE_SIZE.set(0)
+
+    def _entry_key(
+        self: ResponseCache, endpoint: str, import_id: int, version: Optional[int], key: Tuple[Hashable, ...]
+    ) -> Optional[Tuple[Hashable, ...]]:
+        """Build key of response or return None if response can't be cached."""
+        if not self.listening or version is None:
+            return None
+        return (endpoint, import_id, version, *key)
+
+    def _set_version(self: ResponseCache, import_id: int, version: int) -> None:
+        """Set version of import unless it is dropped, versions only grow, so updates can come in any order."""
+        if self.is_dropped(import_id):
+            return
+        if version > self._versions.get(import_id, -1):
+            self._versions[import_id] = version
+            self._evict_import(import_id, "version")
+        self._touch(import_id)
+
+    def _touch(self: ResponseCache, import_id: int) -> None:
+        """Mark version of import as recently used and forget the least recently used ones above the limit."""
+        self._versions.move_to_end(import_id)
+        while len(self._versions) > self.max_imports:
+            forgotten_id, _ = self._versions.popitem(last=False)
+            self._evict_import(forgotten_id, "imports")
+
+    def _put(self: ResponseCache, entry_key: Optional[Tuple[Hashable, ...]], body: bytes) -> None:
+        if entry_key is None or len(body) > self.max_size or entry_key in self._entries:
+            return
+        # Import could be changed while the body was rendered, then it is cached with outdated version or not at all.
+        _, import_id, version, *_ = entry_key
+        if not self.listening or self._versions.get(import_id) != version:
+            return
+        self._entries[entry_key] = body
+        self._keys_by_import.setdefault(import_id, set()).add(entry_key)
+        self.size += len(body)
+        while self.size > self.max_size:
+            evicted_key, evicted_body = self._entries.popitem(last=False)
+            self._remove_key(evicted_key, evicted_body)
+            CACHE_EVICTIONS.labels("size").inc()
+        CACHE_SIZE.set(self.size)
+
+    def _evict_import(self: ResponseCache, import_id: int, reason: str) -> None:
+        for entry_key in self._keys_by_import.pop(import_id, ()):
+            self._remove_key(entry_key, self._entries.pop(entry_key))
+            CACHE_EVICTIONS.labels(reason).inc()
+        CACHE_SIZE.set(self.size)
+
+    def _remove_key(self: ResponseCache, entry_key: Tuple[Hashable, ...], body: bytes) -> None:
+        self.size -= len(body)
+        import_id = entry_key[1]
+        keys = self._keys_by_import.get(import_id)
+        if keys is not None:
+            keys.discard(entry_key)
+            if not keys:
+                del self._keys_by_import[import_id]
+
+    def _on_notification(self: ResponseCache, connection: Any, pid: int, channel: str, payload: str) -> None:
+        import_id, version = payload.split(":")
+        if version == analyzer.IMPORT_DROPPED:
+            self.drop(int(import_id))
+        else:
+            self._set_version(int(import_id), int(version))
+
+    async def _listen(self: ResponseCache, dsn: str) -> None:
+        """Listen to changes of imports, reconnect if connection is lost."""
+        while True:
+            try:
+                connection = await asyncpg.connect(dsn)
+                try:
+                    await connection.add_listener(analyzer.IMPORTS_CHANNEL, self._on_notification)
+                    self.listening = True
+                    while True:
+                        await asyncio.sleep(self.check_interval)
+                        await connection.fetchval("SELECT 1")
+                finally:
+                    self.listening = False
+                    self.clear()
+                    connection.terminate()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Listener of imports changes failed, responses are not cached")
+                await asyncio.sleep(self.check_interval)
@@ -0,0 +1,83 @@
+"""Columnar representation of import used to validate it."""
+from __future__ import annotations
+
+from array import array
+from itertools import chain, islice, repeat
+from operator import eq, sub
+from typing import Any, Iterable, List
+
+# Citizen ids are signed 32-bit integers, shifting them by 2**31 allows to pack a pair of ids into one 64-bit key.
+ID_SHIFT = 2 ** 31
+
+
+def pack_pairs(left: Iterable[int], right: Iterable[int]) -> List[int]:
+    """Pack pairs of ids into sorted list of 64-bit keys."""
+    return sorted(map(lambda a, b: (a + ID_SHIFT) << 32 | (b + ID_SHIFT), left, right))
+
+
+def unpack_pair(key: int) -> tuple:
+    """Unpack 64-bit key into pair of ids."""
+    return (key >> 32) - ID_SHIFT, (key & 0xFFFFFFFF) - ID_SHIFT
+
+
+class ImportColumns:
+    """Citizens ids and their relatives stored in arrays.
+
+    Relatives use CSR layout, relatives of `citizen_ids[i]` are
+    `relatives[relatives_offsets[i]:relatives_offsets[i + 1]]`.
+    """
+
+    def __init__(self: ImportColumns) -> None:
+        """Initialize empty columns."""
+        self.citizen_ids = array("q")
+        self.relatives_offsets = array("q", [0])
+        self.relatives = array("q")
+
+    @classmethod
+    def from_citizens(cls: type, citizens_list: Iterable[Any]) -> ImportColumns:
+        """Build columns from citizens in one pass."""
+        columns = cls()
+        columns.extend(citizens_list)
+        return columns
+
+    def extend(self: ImportColumns, citizens_list: Iterable[Any]) -> None:
+        """Append citizens to columns."""
+        for citizen in citizens_list:
+            self.citizen_ids.append(citizen.citizen_id)
+            self.relatives.extend(citizen.relatives)
+            self.relatives_offsets.append(len(self.relatives))
+
+    def __len__(self: ImportColumns) -> int:
+        """Return number of citizens."""
+        return len(self.citizen_ids)
+
+    @property
+    def relation_citizens(self: ImportColumns) -> array:
+        """Citizen id for every element of `relatives`."""
+        counts = map(sub, islice(self.relatives_offsets, 1, None), self.relatives_offsets)
+        return array("q", chain.from_iterable(map(repeat, self.citizen_ids, counts)))
+
+    def validate(self: ImportColumns) -> None:
+        """Validate that citizen ids are unique, relatives exist in import and every relation is mutual.
+
+        Citizen can be a relative of itself, such relation is mutual by definition.
+
+        Raises:
+            ValueError: if some of invariants is violated.
+        """
+        sorted_ids = sorted(self.citizen_ids)
+        if any(map(eq, sorted_ids, islice(sorted_ids, 1, None))):
+            raise ValueError("citizen ids in import are not unique")
+
+        unknown_relatives = set(self.relatives).difference(sorted_ids)
+        relation_citizens = self.relation_citizens
+        if unknown_relatives:
+            for citizen_id, relative_id in zip(relation_citizens, self.relatives):
+                if relative_id in unknown_relatives:
+                    raise ValueError(f"citizen {citizen_id} has relative {relative_id} that is not in import")
+
+        forward = pack_pairs(relation_citizens, self.relatives)
+        backward = pack_pairs(self.relatives, relation_citizens)
+        if forward != backward:
+            relative_id, citizen_id = unpack_pair(min(set(backward).difference(forward)))
+            raise ValueError(f"citizen {citizen_id} does not have relation with {relative_id}")
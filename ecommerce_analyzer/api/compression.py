@@ -0,0 +1,148 @@
+"""Compression of response bodies negotiated by `Accept-Encoding` header."""
+from __future__ import annotations
+
+import time
+import zlib
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Histogram
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSION_RATIO = Histogram(
+    "response_compression_ratio",
+    "Size of compressed response bodies relative to their original size.",
+    ["encoding"],
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0),
+)
+COMPRESSION_CPU_SECONDS = Counter(
+    "response_compression_cpu_seconds_total", "CPU time spent on compression of response bodies.", ["encoding"]
+)
+
+# Encodings supported by this process in order of preference, brotli is used only if it is installed.
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """Parse `Accept-Encoding` header into quality values of content codings."""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities
+
+
+async def read_head(chunks: AsyncIterator[bytes], size: int) -> Tuple[bytes, bool]:
+    """Read chunks until at least `size` bytes are read, return them and whether there are no more chunks."""
+    head: List[bytes] = []
+    read = 0
+    while read < size:
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            return b"".join(head), True
+        head.append(chunk)
+        read += len(chunk)
+    return b"".join(head), False
+
+
+async def prepend(head: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Yield already read head of body before the rest of its chunks."""
+    yield head
+    async for chunk in chunks:
+        yield chunk
+
+
+class _Compressor:
+    """Streaming compressor that flushes every chunk, so that client can decompress it at once."""
+
+    def __init__(self: _Compressor, encoding: str, level: int) -> None:
+        self.encoding = encoding
+        self.input_size = 0
+        self.output_size = 0
+        self.cpu_seconds = 0.0
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self: _Compressor, chunk: bytes) -> bytes:
+        started = time.thread_time()
+        if self.encoding == "br":
+            compressed = self._compressor.process(chunk) + self._compressor.flush()
+        else:
+            compressed = self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self._account(started, len(chunk), len(compressed))
+        return compressed
+
+    def finish(self: _Compressor) -> bytes:
+        started = time.thread_time()
+        compressed = self._compressor.finish() if self.encoding == "br" else self._compressor.flush()
+        self._account(started, 0, len(compressed))
+        COMPRESSION_CPU_SECONDS.labels(self.encoding).inc(self.cpu_seconds)
+        if self.input_size:
+            COMPRESSION_RATIO.labels(self.encoding).observe(self.output_size / self.input_size)
+        return compressed
+
+    def _account(self: _Compressor, started: float, input_size: int, output_size: int) -> None:
+        # Compression runs in the thread of event loop, so its thread time is not affected by other requests.
+        self.cpu_seconds += time.thread_time() - started
+        self.input_size += input_size
+        self.output_size += output_size
+
+
+class ResponseCompression:
+    """Negotiates content coding of responses and compresses their bodies."""
+
+    def __init__(self: ResponseCompression, min_size: int, gzip_level: int = 6, brotli_quality: int = 4) -> None:
+        """Initialize compression settings.
+
+        Args:
+            min_size: bodies smaller than this number of bytes are sent as they are.
+            gzip_level: compression level of gzip, from 1 to 9.
+            brotli_quality: compression quality of brotli, from 0 to 11.
+        """
+        self.min_size = min_size
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+
+    def choose_encoding(self: ResponseCompression, accept_encoding: Optional[str]) -> Optional[str]:
+        """Choose the most preferred by client supported encoding or None if body should not be compressed."""
+        if not accept_encoding:
+            return None
+        qualities = parse_accept_encoding(accept_encoding)
+        default = qualities.get("*", 0.0)
+        best, best_quality = None, 0.0
+        for encoding in ENCODINGS:
+            quality = qualities.get(encoding, default)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self: ResponseCompression, body: bytes, encoding: str) -> bytes:
+        """Compress the whole body."""
+        compressor = _Compressor(encoding, self.levels[encoding])
+        return compressor.compress(body) + compressor.finish()
+
+    async def compress_stream(
+        self: ResponseCompression, chunks: AsyncIterator[bytes], encoding: str
+    ) -> AsyncIterator[bytes]:
+        """Compress every chunk of streamed body as soon as it is read."""
+        compressor = _Compressor(encoding, self.levels[encoding])
+        async for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.finish()
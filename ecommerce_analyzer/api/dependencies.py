@@ -1,7 +1,40 @@
 """Contains application's dependencies."""
-from databases import Database
 from db.settings import DataBaseSettings
 
+from .cache import ResponseCache
+from .compression import ResponseCompression
+from .jobs import ImportJobsPool
+from .pool import MonitoredDatabase
+from .replicas import ReplicaRouter
+from .settings import ApiSettings
+
+settings = ApiSettings()
+pool_options = dict(
+    max_size=settings.pool_max_size,
+    adaptive=settings.pool_adaptive,
+    budget=settings.pool_budget,
+    target_wait=settings.pool_target_wait,
+    interval=settings.pool_adjust_interval,
+    max_inactive_connection_lifetime=settings.pool_idle_lifetime,
+)
+
 db_settings = DataBaseSettings()
 dsn = db_settings.dsn()
-database = Database(dsn, min_size=5, max_size=20)
+database = MonitoredDatabase(dsn, "primary", min_size=settings.pool_min_size, **pool_options)
+
+import_jobs_pool = ImportJobsPool(
+    workers=settings.import_workers,
+    queue_size=settings.import_queue_size,
+    method=settings.ingest_method,
+    connections=settings.ingest_connections,
+    progress_interval=settings.import_progress_interval,
+    stale_after=settings.import_stale_after,
+)
+response_cache = ResponseCache(settings.response_cache_size, max_imports=settings.response_cache_imports)
+replica_dsn = db_settings.replica_dsn()
+# Connections to replica are opened on demand, so that application starts while replica is unavailable.
+replica = MonitoredDatabase(replica_dsn, "replica", min_size=0, **pool_options) if replica_dsn is not None else None
+replicas = ReplicaRouter(replica, settings.replica_max_wait)
+response_compression = ResponseCompression(
+    min_size=settings.compression_min_size, gzip_level=settings.gzip_level, brotli_quality=settings.brotli_quality
+)
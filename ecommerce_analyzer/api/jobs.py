@@ -0,0 +1,237 @@
+"""Background import jobs."""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+import analyzer
+from databases import Database
+from db import import_jobs
+from sqlalchemy import Float, Interval, and_, cast, func, select
+from sqlalchemy.sql import ColumnElement, Update
+
+from .scheme import Import, JobPhase
+
+logger = logging.getLogger(__name__)
+
+ABANDONED_ERROR = "import job was abandoned by stopped import service"
+
+
+class RunningJob:
+    """Import job processed by this worker process."""
+
+    def __init__(self: RunningJob, job_id: int, database: Database) -> None:
+        """Initialize job."""
+        self.job_id = job_id
+        self.database = database
+        self.progress = analyzer.ImportProgress()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.import_id: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def as_dict(self: RunningJob) -> dict:
+        """Represent job state as `ImportJob` object."""
+        duration = None
+        if self.started is not None:
+            duration = (self.finished or time.monotonic()) - self.started
+        phase = self.progress.phase
+        if self.error is not None:
+            phase = JobPhase.failed
+        elif self.import_id is not None:
+            phase = JobPhase.done
+        return {
+            "job_id": self.job_id,
+            "phase": phase,
+            "rows_written": self.progress.rows_written,
+            "duration": duration,
+            "import_id": self.import_id,
+            "error": self.error,
+        }
+
+
+class ImportJobsPool:
+    """Bounded pool of background workers that save imports.
+
+    Pool belongs to one worker process. Jobs that are processed by this process report live progress, other
+    processes read it from `import_jobs` table, where it is written every `progress_interval` along with the time of
+    update. Unfinished jobs that weren't updated for `stale_after` are abandoned by stopped process and marked failed.
+    """
+
+    def __init__(
+        self: ImportJobsPool,
+        workers: int,
+        queue_size: int,
+        method: analyzer.IngestMethod = analyzer.IngestMethod.copy,
+        connections: int = 4,
+        progress_interval: float = 1.0,
+        stale_after: float = 30.0,
+    ) -> None:
+        """Initialize pool, workers are started lazily on first job."""
+        self.workers = workers
+        self.queue_size = queue_size
+        self.method = method
+        self.connections = connections
+        self.progress_interval = progress_interval
+        self.stale_after = stale_after
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._jobs: Dict[int, RunningJob] = {}
+
+    def _ensure_started(self: ImportJobsPool) -> None:
+        loop = asyncio.get_event_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._jobs = {}
+        # Workers run in an empty context, so that every worker gets its own database connection instead
+        # of sharing the one bound to the context of the request that started them.
+        empty_context = contextvars.Context()
+        self._tasks = [empty_context.run(loop.create_task, self._work()) for _ in range(self.workers)]
+        self._tasks.append(empty_context.run(loop.create_task, self._report_progress()))
+
+    async def submit(self: ImportJobsPool, import_obj: Import, database: Database) -> dict:
+        """Register job and put it into queue.
+
+        Raises:
+            asyncio.QueueFull: if there are too many pending jobs.
+        """
+        self._ensure_started()
+        if self._queue.full():
+            raise asyncio.QueueFull
+        query = import_jobs.insert().values(phase=JobPhase.queued.value).returning(import_jobs.c.job_id)
+        job_id = await database.fetch_val(query)
+        job = RunningJob(job_id, database)
+        self._jobs[job_id] = job
+        self._queue.put_nowait((job, import_obj))
+        return job.as_dict()
+
+    async def get(self: ImportJobsPool, job_id: int, database: Database) -> Optional[dict]:
+        """Get job state, live if job is processed by this process."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.as_dict()
+        await database.execute(self._fail_abandoned_query(import_jobs.c.job_id == job_id))
+        # Duration of unfinished job is counted by the database clock, as its start time is.
+        finished_at = func.coalesce(import_jobs.c.finished_at, func.now())
+        duration = cast(func.extract("epoch", finished_at - import_jobs.c.started_at), Float).label("duration")
+        row = await database.fetch_one(select([import_jobs, duration]).where(import_jobs.c.job_id == job_id))
+        if row is None:
+            return None
+        return {
+            "job_id": row["job_id"],
+            "phase": row["phase"],
+            "rows_written": row["rows_written"],
+            "duration": row["duration"],
+            "import_id": row["import_id"],
+            "error": row["error"],
+        }
+
+    async def fail_abandoned(self: ImportJobsPool, database: Database) -> None:
+        """Mark unfinished jobs of stopped processes as failed, jobs of running processes are updated in time."""
+        await database.execute(self._fail_abandoned_query())
+
+    async def report_progress(self: ImportJobsPool) -> None:
+        """Write progress of jobs of this process to `import_jobs` table."""
+        for job in list(self._jobs.values()):
+            state = job.as_dict()
+            query = (
+                import_jobs.update()
+                .where(and_(import_jobs.c.job_id == job.job_id, import_jobs.c.finished_at.is_(None)))
+                .values(phase=state["phase"], rows_written=state["rows_written"], updated_at=func.now())
+            )
+            await job.database.execute(query)
+
+    async def stop(self: ImportJobsPool) -> None:
+        """Cancel workers, unfinished jobs are marked as failed."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        for job in list(self._jobs.values()):
+            job.error = "import service stopped"
+            await self._finish(job)
+
+    def _fail_abandoned_query(self: ImportJobsPool, *where: ColumnElement) -> Update:
+        return (
+            import_jobs.update()
+            .where(
+                and_(
+                    import_jobs.c.finished_at.is_(None),
+                    import_jobs.c.updated_at < func.now() - cast(timedelta(seconds=self.stale_after), Interval),
+                    *where,
+                )
+            )
+            .values(phase=JobPhase.failed.value, error=ABANDONED_ERROR, finished_at=func.now())
+        )
+
+    async def _report_progress(self: ImportJobsPool) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            try:
+                await self.report_progress()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to report progress of import jobs")
+
+    async def _finish(self: ImportJobsPool, job: RunningJob) -> None:
+        state = job.as_dict()
+        query = (
+            import_jobs.update()
+            .where(import_jobs.c.job_id == job.job_id)
+            .values(
+                phase=state["phase"],
+                rows_written=state["rows_written"],
+                import_id=job.import_id,
+                error=job.error,
+                finished_at=func.now(),
+                updated_at=func.now(),
+            )
+        )
+        await job.database.execute(query)
+        self._jobs.pop(job.job_id, None)
+
+    async def _start(self: ImportJobsPool, job: RunningJob) -> None:
+        job.progress.phase = JobPhase.citizens
+        query = (
+            import_jobs.update()
+            .where(import_jobs.c.job_id == job.job_id)
+            .values(phase=job.progress.phase.value, started_at=func.now(), updated_at=func.now())
+        )
+        await job.database.execute(query)
+        job.started = time.monotonic()
+
+    async def _run(self: ImportJobsPool, job: RunningJob, import_obj: Import) -> None:
+        await self._start(job)
+        try:
+            job.import_id = await analyzer.save_import(
+                import_obj, job.database, method=self.method, progress=job.progress, connections=self.connections
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Import job %d failed", job.job_id)
+            job.error = str(e) or e.__class__.__name__
+        job.finished = time.monotonic()
+        await self._finish(job)
+
+    async def _work(self: ImportJobsPool) -> None:
+        queue = self._queue
+        while True:
+            job_item: Tuple[RunningJob, Import] = await queue.get()
+            try:
+                await self._run(*job_item)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to update state of import job %d", job_item[0].job_id)
+            finally:
+                queue.task_done()
@@ -0,0 +1,229 @@
+"""Connection pools that export their metrics and adapt their size to waits for connections."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections import deque
+from contextlib import suppress
+from typing import Any, Deque, List, Optional, Tuple
+
+import asyncpg
+from databases import Database
+from prometheus_client import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+APPLICATION_NAME = "ecommerce_analyzer"
+
+POOL_CONNECTIONS = Gauge("db_pool_connections", "Connections of pool opened on server.", ["database"])
+POOL_LIMIT = Gauge("db_pool_limit", "Maximum number of connections pool lends at once.", ["database"])
+POOL_IN_USE = Gauge("db_pool_in_use", "Connections lent by pool.", ["database"])
+POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting for connection of pool, including connecting.",
+    ["database"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+# Connections of this process and of other processes of application, pools name their connections by process.
+COUNT_CONNECTIONS = """
+SELECT count(*) FILTER (WHERE application_name = $1),
+       count(*) FILTER (WHERE starts_with(application_name, $2) AND application_name <> $1)
+FROM pg_stat_activity
+"""
+
+
+class LimitedPool:
+    """Proxy of asyncpg pool that lends at most `limit` connections at once and measures waits for them.
+
+    Waiting tasks get connections in order of arrival, released connection is handed over to the first of them, so
+    that tasks that release and acquire connections in a loop don't starve others.
+    """
+
+    def __init__(self: LimitedPool, pool: asyncpg.pool.Pool, name: str, limit: int) -> None:
+        """Initialize proxy of connected pool.
+
+        Args:
+            pool: asyncpg pool, its `max_size` is the upper bound of the limit.
+            name: name of database in metrics.
+            limit: initial maximum number of connections lent at once.
+        """
+        self.pool = pool
+        self.name = name
+        self.limit = limit
+        self.in_use = 0
+        # Maximum number of connections lent at once and waits for connections since the last adjustment.
+        self.peak = 0
+        self.waits: List[float] = []
+        # Futures of tasks waiting for their turn with start times of their waits.
+        self.waiting: Deque[Tuple[asyncio.Future, float]] = deque()
+        POOL_LIMIT.labels(name).set(limit)
+
+    def __getattr__(self: LimitedPool, name: str) -> Any:
+        """Delegate other methods to asyncpg pool."""
+        return getattr(self.pool, name)
+
+    async def acquire(self: LimitedPool) -> asyncpg.Connection:
+        """Wait until less than `limit` connections are lent and acquire connection."""
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        if self.in_use < self.limit and not self.waiting:
+            self._lend()
+        else:
+            turn = loop.create_future()
+            self.waiting.append((turn, started))
+            try:
+                await turn
+            except BaseException:
+                if turn.done() and not turn.cancelled():
+                    self._return()
+                else:
+                    self.waiting.remove((turn, started))
+                raise
+        try:
+            connection = await self.pool.acquire()
+        except BaseException:
+            self._return()
+            raise
+        wait = loop.time() - started
+        self.waits.append(wait)
+        POOL_WAIT.labels(self.name).observe(wait)
+        return connection
+
+    async def release(self: LimitedPool, connection: asyncpg.Connection) -> None:
+        """Release connection to asyncpg pool and hand its turn over to the first waiting task."""
+        try:
+            await self.pool.release(connection)
+        finally:
+            self._return()
+
+    def set_limit(self: LimitedPool, limit: int) -> None:
+        """Change maximum number of connections lent at once, connections lent above it are not taken back."""
+        self.limit = limit
+        POOL_LIMIT.labels(self.name).set(limit)
+        self._wake_up()
+
+    def _lend(self: LimitedPool) -> None:
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+        POOL_IN_USE.labels(self.name).inc()
+
+    def _return(self: LimitedPool) -> None:
+        self.in_use -= 1
+        POOL_IN_USE.labels(self.name).dec()
+        self._wake_up()
+
+    def _wake_up(self: LimitedPool) -> None:
+        while self.waiting and self.in_use < self.limit:
+            turn, _ = self.waiting.popleft()
+            if not turn.done():
+                self._lend()
+                turn.set_result(None)
+
+
+class MonitoredDatabase(Database):
+    """Database with connection pool that exports its metrics and can adapt its size to waits for connections.
+
+    In adaptive mode pool lends from `min_size` to `max_size` connections at once. Every `interval` the limit grows if
+    90th percentile of waits is longer than `target_wait` or if a task is waiting longer than that, by the number of
+    waiting tasks but at least by a quarter, and shrinks by one if nobody waited and not all lent connections were
+    used. The limit doesn't grow above `budget` minus connections of other processes of application to the same
+    server and shrinks down to it, so processes share the budget without coordination. Processes that grow at the
+    same moment may exceed the budget by their steps, so the budget should leave room below `max_connections`. Idle
+    connections above the limit are closed by asyncpg after `max_inactive_connection_lifetime`.
+    """
+
+    def __init__(
+        self: MonitoredDatabase,
+        url: str,
+        name: str,
+        min_size: int,
+        max_size: int,
+        adaptive: bool = False,
+        budget: Optional[int] = None,
+        target_wait: float = 0.005,
+        interval: float = 1.0,
+        **options: Any,
+    ) -> None:
+        """Initialize database, pool is started by `connect`.
+
+        Args:
+            url: dsn of database.
+            name: name of database in metrics.
+            min_size: number of connections opened on start, it is also the lower bound of the limit.
+            max_size: size of asyncpg pool, the limit is always `max_size` if pool is not adaptive.
+            adaptive: whether the limit is changed by waits for connections.
+            budget: maximum number of connections of all processes of application to the server, unlimited if None.
+            target_wait: seconds of waits for connections the limit is raised at.
+            interval: seconds between updates of number of connections and adjustments of the limit.
+            options: other options of asyncpg pool.
+        """
+        self.name = name
+        self.application_name = f"{APPLICATION_NAME}:{name}:{os.getpid()}"
+        super().__init__(
+            url,
+            min_size=min_size,
+            max_size=max_size,
+            server_settings={"application_name": self.application_name},
+            **options,
+        )
+        # Pool lends at least one connection, even if none are opened on start.
+        self.min_limit = max(min_size, 1)
+        self.max_size = max_size
+        self.adaptive = adaptive
+        self.budget = budget
+        self.target_wait = target_wait
+        self.interval = interval
+        self.pool: Optional[LimitedPool] = None
+        self._monitor: Optional[asyncio.Task] = None
+
+    async def connect(self: MonitoredDatabase) -> None:
+        """Start connection pool and its monitoring."""
+        await super().connect()
+        self.pool = LimitedPool(self._backend._pool, self.name, self.min_limit if self.adaptive else self.max_size)
+        self._backend._pool = self.pool
+        self._monitor = asyncio.create_task(self._monitor_pool())
+
+    async def disconnect(self: MonitoredDatabase) -> None:
+        """Stop monitoring and close connection pool."""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._monitor
+            self._monitor = None
+        await super().disconnect()
+
+    async def adjust(self: MonitoredDatabase) -> None:
+        """Update number of connections of pool and, in adaptive mode, its limit by waits since the last call."""
+        pool = self.pool
+        # Connection is taken from asyncpg pool directly, so that the limit doesn't delay adjustment, hence pool may
+        # have one connection above the limit.
+        own, others = await pool.pool.fetchrow(COUNT_CONNECTIONS, self.application_name, f"{APPLICATION_NAME}:")
+        POOL_CONNECTIONS.labels(self.name).set(own)
+        waits, pool.waits = sorted(pool.waits), []
+        peak, pool.peak = pool.peak, pool.in_use
+        if not self.adaptive:
+            return
+
+        now = asyncio.get_event_loop().time()
+        waiting = now - pool.waiting[0][1] if pool.waiting else 0.0
+        limit = pool.limit
+        if waiting > self.target_wait or (waits and waits[int(len(waits) * 0.9)] > self.target_wait):
+            limit += max(len(pool.waiting), limit // 4, 1)
+        elif (not waits or waits[-1] <= self.target_wait) and peak < limit:
+            limit -= 1
+        if self.budget is not None:
+            limit = min(limit, self.budget - others)
+        limit = max(self.min_limit, min(limit, self.max_size))
+        if limit != pool.limit:
+            logger.debug("Limit of %s pool changed from %s to %s", self.name, pool.limit, limit)
+            pool.set_limit(limit)
+
+    async def _monitor_pool(self: MonitoredDatabase) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.adjust()
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                logger.debug("Can't count connections of %s pool", self.name, exc_info=True)
@@ -0,0 +1,74 @@
+"""Routing of reads of imports to read replica."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional
+
+import analyzer
+import asyncpg
+from databases import Database
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+ROUTED_READS = Counter("routed_reads_total", "Reads of imports by database they were routed to.", ["database"])
+
+
+class ReplicaRouter:
+    """Chooses database to read import from, replica is chosen when it has replayed the version of import.
+
+    Responses are cached by version of import got from primary, so replica that lags behind could put stale
+    responses into cache. Reads are routed to replica only when it has the version already, they wait for replica
+    to catch up for a while and fall back to primary after that.
+    """
+
+    def __init__(
+        self: ReplicaRouter, replica: Optional[Database], max_wait: float, poll_interval: float = 0.01
+    ) -> None:
+        """Initialize router.
+
+        Args:
+            replica: database replicated from primary, all reads are routed to primary if it is None.
+            max_wait: maximum seconds to wait for replica to replay the version, primary is chosen at once if 0.
+            poll_interval: seconds between checks of version on replica.
+        """
+        self.replica = replica
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+
+    async def connect(self: ReplicaRouter) -> None:
+        """Start connection pool of replica."""
+        if self.replica is not None:
+            await self.replica.connect()
+
+    async def disconnect(self: ReplicaRouter) -> None:
+        """Close connection pool of replica."""
+        if self.replica is not None:
+            await self.replica.disconnect()
+
+    async def choose(self: ReplicaRouter, import_id: int, version: Optional[int], primary: Database) -> Database:
+        """Choose database to read import from.
+
+        Args:
+            import_id: import to read.
+            version: version of import got from primary, primary is chosen if it is None, as there is no import.
+            primary: database to fall back to, it is also chosen at once if replica is unavailable.
+        """
+        if self.replica is not None and version is not None:
+            loop = asyncio.get_event_loop()
+            deadline = loop.time() + self.max_wait
+            while True:
+                try:
+                    replica_version = await analyzer.get_import_version(import_id, self.replica)
+                except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                    logger.warning("Can't get version of import %s from replica", import_id, exc_info=True)
+                    break
+                if replica_version is not None and replica_version >= version:
+                    ROUTED_READS.labels("replica").inc()
+                    return self.replica
+                if loop.time() + self.poll_interval > deadline:
+                    break
+                await asyncio.sleep(self.poll_interval)
+        ROUTED_READS.labels("primary").inc()
+        return primary
@@ -6,6 +6,11 @@ Contains some business logic in form of validators.
 __all__ = [
     "Citizen",
     "CitizenPatch",
+    "CitizenPatchItem",
+    "CitizensPatch",
+    "PatchedCitizens",
+    "CitizenChange",
+    "ImportChanges",
     "CitizenPresents",
     "Import",
     "PresentsByMonth",
@@ -14,12 +19,17 @@ __all__ = [
     "SavedImport",
     "Percentiles",
     "Presents",
+    "JobPhase",
+    "ImportJob",
+    "SavedImportJob",
 ]
 from datetime import date
 from enum import Enum
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel, Field, PositiveInt, confloat, constr, create_model, root_validator, validator
+from pydantic import BaseModel, Field, PositiveInt, confloat, conlist, constr, create_model, root_validator, validator
+
+from .columns import ImportColumns
 
 
 class Gender(str, Enum):
@@ -93,6 +103,47 @@ class CitizenPatch(BaseCitizen):
         return values
 
 
+class CitizenPatchItem(CitizenPatch):
+    """Patch of citizen given together with its id."""
+
+    citizen_id: int = Field(...)
+
+    @root_validator(pre=True)
+    def assert_any(cls, values: Any) -> Any:
+        """Validate that at least one of fields besides id is not empty."""
+        if all(v is None for k, v in values.items() if k != "citizen_id"):
+            raise ValueError("at least one of fields must have value")
+        return values
+
+
+class CitizensPatch(BaseModel):
+    """Patches of citizens, they are applied in the given order."""
+
+    data: conlist(CitizenPatchItem, min_items=1)
+
+
+class PatchedCitizens(BaseModel):
+    """Citizens after patches."""
+
+    data: List[Citizen]
+
+
+class CitizenChange(BaseModel):
+    """Change of citizen made by patch, relatives are given by ids added to and removed from them."""
+
+    version: PositiveInt = Field(..., description="Version of import created by the patch")
+    citizen_id: int
+    fields: Dict[str, Any] = Field(..., description="New values of other changed fields")
+    relatives_added: List[int]
+    relatives_removed: List[int]
+
+
+class ImportChanges(BaseModel):
+    """Changes of citizens in order of versions."""
+
+    data: List[CitizenChange]
+
+
 class Import(BaseModel):
     """Import model."""
 
@@ -105,25 +156,9 @@ class Import(BaseModel):
         use_enum_values = True
 
     @validator("data")
-    def citizens_ids_unique(cls, v: List[Citizen]) -> List[Citizen]:
-        """Validate that every citizen in import has unique id."""
-        citizen_ids_set = set()
-        citizen_ids = []
-        for citizen in v:
-            citizen_ids.append(citizen.citizen_id)
-            citizen_ids_set.add(citizen.citizen_id)
-        if len(citizen_ids) > len(citizen_ids_set):
-            raise ValueError("citizen ids in import are not unique")
-        return v
-
-    @validator("data")
-    def citizens_relatives_mutual(cls, v: List[Citizen]) -> List[Citizen]:
-        """Validate that every relation is mutual."""
-        relatives = {citizen.citizen_id: set(citizen.relatives) for citizen in v}
-        for citizen_id, relative_ids in relatives.items():
-            for relative_id in relative_ids:
-                if citizen_id not in relatives.get(relative_id, set()):
-                    raise ValueError(f"citizen {citizen_id} does not have relation with {relative_id}")
+    def citizens_consistent(cls, v: List[Citizen]) -> List[Citizen]:
+        """Validate that citizen ids are unique and every relation is mutual using columnar representation."""
+        ImportColumns.from_citizens(v).validate()
         return v
 
 
@@ -169,3 +204,48 @@ class Percentiles(BaseModel):
     """Age percentiles."""
 
     data: List[TownPercentiles]
+
+
+class ImportSummary(BaseModel):
+    """Results of read endpoints, only requested ones are present."""
+
+    citizens: Optional[List[Citizen]]
+    birthdays: Optional[PresentsByMonth]
+    age_statistics: Optional[List[TownPercentiles]]
+
+
+class Summary(BaseModel):
+    """Summary of import."""
+
+    data: ImportSummary
+
+
+class JobPhase(str, Enum):
+    """Phase of background import job."""
+
+    queued = "queued"
+    citizens = "citizens"
+    done = "done"
+    failed = "failed"
+
+
+class ImportJob(BaseModel):
+    """State of background import job."""
+
+    job_id: PositiveInt
+    phase: JobPhase
+    rows_written: int = Field(..., ge=0)
+    duration: Optional[confloat(ge=0)] = Field(None, description="Seconds spent on saving import")
+    import_id: Optional[PositiveInt]
+    error: Optional[str]
+
+    class Config:
+        """Model config."""
+
+        use_enum_values = True
+
+
+class SavedImportJob(BaseModel):
+    """Background import job."""
+
+    data: ImportJob
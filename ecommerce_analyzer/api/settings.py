@@ -0,0 +1,41 @@
+"""Settings of API service."""
+from enum import Enum
+
+from analyzer import IngestMethod
+from pydantic import BaseSettings, Field
+
+
+class RenderMethod(str, Enum):
+    """Strategy used to render response documents of read endpoints."""
+
+    python = "python"
+    database = "database"
+
+
+class ApiSettings(BaseSettings):
+    """API settings."""
+
+    max_import_size: int = Field(256 * 1024 * 1024, env="MAX_IMPORT_SIZE")
+    import_batch_size: int = Field(1000, env="IMPORT_BATCH_SIZE")
+    import_workers: int = Field(2, env="IMPORT_WORKERS")
+    import_queue_size: int = Field(8, env="IMPORT_QUEUE_SIZE")
+    import_progress_interval: float = Field(1.0, env="IMPORT_PROGRESS_INTERVAL")
+    import_stale_after: float = Field(30.0, env="IMPORT_STALE_AFTER")
+    ingest_method: IngestMethod = Field(IngestMethod.copy, env="INGEST_METHOD")
+    ingest_connections: int = Field(4, env="INGEST_CONNECTIONS")
+    response_cache_size: int = Field(64 * 1024 * 1024, env="RESPONSE_CACHE_SIZE")
+    response_cache_imports: int = Field(100_000, env="RESPONSE_CACHE_IMPORTS")
+    render_method: RenderMethod = Field(RenderMethod.database, env="RENDER_METHOD")
+    compression_min_size: int = Field(1024, env="COMPRESSION_MIN_SIZE")
+    gzip_level: int = Field(6, env="GZIP_LEVEL")
+    brotli_quality: int = Field(4, env="BROTLI_QUALITY")
+    replica_max_wait: float = Field(0.5, env="REPLICA_MAX_WAIT")
+    # Pool of every process opens up to `pool_max_size` connections, in adaptive mode it lends from `pool_min_size`
+    # to `pool_max_size` of them by waits for connections, while all processes stay within `pool_budget`.
+    pool_min_size: int = Field(5, env="POOL_MIN_SIZE")
+    pool_max_size: int = Field(20, env="POOL_MAX_SIZE")
+    pool_adaptive: bool = Field(False, env="POOL_ADAPTIVE")
+    pool_budget: int = Field(150, env="POOL_BUDGET")
+    pool_target_wait: float = Field(0.005, env="POOL_TARGET_WAIT")
+    pool_adjust_interval: float = Field(1.0, env="POOL_ADJUST_INTERVAL")
+    pool_idle_lifetime: float = Field(60.0, env="POOL_IDLE_LIFETIME")
@@ -0,0 +1,226 @@
+"""Incremental parsing and validation of import request bodies and incremental rendering of responses."""
+from __future__ import annotations
+
+import codecs
+import json
+from typing import Any, AsyncIterable, AsyncIterator, List, Mapping
+
+from fastapi import HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+
+from .scheme import Citizen
+
+WHITESPACE = " \t\n\r"
+# Same JSON format as `JSONResponse` renders.
+encode_json = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode
+
+
+class ImportStreamParser:
+    """Push parser for `{"data": [...]}` documents.
+
+    Chunks of raw body are fed into parser and every completely received element of `data` array is returned
+    as soon as it is available, so only the current element has to be kept in memory.
+    """
+
+    def __init__(self: ImportStreamParser) -> None:
+        """Initialize parser."""
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "document"
+        self._key = None
+        self.data_found = False
+
+    def feed(self: ImportStreamParser, chunk: bytes) -> List[Any]:
+        """Consume chunk of body and return completed `data` elements."""
+        self._buffer = self._buffer[self._pos :] + self._text_decoder.decode(chunk)
+        self._pos = 0
+        return self._parse(final=False)
+
+    def close(self: ImportStreamParser) -> List[Any]:
+        """Finish parsing and return remaining `data` elements.
+
+        Raises:
+            ValueError: if document is malformed or incomplete.
+        """
+        self._buffer = self._buffer[self._pos :] + self._text_decoder.decode(b"", final=True)
+        self._pos = 0
+        items = self._parse(final=True)
+        if self._state != "end":
+            raise ValueError("unexpected end of document")
+        return items
+
+    def _decode_value(self: ImportStreamParser, final: bool) -> Any:
+        """Decode JSON value at current position or return self if more data is required."""
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise ValueError(f"malformed JSON value at position {self._pos}")
+            return self
+        # Value at the end of the buffer may be a truncated number or literal.
+        if end == len(self._buffer) and not final:
+            return self
+        self._pos = end
+        return value
+
+    def _expect(self: ImportStreamParser, char: str, expected: str) -> None:
+        if char not in expected:
+            raise ValueError(f"unexpected character {char!r} at position {self._pos}")
+        self._pos += 1
+
+    def _parse(self: ImportStreamParser, final: bool) -> List[Any]:  # noqa: C901
+        items = []
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos == len(self._buffer):
+                return items
+            char = self._buffer[self._pos]
+
+            if self._state == "document":
+                self._expect(char, "{")
+                self._state = "first_key"
+            elif self._state in ("first_key", "key"):
+                if char == "}" and self._state == "first_key":
+                    self._pos += 1
+                    self._state = "end"
+                    continue
+                if char != '"':
+                    raise ValueError(f"unexpected character {char!r} at position {self._pos}")
+                key = self._decode_value(final)
+                if key is self:
+                    return items
+                self._key = key
+                self._state = "colon"
+            elif self._state == "colon":
+                self._expect(char, ":")
+                self._state = "value"
+            elif self._state == "value" and self._key == "data":
+                self._expect(char, "[")
+                self.data_found = True
+                self._state = "first_item"
+            elif self._state == "value":
+                if self._decode_value(final) is self:
+                    return items
+                self._state = "members"
+            elif self._state == "first_item" and char == "]":
+                self._pos += 1
+                self._state = "members"
+            elif self._state in ("first_item", "item"):
+                item = self._decode_value(final)
+                if item is self:
+                    return items
+                items.append(item)
+                self._state = "items"
+            elif self._state == "items":
+                self._expect(char, ",]")
+                self._state = "item" if char == "," else "members"
+            elif self._state == "members":
+                self._expect(char, ",}")
+                self._state = "key" if char == "," else "end"
+            else:
+                raise ValueError(f"unexpected character {char!r} after end of document")
+
+
+def import_validation_error(exc: Exception, *loc: Any) -> RequestValidationError:
+    """Wrap error of import data validation into the same exception FastAPI raises for invalid body."""
+    return RequestValidationError([ErrorWrapper(exc, loc=("body", "data", *loc))])
+
+
+async def iter_citizens_batches(request: Request, batch_size: int, max_size: int) -> AsyncIterator[List[Citizen]]:
+    """Read import body incrementally and yield validated citizens in batches of at most `batch_size`.
+
+    Import-wide invariants are not checked here, they are validated on columnar representation of the import.
+
+    Raises:
+        HTTPException: if body is larger than `max_size` bytes or is not a valid JSON document.
+        RequestValidationError: if some citizen doesn't pass validation.
+    """
+    parser = ImportStreamParser()
+    batch: List[Citizen] = []
+    index = 0
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_size:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Import is too large")
+        try:
+            # Starlette marks the end of body with an empty chunk.
+            items = parser.feed(chunk) if chunk else parser.close()
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="There was an error parsing the body")
+
+        for item in items:
+            try:
+                citizen = Citizen.parse_obj(item)
+            except ValidationError as e:
+                raise import_validation_error(e, index)
+            if citizen.relatives is None:
+                # Relations of import are validated on columns, as they are for `Import`, which needs relatives.
+                raise import_validation_error(ValueError("relatives are required"), index, "relatives")
+            batch.append(citizen)
+            index += 1
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    if not parser.data_found:
+        raise import_validation_error(ValueError("field required"))
+    if batch:
+        yield batch
+
+
+async def iter_json_list(
+    items: AsyncIterable[Any], chunk_size: int = 64 * 1024, prefix: str = '{"data":[', suffix: str = "]}"
+) -> AsyncIterator[bytes]:
+    """Render items as JSON list between `prefix` and `suffix` in chunks of about `chunk_size` bytes."""
+    parts = [prefix]
+    size = 0
+    separator = ""
+    async for item in items:
+        part = separator + encode_json(item)
+        separator = ","
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(parts).encode()
+            parts = []
+            size = 0
+    parts.append(suffix)
+    yield "".join(parts).encode()
+
+
+async def iter_citizens_json(
+    rows: AsyncIterable[Mapping[str, Any]], chunk_size: int = 64 * 1024, prefix: str = '{"data":[', suffix: str = "]}"
+) -> AsyncIterator[bytes]:
+    """Render citizens rows as `{"data": [...]}` document in chunks of about `chunk_size` bytes.
+
+    Rows are read from database, so unlike responses with `response_model` they are not validated, but document
+    is the same as `Import` model is rendered to. List of citizens can be put into other document with `prefix`
+    and `suffix`.
+    """
+
+    async def citizens() -> AsyncIterator[dict]:
+        async for row in rows:
+            citizen = dict(row)
+            if "birth_date" in citizen:
+                citizen["birth_date"] = citizen["birth_date"].isoformat()
+            yield citizen
+
+    async for chunk in iter_json_list(citizens(), chunk_size, prefix, suffix):
+        yield chunk
+
+
+async def iter_changes_json(rows: AsyncIterable[Mapping[str, Any]]) -> AsyncIterator[bytes]:
+    """Render changes rows as `{"data": [...]}` document, it is the same as `ImportChanges` model is rendered to."""
+
+    async def changes() -> AsyncIterator[dict]:
+        async for row in rows:
+            yield dict(row)
+
+    async for chunk in iter_json_list(changes()):
+        yield chunk
@@ -1,3 +1,3 @@
 """Module that contains database models, settings and alembic migrations."""
-__all__ = ["metadata", "citizens", "imports", "relations"]
-from .tables import citizens, imports, metadata, relations
+__all__ = ["metadata", "citizens", "presents", "town_birth_dates", "imports", "import_jobs", "citizen_changes"]
+from .tables import citizen_changes, citizens, import_jobs, imports, metadata, presents, town_birth_dates
@@ -0,0 +1,60 @@
+"""store relatives as array in citizens
+
+Revision ID: 24bc6d12c880
+Revises: 2a6afe046f1f
+Create Date: 2026-10-17 22:41:26.704125
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "24bc6d12c880"
+down_revision = "2a6afe046f1f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "citizens",
+        sa.Column("relatives", postgresql.ARRAY(sa.Integer()), server_default="{}", nullable=False),
+    )
+    op.execute(
+        """
+        UPDATE citizens SET relatives = r.relatives
+        FROM (
+            SELECT import_id, citizen, array_agg(relative ORDER BY relative) AS relatives
+            FROM relations
+            GROUP BY import_id, citizen
+        ) AS r
+        WHERE citizens.import_id = r.import_id AND citizens.citizen_id = r.citizen
+        """
+    )
+    op.drop_table("relations")
+
+
+def downgrade():
+    op.create_table(
+        "relations",
+        sa.Column("import_id", sa.Integer(), nullable=False),
+        sa.Column("citizen", sa.Integer(), nullable=False),
+        sa.Column("relative", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["import_id", "citizen"],
+            ["citizens.import_id", "citizens.citizen_id"],
+            name=op.f("fk__relations__import_id_citizen__citizens"),
+        ),
+        sa.ForeignKeyConstraint(
+            ["import_id", "relative"],
+            ["citizens.import_id", "citizens.citizen_id"],
+            name=op.f("fk__relations__import_id_relative__citizens"),
+        ),
+        sa.PrimaryKeyConstraint("import_id", "citizen", "relative", name=op.f("pk__relations")),
+        postgresql_partition_by="LIST (import_id)",
+    )
+    for (import_id,) in op.get_bind().execute(sa.text("SELECT import_id FROM imports")).fetchall():
+        op.execute(f"CREATE TABLE relations_{import_id} PARTITION OF relations FOR VALUES IN ({import_id})")
+    op.execute("INSERT INTO relations SELECT import_id, citizen_id, unnest(relatives) FROM citizens")
+    op.drop_column("citizens", "relatives")
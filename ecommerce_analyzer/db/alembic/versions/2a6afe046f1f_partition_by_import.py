@@ -0,0 +1,82 @@
+"""partition citizens and relations by import
+
+Revision ID: 2a6afe046f1f
+Revises: d8bb46081319
+Create Date: 2026-10-17 22:04:13.518230
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "2a6afe046f1f"
+down_revision = "d8bb46081319"
+branch_labels = None
+depends_on = None
+
+
+def create_tables(**kwargs):
+    """Create citizens and relations tables as in the initial migration."""
+    op.create_table(
+        "citizens",
+        sa.Column("import_id", sa.Integer(), nullable=False),
+        sa.Column("citizen_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("town", sa.String(length=256), nullable=False),
+        sa.Column("street", sa.String(length=256), nullable=False),
+        sa.Column("building", sa.String(length=256), nullable=False),
+        sa.Column("apartment", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=256), nullable=False),
+        sa.Column("birth_date", sa.Date(), nullable=False),
+        sa.Column("gender", postgresql.ENUM("male", "female", name="gender", create_type=False), nullable=False),
+        sa.ForeignKeyConstraint(["import_id"], ["imports.import_id"], name=op.f("fk__citizens__import_id__imports")),
+        sa.PrimaryKeyConstraint("import_id", "citizen_id", name=op.f("pk__citizens")),
+        **kwargs,
+    )
+    op.create_table(
+        "relations",
+        sa.Column("import_id", sa.Integer(), nullable=False),
+        sa.Column("citizen", sa.Integer(), nullable=False),
+        sa.Column("relative", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["import_id", "citizen"],
+            ["citizens.import_id", "citizens.citizen_id"],
+            name=op.f("fk__relations__import_id_citizen__citizens"),
+        ),
+        sa.ForeignKeyConstraint(
+            ["import_id", "relative"],
+            ["citizens.import_id", "citizens.citizen_id"],
+            name=op.f("fk__relations__import_id_relative__citizens"),
+        ),
+        sa.PrimaryKeyConstraint("import_id", "citizen", "relative", name=op.f("pk__relations")),
+        **kwargs,
+    )
+
+
+def replace_tables(suffix, **kwargs):
+    """Rename current tables, create new ones and move all rows into them."""
+    for table in ("relations", "citizens"):
+        op.rename_table(table, f"{table}_{suffix}")
+        op.execute(f"ALTER TABLE {table}_{suffix} RENAME CONSTRAINT pk__{table} TO pk__{table}_{suffix}")
+    create_tables(**kwargs)
+
+
+def move_rows(suffix):
+    """Copy rows from renamed tables and drop them."""
+    for table in ("citizens", "relations"):
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_{suffix}")
+    op.drop_table(f"relations_{suffix}")
+    op.drop_table(f"citizens_{suffix}")
+
+
+def upgrade():
+    replace_tables("unpartitioned", postgresql_partition_by="LIST (import_id)")
+    for (import_id,) in op.get_bind().execute(sa.text("SELECT import_id FROM imports")).fetchall():
+        for table in ("citizens", "relations"):
+            op.execute(f"CREATE TABLE {table}_{import_id} PARTITION OF {table} FOR VALUES IN ({import_id})")
+    move_rows("unpartitioned")
+
+
+def downgrade():
+    replace_tables("partitioned")
+    move_rows("partitioned")
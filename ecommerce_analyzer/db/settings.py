@@ -1,4 +1,6 @@
 """Settings for database connection."""
+from typing import Optional
+
 from pydantic import BaseSettings, Field
 
 MAX_QUERY_ARGS = 32767
@@ -12,11 +14,22 @@ class DataBaseSettings(BaseSettings):
     host: str = Field(..., env="POSTGRES_HOST")
     port: int = Field(..., env="POSTGRES_PORT")
     db: str = Field(..., env="POSTGRES_DB")
+    # Hot standby that replicates the database by streaming replication, reads are not routed to it if not set.
+    replica_host: Optional[str] = Field(None, env="POSTGRES_REPLICA_HOST")
+    replica_port: Optional[int] = Field(None, env="POSTGRES_REPLICA_PORT")
 
     def dsn(self) -> str:
         """Generate dsn string."""
         return f"postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.db}"
 
+    def replica_dsn(self) -> Optional[str]:
+        """Generate dsn string of replica with the same credentials, None if replica is not configured."""
+        if self.replica_host is None:
+            return None
+        return (
+            f"postgresql://{self.user}:{self.password}@{self.replica_host}:{self.replica_port or self.port}/{self.db}"
+        )
+
     class Config:
         """Config."""
 
@@ -1,6 +1,11 @@
-"""Database models."""
-from sqlalchemy import Column, Date, ForeignKey, ForeignKeyConstraint, Integer, String, Table
-from sqlalchemy.dialects.postgresql import ENUM
+"""Database models.
+
+Citizens and aggregates of imports are partitioned by `import_id`, every import has its own partitions named
+`<table>_<import_id>`, they are created and attached by `analyzer.save_import`. Relations are stored in both
+citizens of the pair.
+"""
+from sqlalchemy import Column, Date, DateTime, ForeignKey, Integer, String, Table, Text, func
+from sqlalchemy.dialects.postgresql import ARRAY, ENUM, JSONB
 
 from .base import metadata
 
@@ -16,18 +21,70 @@ citizens = Table(
     Column("name", String(256), nullable=False),
     Column("birth_date", Date, nullable=False),
     Column("gender", ENUM("male", "female", name="gender", create_type=False), nullable=False),
+    Column("relatives", ARRAY(Integer), nullable=False, server_default="{}"),
+    postgresql_partition_by="LIST (import_id)",
+)
+
+
+# Number of presents citizen buys to its relatives born in the month.
+presents = Table(
+    "presents",
+    metadata,
+    Column("import_id", Integer, ForeignKey("imports.import_id"), primary_key=True),
+    Column("citizen_id", Integer, primary_key=True),
+    Column("month", Integer, primary_key=True),
+    Column("presents", Integer, nullable=False),
+    postgresql_partition_by="LIST (import_id)",
+)
+
+
+# Number of citizens of the town born on the date.
+town_birth_dates = Table(
+    "town_birth_dates",
+    metadata,
+    Column("import_id", Integer, ForeignKey("imports.import_id"), primary_key=True),
+    Column("town", String(256), primary_key=True),
+    Column("birth_date", Date, primary_key=True),
+    Column("citizens", Integer, nullable=False),
+    postgresql_partition_by="LIST (import_id)",
 )
 
 
-imports = Table("imports", metadata, Column("import_id", Integer, primary_key=True, autoincrement=True),)
+# Changes of citizens made by patches, `version` is the version of import created by the patch. Relatives are
+# given by ids added to and removed from them, `fields` holds new values of other changed columns.
+citizen_changes = Table(
+    "citizen_changes",
+    metadata,
+    Column("import_id", Integer, ForeignKey("imports.import_id"), primary_key=True),
+    Column("version", Integer, primary_key=True),
+    Column("citizen_id", Integer, primary_key=True),
+    Column("fields", JSONB, nullable=False, server_default="{}"),
+    Column("relatives_added", ARRAY(Integer), nullable=False, server_default="{}"),
+    Column("relatives_removed", ARRAY(Integer), nullable=False, server_default="{}"),
+    postgresql_partition_by="LIST (import_id)",
+)
+
+
+# Version of import is incremented by every change of its citizens, it is a part of cached responses keys.
+imports = Table(
+    "imports",
+    metadata,
+    Column("import_id", Integer, primary_key=True, autoincrement=True),
+    Column("version", Integer, nullable=False, server_default="0"),
+)
 
 
-relations = Table(
-    "relations",
+import_jobs = Table(
+    "import_jobs",
     metadata,
-    Column("import_id", Integer, primary_key=True),
-    Column("citizen", Integer, primary_key=True),
-    Column("relative", Integer, primary_key=True),
-    ForeignKeyConstraint(("import_id", "citizen"), ("citizens.import_id", "citizens.citizen_id")),
-    ForeignKeyConstraint(("import_id", "relative"), ("citizens.import_id", "citizens.citizen_id")),
+    Column("job_id", Integer, primary_key=True, autoincrement=True),
+    Column("phase", String(16), nullable=False),
+    Column("rows_written", Integer, nullable=False, server_default="0"),
+    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
+    Column("started_at", DateTime(timezone=True)),
+    Column("finished_at", DateTime(timezone=True)),
+    Column("import_id", Integer, ForeignKey("imports.import_id")),
+    Column("error", Text),
+    # Updated by the process that runs the job while it is queued or running, stale one means the process is gone.
+    Column("updated_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
 )
@@ -0,0 +1,207 @@
+import asyncio
+import random
+from collections import Counter
+from datetime import date, timedelta
+from math import ceil, floor
+
+import analyzer
+import pytest
+from analyzer.aggregates import percentiles_cont
+from api.scheme import CitizenPatch, CitizenPatchItem, Import
+from databases import Database
+from db import presents
+from sqlalchemy import and_
+from utils import compare_citizen_groups, generate_citizen, generate_citizens
+
+PATCHES = [
+    # Смена месяца рождения меняет месяц подарков от всех родственников.
+    (1, CitizenPatch(birth_date="1990-07-15")),
+    # Смена города переносит жителя в другую выборку возрастов.
+    (2, CitizenPatch(town="Другой город", birth_date="1980-03-01")),
+    # Новые и удаленные родственники, включая самого жителя.
+    (3, CitizenPatch(relatives=[1, 3, 4])),
+    (1, CitizenPatch(relatives=[], town="Третий город")),
+    (4, CitizenPatch(relatives=[3, 5], birth_date="2000-12-31")),
+]
+
+
+async def expected_birthdays(import_id, database):
+    citizens = {c["citizen_id"]: c for c in await analyzer.get_citizens(import_id, database)}
+    presents = Counter()
+    for citizen in citizens.values():
+        for relative_id in citizen["relatives"]:
+            presents[citizen["citizen_id"], citizens[relative_id]["birth_date"].month] += 1
+    res = {str(i): [] for i in range(1, 13)}
+    for (citizen_id, month), count in presents.items():
+        res[str(month)].append({"citizen_id": citizen_id, "presents": count})
+    return res
+
+
+async def expected_age_statistics(import_id, database):
+    query = """
+        SELECT town,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY date_part('year', age(birth_date))) AS p50,
+            percentile_cont(0.75) WITHIN GROUP (ORDER BY date_part('year', age(birth_date))) AS p75,
+            percentile_cont(0.99) WITHIN GROUP (ORDER BY date_part('year', age(birth_date))) AS p99
+        FROM citizens WHERE import_id = :import_id GROUP BY town
+    """
+    return [dict(row) for row in await database.fetch_all(query, {"import_id": import_id})]
+
+
+def sort_birthdays(birthdays):
+    return {month: sorted(values, key=lambda v: v["citizen_id"]) for month, values in birthdays.items()}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("method", list(analyzer.IngestMethod))
+async def test_aggregates_follow_patches(migrated_postgres, database, method):
+    # Агрегаты, посчитанные при загрузке и обновленные при изменении жителей,
+    # должны совпадать с посчитанными заново по жителям.
+    dataset = [
+        generate_citizen(citizen_id=1, town="Москва", birth_date="1950-01-10", relatives=[2, 3]),
+        generate_citizen(citizen_id=2, town="Москва", birth_date="1960-02-20", relatives=[1]),
+        generate_citizen(citizen_id=3, town="Москва", birth_date="1970-02-28", relatives=[1, 3]),
+        generate_citizen(citizen_id=4, town="Самара", birth_date="1999-05-05", relatives=[]),
+        generate_citizen(citizen_id=5, town="Самара", birth_date="2001-05-06", relatives=[]),
+    ]
+    dataset.extend(generate_citizens(citizens_num=200, relations_num=50, start_citizen_id=6))
+    async with database:
+        import_id = await analyzer.save_import(Import(data=dataset), database, method=method)
+        for citizen_id, patch in [(None, None)] + PATCHES:
+            if citizen_id is not None:
+                await analyzer.patch_citizen(import_id, citizen_id, patch, database)
+            birthdays = await analyzer.get_birthdays(import_id, database)
+            assert sort_birthdays(birthdays) == sort_birthdays(await expected_birthdays(import_id, database))
+            age_statistics = await analyzer.get_age_statistics(import_id, database)
+            expected = await expected_age_statistics(import_id, database)
+            assert sorted(age_statistics, key=lambda s: s["town"]) == sorted(expected, key=lambda s: s["town"])
+
+
+@pytest.mark.parametrize(
+    "values", [[(10.0, 1)], [(10.0, 2), (20.0, 1)], [(1.0, 3), (5.0, 1), (7.0, 10), (90.0, 1)], [(3.0, 1000)]]
+)
+def test_percentiles_cont(values):
+    # Процентили по гистограмме совпадают с процентилями по развернутому списку значений.
+    expanded = [value for value, count in values for _ in range(count)]
+    fractions = [0, 0.5, 0.75, 0.99, 1]
+    for fraction, percentile in zip(fractions, percentiles_cont(values, fractions)):
+        position = fraction * (len(expanded) - 1)
+        lower, upper = expanded[floor(position)], expanded[ceil(position)]
+        assert percentile == lower + (upper - lower) * (position - floor(position))
+
+
+def random_patch(rnd, citizen_ids):
+    fields = {
+        "town": lambda: rnd.choice(["Москва", "Самара", "Керчь"]),
+        "birth_date": lambda: (date(1950, 1, 1) + timedelta(days=rnd.randrange(20000))).isoformat(),
+        "relatives": lambda: rnd.sample(citizen_ids, rnd.randrange(4)),
+        "name": lambda: rnd.choice(["Иван", "Петр"]),
+    }
+    names = rnd.sample(list(fields), rnd.randrange(1, len(fields) + 1))
+    return CitizenPatch(**{name: fields[name]() for name in names})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("seed", range(3))
+async def test_aggregates_follow_random_patches(migrated_postgres, database, seed):
+    rnd = random.Random(seed)
+    dataset = generate_citizens(citizens_num=30, relations_num=20, start_citizen_id=1)
+    citizen_ids = [citizen["citizen_id"] for citizen in dataset]
+    async with database:
+        import_id = await analyzer.save_import(Import(data=dataset), database)
+        for _ in range(40):
+            await analyzer.patch_citizen(import_id, rnd.choice(citizen_ids), random_patch(rnd, citizen_ids), database)
+            difference = await analyzer.check_aggregates(import_id, database)
+            assert not difference.presents and not difference.birth_dates
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("seed", range(3))
+async def test_bulk_patch_equals_sequential_patches(migrated_postgres, database, seed):
+    # Пакетное изменение должно приводить к тому же результату, что и изменения по одному.
+    rnd = random.Random(seed)
+    dataset = generate_citizens(citizens_num=30, relations_num=20, start_citizen_id=1)
+    citizen_ids = [citizen["citizen_id"] for citizen in dataset]
+    # Часть жителей изменяется несколько раз, остальные меняются только как родственники.
+    patched_ids = rnd.sample(citizen_ids, 10)
+    patches = [
+        CitizenPatchItem(citizen_id=rnd.choice(patched_ids), **random_patch(rnd, citizen_ids).dict(exclude_none=True))
+        for _ in range(30)
+    ]
+    async with database:
+        bulk_import_id = await analyzer.save_import(Import(data=dataset), database)
+        import_id = await analyzer.save_import(Import(data=dataset), database)
+        patched = await analyzer.patch_citizens(bulk_import_id, patches, database)
+        for patch in patches:
+            await analyzer.patch_citizen(import_id, patch.citizen_id, patch, database)
+
+        def without_import_id(citizens):
+            return [{k: v for k, v in citizen.items() if k != "import_id"} for citizen in citizens]
+
+        expected = without_import_id(await analyzer.get_citizens(import_id, database))
+        actual = without_import_id(await analyzer.get_citizens(bulk_import_id, database))
+        assert compare_citizen_groups(actual, expected)
+        # Возвращаются измененные жители в порядке их первых изменений.
+        order = list(dict.fromkeys(patch.citizen_id for patch in patches))
+        assert [citizen["citizen_id"] for citizen in patched] == order
+        assert compare_citizen_groups(without_import_id(patched), [c for c in expected if c["citizen_id"] in order])
+        difference = await analyzer.check_aggregates(bulk_import_id, database)
+        assert not difference.presents and not difference.birth_dates
+        assert await analyzer.get_import_version(bulk_import_id, database) == 1
+
+
+@pytest.mark.asyncio
+async def test_check_aggregates_finds_difference(migrated_postgres, database):
+    dataset = [
+        generate_citizen(citizen_id=1, town="Москва", birth_date="1950-01-10", relatives=[2]),
+        generate_citizen(citizen_id=2, town="Москва", birth_date="1960-02-20", relatives=[1]),
+    ]
+    async with database:
+        import_id = await analyzer.save_import(Import(data=dataset), database)
+        difference = await analyzer.check_aggregates(import_id, database)
+        assert not difference.presents and not difference.birth_dates
+
+        # Лишний подарок и пропавший счетчик выгрузки.
+        condition = and_(presents.c.import_id == import_id, presents.c.citizen_id == 1)
+        await database.execute(presents.update().where(condition).values(presents=presents.c.presents + 1))
+        await database.execute(
+            presents.delete().where(and_(presents.c.import_id == import_id, presents.c.citizen_id == 2))
+        )
+        difference = await analyzer.check_aggregates(import_id, database)
+        assert difference.presents == {(1, 2): 1, (2, 1): -1}
+        assert not difference.birth_dates
+
+
+@pytest.mark.asyncio
+async def test_clone_during_patches(db_settings, migrated_postgres):
+    # Копия выгрузки, которую изменяют во время копирования, должна быть
+    # согласованной: агрегаты копии совпадают с ее жителями.
+    database = Database(db_settings.dsn(), min_size=4, max_size=4)
+    rnd = random.Random(0)
+    dataset = generate_citizens(citizens_num=3000, relations_num=1000, start_citizen_id=1)
+    citizen_ids = [citizen["citizen_id"] for citizen in dataset]
+    async with database:
+        # Каждый вызов выполняется в отдельной задаче, чтобы получить свое
+        # соединение.
+        import_id = await asyncio.create_task(analyzer.save_import(Import(data=dataset), database))
+        cloned = False
+
+        async def patch():
+            while not cloned:
+                await analyzer.patch_citizen(
+                    import_id, rnd.choice(citizen_ids), random_patch(rnd, citizen_ids), database
+                )
+
+        async def clone():
+            nonlocal cloned
+            try:
+                return [await analyzer.clone_import(import_id, database) for _ in range(5)]
+            finally:
+                cloned = True
+
+        clone_ids, *_ = await asyncio.gather(
+            asyncio.create_task(clone()), *(asyncio.create_task(patch()) for _ in range(2))
+        )
+        for clone_id in clone_ids:
+            difference = await asyncio.create_task(analyzer.check_aggregates(clone_id, database))
+            assert not difference.presents and not difference.birth_dates
@@ -0,0 +1,112 @@
+import random
+
+import analyzer
+import pytest
+from api.scheme import CitizenPatch, CitizenPatchItem, Import
+from test_aggregates import random_patch
+from utils import compare_citizen_groups, generate_citizen, generate_citizens
+
+
+async def get_changes(import_id, database, since=0):
+    return [dict(row) async for row in analyzer.iter_changes(import_id, database, since)]
+
+
+def apply_changes(citizens, changes):
+    """
+    Применяет изменения к копии жителей так, как это делал бы потребитель ленты.
+    """
+    citizens = {citizen["citizen_id"]: {**citizen, "relatives": list(citizen["relatives"])} for citizen in citizens}
+    for change in changes:
+        citizen = citizens[change["citizen_id"]]
+        citizen.update(change["fields"])
+        relatives = [r for r in citizen["relatives"] if r not in change["relatives_removed"]]
+        citizen["relatives"] = relatives + change["relatives_added"]
+    return list(citizens.values())
+
+
+@pytest.mark.asyncio
+async def test_patch_logs_changes(migrated_postgres, database):
+    dataset = [
+        generate_citizen(citizen_id=1, relatives=[2]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+        generate_citizen(citizen_id=3, relatives=[]),
+    ]
+    async with database:
+        import_id = await analyzer.save_import(Import(data=dataset), database)
+        await analyzer.patch_citizen(import_id, 1, CitizenPatch(name="Иванов", relatives=[1, 3]), database)
+        # Изменение без родственников не меняет других жителей.
+        await analyzer.patch_citizen(import_id, 3, CitizenPatch(apartment=7, gender="male"), database)
+
+        changes = await get_changes(import_id, database)
+        for change in changes:
+            change["relatives_added"].sort()
+        assert changes == [
+            {
+                "version": 1,
+                "citizen_id": 1,
+                "fields": {"name": "Иванов"},
+                "relatives_added": [1, 3],
+                "relatives_removed": [2],
+            },
+            {"version": 1, "citizen_id": 2, "fields": {}, "relatives_added": [], "relatives_removed": [1]},
+            {"version": 1, "citizen_id": 3, "fields": {}, "relatives_added": [1], "relatives_removed": []},
+            {
+                "version": 2,
+                "citizen_id": 3,
+                "fields": {"apartment": 7, "gender": "male"},
+                "relatives_added": [],
+                "relatives_removed": [],
+            },
+        ]
+        # Потребитель получает только изменения после известной ему версии.
+        assert await get_changes(import_id, database, since=1) == changes[3:]
+        assert await get_changes(import_id, database, since=2) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("bulk", [False, True])
+async def test_changes_replay_patches(migrated_postgres, database, bulk):
+    # Применение ленты изменений к исходной выгрузке дает текущее состояние выгрузки.
+    rnd = random.Random(0)
+    dataset = generate_citizens(citizens_num=30, relations_num=20, start_citizen_id=1)
+    citizen_ids = [citizen["citizen_id"] for citizen in dataset]
+    patches = [
+        CitizenPatchItem(citizen_id=rnd.choice(citizen_ids), **random_patch(rnd, citizen_ids).dict(exclude_none=True))
+        for _ in range(20)
+    ]
+    async with database:
+        import_id = await analyzer.save_import(Import(data=dataset), database)
+        if bulk:
+            await analyzer.patch_citizens(import_id, patches[:10], database)
+            await analyzer.patch_citizens(import_id, patches[10:], database)
+        else:
+            for patch in patches:
+                await analyzer.patch_citizen(import_id, patch.citizen_id, patch, database)
+
+        changes = await get_changes(import_id, database)
+        versions = [change["version"] for change in changes]
+        assert versions == sorted(versions)
+        assert versions[-1] == await analyzer.get_import_version(import_id, database)
+        actual = [
+            {k: v for k, v in c.items() if k != "import_id"} for c in await analyzer.get_citizens(import_id, database)
+        ]
+        for citizen in actual:
+            citizen["birth_date"] = citizen["birth_date"].isoformat()
+        assert compare_citizen_groups(apply_changes(dataset, changes), actual)
+
+
+@pytest.mark.asyncio
+async def test_failed_patch_logs_nothing(migrated_postgres, database):
+    dataset = [generate_citizen(citizen_id=1, relatives=[])]
+    async with database:
+        import_id = await analyzer.save_import(Import(data=dataset), database)
+        with pytest.raises(ValueError):
+            await analyzer.patch_citizen(import_id, 1, CitizenPatch(relatives=[2]), database)
+        with pytest.raises(ValueError):
+            await analyzer.patch_citizens(import_id, [CitizenPatchItem(citizen_id=1, relatives=[2])], database)
+        assert await get_changes(import_id, database) == []
+
+        # Копия выгрузки начинается с версии 0 и без истории изменений.
+        await analyzer.patch_citizen(import_id, 1, CitizenPatch(name="Иванов"), database)
+        clone_id = await analyzer.clone_import(import_id, database)
+        assert await get_changes(clone_id, database) == []
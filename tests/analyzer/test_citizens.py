@@ -1,9 +1,12 @@
+import asyncio
+import random
 from datetime import date, timedelta
 from typing import List, Mapping
 
 import analyzer
 import pytest
-from api.scheme import CitizenPatch, Import
+from api.scheme import CitizenPatch, CitizenPatchItem, Import
+from databases import Database
 from utils import compare_citizen_groups, compare_citizens, generate_citizen, generate_citizens
 
 datasets = [
@@ -192,3 +195,84 @@ async def test_patch_citizen_add_nonexistent_relative(database, migrated_postgre
     with pytest.raises(Exception):
         async with database:
             await analyzer.patch_citizen(import_id, dataset[0]["citizen_id"], patch, database)
+
+
+@pytest.mark.asyncio
+async def test_failed_patch_changes_nothing(database, migrated_postgres):
+    """
+    Если среди добавляемых родственников есть несуществующий, выгрузка не должна измениться.
+    """
+    dataset = [generate_citizen(citizen_id=1, relatives=[]), generate_citizen(citizen_id=2, relatives=[])]
+    async with database:
+        import_id = await analyzer.save_import(Import(data=dataset), database)
+        before = await analyzer.get_citizens(import_id, database)
+
+        with pytest.raises(ValueError, match="relatives"):
+            await analyzer.patch_citizen(import_id, 1, CitizenPatch(name="Иванов", relatives=[2, 999]), database)
+        with pytest.raises(ValueError, match="not found"):
+            await analyzer.patch_citizen(import_id, 999, CitizenPatch(name="Иванов"), database)
+
+        assert await analyzer.get_citizens(import_id, database) == before
+        assert await analyzer.get_import_version(import_id, database) == 0
+        difference = await analyzer.check_aggregates(import_id, database)
+        assert not difference.presents and not difference.birth_dates
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "patches, error",
+    [
+        # Несуществующий родственник, даже если следующее изменение его убирает.
+        ([(1, {"relatives": [2, 999]}), (1, {"relatives": [2]})], "relatives"),
+        ([(1, {"name": "Иванов"}), (999, {"name": "Иванов"})], "not found"),
+    ],
+)
+async def test_failed_bulk_patch_changes_nothing(database, migrated_postgres, patches, error):
+    """
+    Пакетное изменение применяется целиком или не применяется вовсе.
+    """
+    dataset = [generate_citizen(citizen_id=1, relatives=[]), generate_citizen(citizen_id=2, relatives=[])]
+    patches = [CitizenPatchItem(citizen_id=citizen_id, **values) for citizen_id, values in patches]
+    async with database:
+        import_id = await analyzer.save_import(Import(data=dataset), database)
+        before = await analyzer.get_citizens(import_id, database)
+
+        with pytest.raises(ValueError, match=error):
+            await analyzer.patch_citizens(import_id, patches, database)
+
+        assert await analyzer.get_citizens(import_id, database) == before
+        assert await analyzer.get_import_version(import_id, database) == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("batch", [1, 5])
+async def test_concurrent_patches(db_settings, migrated_postgres, batch):
+    """
+    Одновременные изменения родственников одних и тех же жителей не должны
+    завершаться ошибкой (взаимные блокировки повторяются), агрегаты должны
+    оставаться согласованными.
+    """
+    database = Database(db_settings.dsn(), min_size=8, max_size=8)
+    dataset = [generate_citizen(citizen_id=citizen_id, relatives=[]) for citizen_id in range(10)]
+    async with database:
+        # Соединение databases наследуется задачами, созданными задачей, которая
+        # его использовала, поэтому все запросы выполняются в отдельных задачах.
+        import_id = await asyncio.create_task(analyzer.save_import(Import(data=dataset), database))
+
+        async def worker(seed):
+            rnd = random.Random(seed)
+            for _ in range(4):
+                patches = [
+                    CitizenPatchItem(citizen_id=rnd.randrange(10), relatives=rnd.sample(range(10), 3))
+                    for _ in range(batch)
+                ]
+                if batch == 1:
+                    await analyzer.patch_citizen(import_id, patches[0].citizen_id, patches[0], database)
+                else:
+                    await analyzer.patch_citizens(import_id, patches, database)
+
+        await asyncio.gather(*(asyncio.create_task(worker(seed)) for seed in range(8)))
+
+        difference = await asyncio.create_task(analyzer.check_aggregates(import_id, database))
+        assert not difference.presents and not difference.birth_dates
+        await asyncio.create_task(analyzer.drop_import(import_id, database))
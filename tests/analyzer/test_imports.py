@@ -1,9 +1,11 @@
+import asyncio
 from datetime import date, timedelta
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import analyzer
 import pytest
-from api.scheme import Citizen, Import
+from api.scheme import Citizen, CitizenPatch, Import
+from databases import Database
 from utils import LONGEST_STR, MAX_INT, compare_citizen_groups, generate_citizen, generate_citizens
 
 Case = Tuple[Optional[callable], List[Union[dict, Citizen]]]
@@ -77,11 +79,11 @@ def get_citizens_from_case(case: Case) -> List[Dict[str, Any]]:
     return citizens
 
 
-async def _test_import(database, case):
+async def _test_import(database, case, method=analyzer.IngestMethod.copy):
     citizens = get_citizens_from_case(case)
     import_obj = Import(data=citizens)
     async with database:
-        import_id = await analyzer.save_import(import_obj=import_obj, database=database)
+        import_id = await analyzer.save_import(import_obj=import_obj, database=database, method=method)
         imported_citizens = await analyzer.get_citizens(import_id=import_id, database=database)
     for citizen in imported_citizens:
         del citizen["import_id"]
@@ -90,8 +92,9 @@ async def _test_import(database, case):
 
 @pytest.mark.asyncio
 @pytest.mark.parametrize("case", CORRECT_CASES)
-async def test_correct_imports(migrated_postgres, database, case):
-    await _test_import(database, case)
+@pytest.mark.parametrize("method", list(analyzer.IngestMethod))
+async def test_correct_imports(migrated_postgres, database, case, method):
+    await _test_import(database, case, method)
 
 
 @pytest.mark.asyncio
@@ -99,3 +102,89 @@ async def test_correct_imports(migrated_postgres, database, case):
 async def test_wrong_imports(migrated_postgres, database, case):
     with pytest.raises(ValueError):
         await _test_import(database, case)
+
+
+async def count_detached_partitions(database):
+    query = (
+        "SELECT count(*) FROM pg_class "
+        "WHERE relname ~ '^(citizens|presents|town_birth_dates)_[0-9]+$' AND relkind = 'r' AND NOT relispartition"
+    )
+    return await database.fetch_val(query)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("method", list(analyzer.IngestMethod))
+async def test_failed_import_drops_partitions(migrated_postgres, database, method, monkeypatch):
+    async def fail(import_id, database):
+        raise RuntimeError
+
+    # Выгрузка падает после того, как все строки записаны.
+    monkeypatch.setattr(analyzer.analyzer, "_publish_import", fail)
+    import_obj = Import(data=generate_citizens(citizens_num=100, relations_num=20))
+    async with database:
+        with pytest.raises(RuntimeError):
+            await analyzer.save_import(import_obj, database, method=method, connections=3)
+        assert await count_detached_partitions(database) == 0
+
+
+@pytest.mark.asyncio
+async def test_drop_import(migrated_postgres, database):
+    citizens = generate_citizens(citizens_num=100, relations_num=20)
+    async with database:
+        import_id = await analyzer.save_import(Import(data=citizens), database)
+        other_import_id = await analyzer.save_import(Import(data=citizens), database)
+
+        assert await analyzer.drop_import(import_id, database)
+        assert await analyzer.get_citizens(import_id, database) == []
+        assert len(await analyzer.get_citizens(other_import_id, database)) == 100
+        assert not await analyzer.drop_import(import_id, database)
+        assert await count_detached_partitions(database) == 0
+
+
+@pytest.mark.asyncio
+async def test_clone_import(migrated_postgres, database):
+    citizens = generate_citizens(citizens_num=100, relations_num=20, start_citizen_id=1)
+    async with database:
+        import_id = await analyzer.save_import(Import(data=citizens), database)
+        clone_id = await analyzer.clone_import(import_id, database)
+        assert clone_id != import_id
+
+        cloned_citizens = await analyzer.get_citizens(clone_id, database)
+        for citizen in cloned_citizens:
+            assert citizen.pop("import_id") == clone_id
+        assert compare_citizen_groups(cloned_citizens, citizens)
+
+        # Изменения копии не затрагивают исходную выгрузку.
+        await analyzer.patch_citizen(clone_id, 1, CitizenPatch(name="Иван", relatives=[]), database)
+        original_citizens = await analyzer.get_citizens(import_id, database)
+        for citizen in original_citizens:
+            del citizen["import_id"]
+        assert compare_citizen_groups(original_citizens, citizens)
+
+        assert await analyzer.clone_import(100500, database) is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_clone_and_drop(db_settings, migrated_postgres):
+    """
+    Одновременные копирование и удаление выгрузок, одной и той же или разных,
+    не должны завершаться взаимной блокировкой.
+    """
+    database = Database(db_settings.dsn(), min_size=4, max_size=4)
+    import_obj = Import(data=generate_citizens(citizens_num=1000, relations_num=100))
+    async with database:
+        for _ in range(5):
+            # Каждый вызов выполняется в отдельной задаче, чтобы получить свое
+            # соединение.
+            import_id = await asyncio.create_task(analyzer.save_import(import_obj, database))
+            other_import_id = await asyncio.create_task(analyzer.save_import(import_obj, database))
+            clones = await asyncio.gather(
+                asyncio.create_task(analyzer.clone_import(import_id, database)),
+                asyncio.create_task(analyzer.drop_import(import_id, database)),
+                asyncio.create_task(analyzer.clone_import(other_import_id, database)),
+                asyncio.create_task(analyzer.drop_import(other_import_id, database)),
+            )
+            for clone_id in clones[::2]:
+                if clone_id is not None:
+                    assert len(await asyncio.create_task(analyzer.get_citizens(clone_id, database))) == 1000
+        assert await count_detached_partitions(database) == 0
@@ -0,0 +1,45 @@
+import analyzer
+import pytest
+from analyzer.metrics import timed
+from api.scheme import Import
+from prometheus_client import REGISTRY
+from utils import generate_citizen
+
+
+def get_calls(function):
+    return REGISTRY.get_sample_value("analyzer_call_duration_seconds_count", {"function": function}) or 0
+
+
+@pytest.mark.asyncio
+async def test_timed_analyzer_functions(migrated_postgres, database):
+    async with database:
+        import_id = await analyzer.save_import(Import(data=[generate_citizen(citizen_id=1)]), database)
+        calls = get_calls("get_import_version"), get_calls("iter_citizens")
+        await analyzer.get_import_version(import_id, database)
+        # Генератор учитывается, когда его перебор закончен.
+        rows = [row async for row in analyzer.iter_citizens(import_id, database)]
+        assert len(rows) == 1
+        assert (get_calls("get_import_version"), get_calls("iter_citizens")) == (calls[0] + 1, calls[1] + 1)
+
+
+@pytest.mark.asyncio
+async def test_timed_generator_closed():
+    closed = []
+
+    @timed
+    async def items():
+        try:
+            for i in range(10):
+                yield i
+        finally:
+            closed.append(True)
+
+    calls = get_calls("items")
+    generator = items()
+    async for item in generator:
+        if item == 2:
+            break
+    # Генератор закрывается сразу, когда потребитель прекращает перебор.
+    await generator.aclose()
+    assert closed == [True]
+    assert get_calls("items") == calls + 1
@@ -0,0 +1,40 @@
+import analyzer
+import pytest
+from api.scheme import CitizenPatch, Import
+from utils import generate_citizens
+
+QUERIES = [
+    lambda import_id, database: analyzer.get_citizens(import_id, database),
+    lambda import_id, database: analyzer.get_birthdays(import_id, database),
+    lambda import_id, database: analyzer.get_age_statistics(import_id, database),
+    lambda import_id, database: analyzer.patch_citizen(
+        import_id, 1, CitizenPatch(name="Иван", relatives=[2, 3]), database
+    ),
+]
+
+
+async def get_partition_scans(database):
+    """Количество чтений партиций, еще не попавших в общую статистику."""
+    query = (
+        "SELECT relname, coalesce(seq_scan, 0) + coalesce(idx_scan, 0) FROM pg_stat_xact_user_tables "
+        "WHERE relname ~ '^(citizens|presents|town_birth_dates)_[0-9]+$'"
+    )
+    return {row[0]: row[1] for row in await database.fetch_all(query)}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("query", QUERIES)
+async def test_partition_pruning(migrated_postgres, database, query):
+    # Запрос к выгрузке должен читать только ее партиции, но не партиции
+    # других выгрузок.
+    import_obj = Import(data=generate_citizens(citizens_num=50, relations_num=10, start_citizen_id=1))
+    async with database:
+        import_id = await analyzer.save_import(import_obj, database)
+        await analyzer.save_import(import_obj, database)
+        async with database.transaction():
+            scans_before = await get_partition_scans(database)
+            await query(import_id, database)
+            scans_after = await get_partition_scans(database)
+    scanned = {name for name, scans in scans_after.items() if scans > scans_before.get(name, 0)}
+    assert scanned
+    assert scanned <= {f"{table}_{import_id}" for table in ("citizens", "presents", "town_birth_dates")}
@@ -0,0 +1,48 @@
+import pytest
+from analyzer.retries import ConflictError, retry_conflicts
+from asyncpg import DeadlockDetectedError
+
+
+@pytest.mark.asyncio
+async def test_retry_conflicts():
+    calls = []
+
+    @retry_conflicts(attempts=3, backoff=0)
+    async def transaction():
+        calls.append(None)
+        if len(calls) < 3:
+            raise DeadlockDetectedError("deadlock detected")
+        return len(calls)
+
+    # Транзакция повторяется после конфликта и возвращает результат удачной попытки.
+    assert await transaction() == 3
+
+
+@pytest.mark.asyncio
+async def test_retry_conflicts_exhausted():
+    calls = []
+
+    @retry_conflicts(attempts=3, backoff=0)
+    async def transaction():
+        calls.append(None)
+        raise ConflictError("conflict")
+
+    # Ошибка последней попытки пробрасывается.
+    with pytest.raises(ConflictError):
+        await transaction()
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_retry_other_errors():
+    calls = []
+
+    @retry_conflicts(attempts=3, backoff=0)
+    async def transaction():
+        calls.append(None)
+        raise ValueError("wrong relatives")
+
+    # Прочие ошибки не повторяются.
+    with pytest.raises(ValueError):
+        await transaction()
+    assert len(calls) == 1
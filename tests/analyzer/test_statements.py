@@ -0,0 +1,31 @@
+import analyzer
+import pytest
+from analyzer.statements import Statement
+from api.scheme import Import
+from db import citizens
+from sqlalchemy import and_, bindparam, select
+from utils import generate_citizen
+
+
+def test_statement_sql():
+    statement = Statement(
+        select([citizens.c.name]).where(and_(citizens.c.import_id == bindparam("import_id"), citizens.c.apartment > 7))
+    )
+    # Параметры нумеруются по именам, значения из запроса передаются как константы.
+    assert "citizens.import_id = $2" in statement.sql
+    assert "citizens.apartment > $1" in statement.sql
+    assert statement._args({"import_id": 10}) == [7, 10]
+    with pytest.raises(KeyError):
+        statement._args({})
+
+
+@pytest.mark.asyncio
+async def test_statement_in_transaction(migrated_postgres, database):
+    async with database:
+        import_id = await analyzer.save_import(Import(data=[generate_citizen(citizen_id=1, relatives=[])]), database)
+        # Подготовленные запросы выполняются в соединении и транзакции текущей задачи.
+        transaction = await database.transaction()
+        await database.execute(citizens.update().where(citizens.c.import_id == import_id).values(name="Петр"))
+        assert (await analyzer.get_citizens(import_id, database))[0]["name"] == "Петр"
+        await transaction.rollback()
+        assert (await analyzer.get_citizens(import_id, database))[0]["name"] != "Петр"
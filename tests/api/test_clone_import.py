@@ -0,0 +1,19 @@
+from utils import compare_citizen_groups, generate_citizens
+
+
+def test_clone_import(migrated_postgres, client):
+    citizens = generate_citizens(citizens_num=10, relations_num=3)
+    import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+
+    response = client.post(f"/imports/{import_id}/clone")
+    assert response.status_code == 201
+    clone_id = response.json()["data"]["import_id"]
+    assert clone_id != import_id
+
+    response = client.get(f"/imports/{clone_id}/citizens")
+    assert compare_citizen_groups(response.json()["data"], citizens)
+
+
+def test_clone_unknown_import(migrated_postgres, client):
+    response = client.post("/imports/100500/clone")
+    assert response.status_code == 404
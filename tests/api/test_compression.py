@@ -0,0 +1,111 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+from api import application
+from api.cache import ResponseCache
+from api.compression import ResponseCompression
+from prometheus_client import REGISTRY
+from utils import generate_citizen, generate_citizens
+
+
+def get_metric(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+async def iterate(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, encoding",
+    [
+        ("gzip", "gzip"),
+        ("gzip, deflate", "gzip"),
+        ("deflate", None),
+        ("gzip;q=0", None),
+        ("*", "br"),
+        ("*;q=0.5, br;q=0", "gzip"),
+        ("identity", None),
+        ("", None),
+        (None, None),
+    ],
+)
+def test_choose_encoding(monkeypatch, accept_encoding, encoding):
+    # Brotli может быть не установлен, поэтому набор кодировок задается явно.
+    monkeypatch.setattr("api.compression.ENCODINGS", ("br", "gzip"))
+    assert ResponseCompression(min_size=0).choose_encoding(accept_encoding) == encoding
+
+
+@pytest.mark.asyncio
+async def test_compress_stream():
+    compression = ResponseCompression(min_size=0)
+    chunks = [b'{"data":[', b'{"citizen_id":1}', b"]}"]
+    compressed = [chunk async for chunk in compression.compress_stream(iterate(chunks), "gzip")]
+    # Каждый сжатый фрагмент можно распаковать сразу, не дожидаясь конца тела.
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress(compressed[0]) == chunks[0]
+    assert gzip.decompress(b"".join(compressed)) == b"".join(chunks)
+    assert compression.compress(b"".join(chunks), "gzip") != b"".join(chunks)
+
+
+@pytest.mark.parametrize("url", ["citizens", "citizens/birthdays", "towns/stat/percentile/age"])
+def test_compressed_responses(migrated_postgres, client, url):
+    citizens = generate_citizens(citizens_num=100, relations_num=30)
+    import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+    url = f"/imports/{import_id}/{url}"
+    plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.json() == plain.json()
+    if len(plain.content) >= application.response_compression.min_size:
+        assert response.headers["Content-Encoding"] == "gzip"
+        # Сжатое и несжатое тело - разные представления с разными ETag.
+        assert response.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+    else:
+        assert response.headers["ETag"] == plain.headers["ETag"]
+
+    # Клиент получает 304 по ETag того тела, которое у него есть.
+    for etag, encoding in ((response.headers["ETag"], "gzip"), (plain.headers["ETag"], "identity")):
+        not_modified = client.get(url, headers={"Accept-Encoding": encoding, "If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.headers["ETag"] == etag
+
+
+def test_small_responses_are_not_compressed(migrated_postgres, client):
+    r = client.post("/imports", json={"data": [generate_citizen(citizen_id=1, relatives=[])]})
+    import_id = r.json()["data"]["import_id"]
+    for url in ("citizens", "citizens/birthdays"):
+        response = client.get(f"/imports/{import_id}/{url}", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert "Content-Encoding" not in response.headers
+
+
+def test_cached_compressed_responses(migrated_postgres, client, db_settings, monkeypatch):
+    loop = asyncio.get_event_loop()
+    cache = ResponseCache(max_size=1024 * 1024, check_interval=0.1)
+    monkeypatch.setattr(application, "response_cache", cache)
+    monkeypatch.setattr(application, "response_compression", ResponseCompression(min_size=1))
+    loop.run_until_complete(cache.start(db_settings.dsn()))
+    try:
+        while not cache.listening:
+            loop.run_until_complete(asyncio.sleep(0.01))
+        citizens = generate_citizens(citizens_num=20, relations_num=5)
+        import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+        urls = [f"/imports/{import_id}/{url}" for url in ("citizens", "citizens/birthdays")]
+        compressions = get_metric("response_compression_ratio_count", encoding="gzip")
+        first = [client.get(url, headers={"Accept-Encoding": "gzip"}).json() for url in urls]
+        assert get_metric("response_compression_ratio_count", encoding="gzip") == compressions + 2
+        cpu_seconds = get_metric("response_compression_cpu_seconds_total", encoding="gzip")
+        # Повторные запросы отдают уже сжатые тела из кэша.
+        assert [client.get(url, headers={"Accept-Encoding": "gzip"}).json() for url in urls] == first
+        assert get_metric("response_compression_ratio_count", encoding="gzip") == compressions + 2
+        assert get_metric("response_compression_cpu_seconds_total", encoding="gzip") == cpu_seconds
+        # Несжатые тела кэшируются отдельно.
+        assert [client.get(url, headers={"Accept-Encoding": "identity"}).json() for url in urls] == first
+    finally:
+        loop.run_until_complete(cache.stop())
@@ -0,0 +1,15 @@
+from utils import generate_citizens
+
+
+def test_drop_import(migrated_postgres, client):
+    citizens = generate_citizens(citizens_num=10, relations_num=3)
+    import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+
+    response = client.delete(f"/imports/{import_id}")
+    assert response.status_code == 204
+    assert client.get(f"/imports/{import_id}/citizens").json()["data"] == []
+
+
+def test_drop_unknown_import(migrated_postgres, client):
+    response = client.delete("/imports/100500")
+    assert response.status_code == 404
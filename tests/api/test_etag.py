@@ -0,0 +1,62 @@
+from datetime import date
+
+import pytest
+from api.cache import etag_matches, make_etag
+from utils import generate_citizen
+
+dataset = [
+    generate_citizen(citizen_id=1, relatives=[2]),
+    generate_citizen(citizen_id=2, relatives=[1]),
+]
+urls = ["citizens", "citizens?limit=1&fields=name", "citizens/birthdays", "towns/stat/percentile/age"]
+
+
+@pytest.mark.parametrize(
+    "if_none_match, matches",
+    [
+        ('W/"1-0"', True),
+        ('"1-0"', True),
+        ('W/"2-0", W/"1-0"', True),
+        ("*", True),
+        ('W/"1-1"', False),
+        ("", False),
+        (None, False),
+    ],
+)
+def test_etag_matches(if_none_match, matches):
+    assert etag_matches(if_none_match, make_etag(1, 0)) is matches
+
+
+@pytest.mark.parametrize("url", urls)
+def test_not_modified(migrated_postgres, client, url):
+    import_id = client.post("/imports", json={"data": dataset}).json()["data"]["import_id"]
+    response = client.get(f"/imports/{import_id}/{url}")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get(f"/imports/{import_id}/{url}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    # После изменения выгрузки старый ETag не подходит.
+    client.patch(f"/imports/{import_id}/citizens/1", json={"name": "Петров Петр Петрович"})
+    response = client.get(f"/imports/{import_id}/{url}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    response = client.get(f"/imports/{import_id}/{url}", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+def test_etag_of_age_statistics(migrated_postgres, client):
+    import_id = client.post("/imports", json={"data": dataset}).json()["data"]["import_id"]
+    # Возраст зависит от текущей даты, поэтому она входит в ETag.
+    response = client.get(f"/imports/{import_id}/towns/stat/percentile/age")
+    assert response.headers["ETag"] == make_etag(import_id, 0, date.today())
+
+
+@pytest.mark.parametrize("url", urls)
+def test_no_etag_without_import(migrated_postgres, client, url):
+    response = client.get(f"/imports/999999/{url}", headers={"If-None-Match": "*"})
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
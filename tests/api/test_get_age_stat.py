@@ -55,3 +55,31 @@ def test_empty(migrated_postgres, client):
     response = client.get(url)
     assert response.status_code == 200
     assert response.json()["data"] == expected
+
+
+def test_as_of(migrated_postgres, client):
+    dataset = [
+        generate_citizen(birth_date="1990-06-15", town="Москва", citizen_id=1),
+        generate_citizen(birth_date="2000-06-16", town="Москва", citizen_id=2),
+        generate_citizen(birth_date="2010-06-15", town="Москва", citizen_id=3),
+        generate_citizen(birth_date="2015-01-01", town="Самара", citizen_id=4),
+    ]
+    r = client.post("/imports", json={"data": dataset})
+    import_id = r.json()["data"]["import_id"]
+    url = f"/imports/{import_id}/towns/stat/percentile/age"
+
+    # Жители, родившиеся после указанной даты, не учитываются.
+    response = client.get(url, params={"as_of": "2010-06-15"})
+    assert response.status_code == 200
+    assert response.json()["data"] == [{"town": "Москва", "p50": 9.0, "p75": 14.5, "p99": 19.78}]
+
+    response = client.get(url, params={"as_of": "2020-06-15"})
+    assert response.json()["data"] == [
+        {"town": "Москва", "p50": 19.0, "p75": 24.5, "p99": 29.78},
+        {"town": "Самара", "p50": 5.0, "p75": 5.0, "p99": 5.0},
+    ]
+
+
+def test_wrong_as_of(migrated_postgres, client):
+    response = client.get("/imports/1/towns/stat/percentile/age", params={"as_of": "2020-13-01"})
+    assert response.status_code == 400
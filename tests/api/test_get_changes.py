@@ -0,0 +1,45 @@
+from api.application import render_response
+from api.scheme import ImportChanges
+from utils import generate_citizen
+
+
+def test_get_changes(migrated_postgres, client):
+    dataset = [generate_citizen(citizen_id=1, relatives=[]), generate_citizen(citizen_id=2, relatives=[])]
+    import_id = client.post("/imports", json={"data": dataset}).json()["data"]["import_id"]
+    url = f"/imports/{import_id}/changes"
+    assert client.get(url).json() == {"data": []}
+
+    client.patch(f"/imports/{import_id}/citizens/1", json={"name": "Иванов", "birth_date": "1990-01-02"})
+    client.patch(f"/imports/{import_id}/citizens", json={"data": [{"citizen_id": 2, "relatives": [1]}]})
+
+    response = client.get(url)
+    assert response.status_code == 200
+    expected = [
+        {
+            "version": 1,
+            "citizen_id": 1,
+            "fields": {"name": "Иванов", "birth_date": "1990-01-02"},
+            "relatives_added": [],
+            "relatives_removed": [],
+        },
+        {"version": 2, "citizen_id": 1, "fields": {}, "relatives_added": [2], "relatives_removed": []},
+        {"version": 2, "citizen_id": 2, "fields": {}, "relatives_added": [1], "relatives_removed": []},
+    ]
+    assert response.json() == {"data": expected}
+    # Документ без валидации совпадает с документом, который строится через модель.
+    assert response.content == render_response(ImportChanges, {"data": expected})
+
+    # Потребитель запрашивает изменения после последней известной ему версии.
+    response = client.get(url, params={"since": 1})
+    assert response.json() == {"data": expected[1:]}
+    assert client.get(url, params={"since": 2}).json() == {"data": []}
+    # Пока выгрузка не изменилась, изменения после той же версии не отправляются повторно.
+    response = client.get(url, params={"since": 1}, headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+def test_get_changes_wrong_request(migrated_postgres, client):
+    import_id = client.post("/imports", json={"data": [generate_citizen(citizen_id=1)]}).json()["data"]["import_id"]
+    assert client.get(f"/imports/{import_id}/changes", params={"since": -1}).status_code == 400
+    client.delete(f"/imports/{import_id}")
+    assert client.get(f"/imports/{import_id}/changes").status_code == 404
@@ -1,4 +1,12 @@
+import asyncio
+
+import analyzer
 import pytest
+from api.application import render_response
+from api.dependencies import settings
+from api.scheme import Import
+from api.settings import RenderMethod
+from api.streaming import iter_citizens_json
 from utils import LONGEST_STR, MAX_INT, compare_citizen_groups, generate_citizen, generate_citizens
 
 dataset = [
@@ -17,3 +25,60 @@ def test_get_citizens(migrated_postgres, client):
     response = client.get(f"/imports/{import_id}/citizens")
     assert response.status_code == 200
     assert compare_citizen_groups(response.json()["data"], dataset)
+
+
+@pytest.mark.parametrize("chunk_size, chunks_num", [(1, 101), (64 * 1024, 1)])
+def test_streamed_citizens(migrated_postgres, client, database, chunk_size, chunks_num):
+    citizens = generate_citizens(citizens_num=100, relations_num=30, name=LONGEST_STR, apartment=MAX_INT)
+    import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+
+    async def render():
+        chunks = [chunk async for chunk in iter_citizens_json(analyzer.iter_citizens(import_id, database), chunk_size)]
+        validated = render_response(Import, {"data": await analyzer.get_citizens(import_id, database)})
+        return chunks, validated
+
+    # Документ без валидации совпадает с документом, который строится через модель Import.
+    chunks, validated = asyncio.get_event_loop().run_until_complete(render())
+    assert b"".join(chunks) == validated
+    assert len(chunks) == chunks_num
+
+
+@pytest.mark.parametrize("method", list(RenderMethod))
+def test_citizens_pages(migrated_postgres, client, monkeypatch, method):
+    monkeypatch.setattr(settings, "render_method", method)
+    citizens = generate_citizens(citizens_num=30, relations_num=10)
+    import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+
+    # Страницы выгрузки упорядочены по citizen_id и вместе содержат всех жителей.
+    pages = []
+    params = {"limit": 7}
+    while not pages or pages[-1]:
+        response = client.get(f"/imports/{import_id}/citizens", params=params)
+        assert response.status_code == 200
+        pages.append(response.json()["data"])
+        if pages[-1]:
+            params["after_citizen_id"] = pages[-1][-1]["citizen_id"]
+    assert [len(page) for page in pages] == [7, 7, 7, 7, 2, 0]
+    assert [citizen for page in pages for citizen in page] == sorted(citizens, key=lambda c: c["citizen_id"])
+
+
+@pytest.mark.parametrize("method", list(RenderMethod))
+def test_citizens_fields(migrated_postgres, client, monkeypatch, method):
+    monkeypatch.setattr(settings, "render_method", method)
+    citizens = generate_citizens(citizens_num=10, relations_num=3)
+    import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+
+    response = client.get(f"/imports/{import_id}/citizens", params={"fields": "name,birth_date", "limit": 3})
+    assert response.status_code == 200
+    expected = [
+        {"citizen_id": c["citizen_id"], "name": c["name"], "birth_date": c["birth_date"]}
+        for c in sorted(citizens, key=lambda c: c["citizen_id"])[:3]
+    ]
+    assert response.json()["data"] == expected
+
+
+@pytest.mark.parametrize("params", [{"fields": "name,unknown"}, {"limit": 0}, {"after_citizen_id": "first"}])
+def test_wrong_citizens_params(migrated_postgres, client, params):
+    import_id = client.post("/imports", json={"data": generate_citizens(citizens_num=3)}).json()["data"]["import_id"]
+    response = client.get(f"/imports/{import_id}/citizens", params=params)
+    assert response.status_code == 400
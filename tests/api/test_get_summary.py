@@ -0,0 +1,63 @@
+import pytest
+from api.dependencies import settings
+from api.settings import RenderMethod
+from utils import generate_citizen, generate_citizens
+
+PARTS = {
+    "citizens": "citizens",
+    "birthdays": "citizens/birthdays",
+    "age_statistics": "towns/stat/percentile/age?as_of=2020-06-15",
+}
+
+
+def sort_citizens(document):
+    if "citizens" in document:
+        document["citizens"].sort(key=lambda citizen: citizen["citizen_id"])
+    return document
+
+
+@pytest.mark.parametrize("method", list(RenderMethod))
+def test_summary(migrated_postgres, client, monkeypatch, method):
+    monkeypatch.setattr(settings, "render_method", method)
+    citizens = generate_citizens(citizens_num=50, relations_num=20, unique_towns=3)
+    citizens.append(generate_citizen(citizen_id=1000, name='"Кавычки"', relatives=[]))
+    import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+    expected = {part: client.get(f"/imports/{import_id}/{url}").json()["data"] for part, url in PARTS.items()}
+
+    response = client.get(f"/imports/{import_id}/summary", params={"as_of": "2020-06-15"})
+    assert response.status_code == 200
+    assert sort_citizens(response.json()["data"]) == sort_citizens(expected)
+
+    # Возвращаются только запрошенные части.
+    for include in (["birthdays"], ["citizens", "age_statistics"], ["age_statistics", "birthdays"]):
+        params = {"include": ",".join(include), "as_of": "2020-06-15"}
+        response = client.get(f"/imports/{import_id}/summary", params=params)
+        assert sort_citizens(response.json()["data"]) == sort_citizens({part: expected[part] for part in include})
+
+
+@pytest.mark.parametrize("method", list(RenderMethod))
+def test_empty_summary(migrated_postgres, client, monkeypatch, method):
+    monkeypatch.setattr(settings, "render_method", method)
+    response = client.get("/imports/100500/summary")
+    assert response.status_code == 200
+    assert response.json()["data"] == {
+        "citizens": [],
+        "birthdays": {str(month): [] for month in range(1, 13)},
+        "age_statistics": [],
+    }
+
+
+def test_summary_etag(migrated_postgres, client):
+    r = client.post("/imports", json={"data": [generate_citizen(citizen_id=1, relatives=[])]})
+    import_id = r.json()["data"]["import_id"]
+    url = f"/imports/{import_id}/summary"
+    etag = client.get(url, params={"include": "birthdays"}).headers["ETag"]
+    assert client.get(url, params={"include": "birthdays"}, headers={"If-None-Match": etag}).status_code == 304
+    # Возраст зависит от даты, поэтому она входит в ETag.
+    assert client.get(url).headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("include", ["presents", "citizens,", ""])
+def test_wrong_summary_parts(migrated_postgres, client, include):
+    response = client.get("/imports/1/summary", params={"include": include})
+    assert response.status_code == 400
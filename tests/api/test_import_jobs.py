@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from api import application
+from api.jobs import ABANDONED_ERROR, ImportJobsPool
+from api.scheme import Import
+from utils import compare_citizen_groups, generate_citizen, generate_citizens
+
+
+def wait_for_job(client, job_id, attempts=1000):
+    for _ in range(attempts):
+        response = client.get(f"/imports/jobs/{job_id}")
+        assert response.status_code == 200
+        job = response.json()["data"]
+        if job["phase"] in ("done", "failed"):
+            return job
+    raise RuntimeError("Import job is not finished in time")
+
+
+def test_import_job(migrated_postgres, client):
+    citizens = generate_citizens(citizens_num=300, relations_num=40)
+    response = client.post("/imports/jobs", json={"data": citizens})
+    assert response.status_code == 202
+    job = response.json()["data"]
+    assert job["phase"] == "queued"
+    assert job["import_id"] is None
+
+    job = wait_for_job(client, job["job_id"])
+    assert job["phase"] == "done"
+    assert job["rows_written"] == 300
+    assert job["duration"] >= 0
+
+    response = client.get(f"/imports/{job['import_id']}/citizens")
+    assert compare_citizen_groups(response.json()["data"], citizens)
+
+
+def test_wrong_import_job(migrated_postgres, client):
+    body = {"data": [generate_citizen(citizen_id=1), generate_citizen(citizen_id=1)]}
+    response = client.post("/imports/jobs", json=body)
+    assert response.status_code == 400
+
+
+def test_unknown_import_job(migrated_postgres, client):
+    response = client.get("/imports/jobs/100500")
+    assert response.status_code == 404
+
+
+def test_import_jobs_queue_full(migrated_postgres, client, monkeypatch):
+    pool = ImportJobsPool(workers=0, queue_size=1)
+    monkeypatch.setattr(application, "import_jobs_pool", pool)
+    body = {"data": [generate_citizen(citizen_id=1)]}
+    job = client.post("/imports/jobs", json=body).json()["data"]
+    response = client.post("/imports/jobs", json=body)
+    assert response.status_code == 503
+
+    asyncio.get_event_loop().run_until_complete(pool.stop())
+    response = client.get(f"/imports/jobs/{job['job_id']}")
+    assert response.json()["data"]["phase"] == "failed"
+
+
+@pytest.mark.asyncio
+async def test_import_job_progress_shared(migrated_postgres, database):
+    pool = ImportJobsPool(workers=0, queue_size=1)
+    # Другой процесс приложения видит прогресс задачи только через таблицу import_jobs.
+    other_pool = ImportJobsPool(workers=0, queue_size=1)
+    try:
+        job = await pool.submit(Import(data=[generate_citizen(citizen_id=1)]), database)
+        running_job = pool._jobs[job["job_id"]]
+        await pool._start(running_job)
+        running_job.progress.rows_written = 5
+        await pool.report_progress()
+
+        job = await other_pool.get(job["job_id"], database)
+        assert job["phase"] == "citizens"
+        assert job["rows_written"] == 5
+        assert job["duration"] >= 0
+    finally:
+        await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_abandoned_import_job(migrated_postgres, database):
+    pool = ImportJobsPool(workers=0, queue_size=2)
+    try:
+        first = await pool.submit(Import(data=[generate_citizen(citizen_id=1)]), database)
+        second = await pool.submit(Import(data=[generate_citizen(citizen_id=1)]), database)
+        # Свежие задачи работающего процесса не считаются брошенными.
+        await ImportJobsPool(workers=0, queue_size=1).fail_abandoned(database)
+        assert (await ImportJobsPool(workers=0, queue_size=1).get(first["job_id"], database))["phase"] == "queued"
+
+        # Задачи, которые долго не обновлялись, помечаются неудавшимися при запуске и при чтении.
+        other_pool = ImportJobsPool(workers=0, queue_size=1, stale_after=0)
+        await other_pool.fail_abandoned(database)
+        job = await other_pool.get(first["job_id"], database)
+        assert job["phase"] == "failed"
+        assert job["error"] == ABANDONED_ERROR
+        pool._jobs.pop(second["job_id"])
+        assert (await other_pool.get(second["job_id"], database))["phase"] == "failed"
+    finally:
+        await pool.stop()
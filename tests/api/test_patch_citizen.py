@@ -54,3 +54,22 @@ def test_wrong_patch(migrated_postgres, client):
     citizen.update(patch)
     response = client.patch(url, data=json.dumps(patch))
     assert response.status_code == 400
+
+
+def test_patch_missing_citizen(migrated_postgres, client):
+    # Житель, которого нет в выгрузке, не найден.
+    r = client.post("/imports", json={"data": [generate_citizen(citizen_id=1)]})
+    import_id = r.json()["data"]["import_id"]
+    response = client.patch(f"/imports/{import_id}/citizens/2", data=json.dumps({"name": "Иванов"}))
+    assert response.status_code == 404
+
+
+def test_patch_unknown_relatives(migrated_postgres, client):
+    # Родственники, которых нет в выгрузке, не сохраняются.
+    citizen = generate_citizen(citizen_id=1, relatives=[])
+    r = client.post("/imports", json={"data": [citizen]})
+    import_id = r.json()["data"]["import_id"]
+    response = client.patch(f"/imports/{import_id}/citizens/1", data=json.dumps({"relatives": [2]}))
+    assert response.status_code == 400
+    response = client.get(f"/imports/{import_id}/citizens")
+    assert compare_citizen_groups(response.json()["data"], [citizen])
@@ -0,0 +1,49 @@
+from utils import compare_citizen_groups, generate_citizen
+
+
+def test_bulk_patch(migrated_postgres, client):
+    dataset = [
+        generate_citizen(citizen_id=1, relatives=[2]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+        generate_citizen(citizen_id=3, relatives=[]),
+    ]
+    import_id = client.post("/imports", json={"data": dataset}).json()["data"]["import_id"]
+    patches = [
+        {"citizen_id": 2, "name": "Сидорова Василиса Петровна"},
+        {"citizen_id": 1, "relatives": [3]},
+        # Изменения применяются по порядку, второе изменение жителя видит результат первого.
+        {"citizen_id": 2, "relatives": [1, 2]},
+    ]
+    response = client.patch(f"/imports/{import_id}/citizens", json={"data": patches})
+    assert response.status_code == 200
+
+    dataset[0]["relatives"] = [2, 3]
+    dataset[1].update(name="Сидорова Василиса Петровна", relatives=[1, 2])
+    dataset[2]["relatives"] = [1]
+    assert compare_citizen_groups(response.json()["data"], dataset[:2])
+    assert [citizen["citizen_id"] for citizen in response.json()["data"]] == [2, 1]
+    response = client.get(f"/imports/{import_id}/citizens")
+    assert compare_citizen_groups(response.json()["data"], dataset)
+
+
+def test_wrong_bulk_patch(migrated_postgres, client):
+    import_id = client.post("/imports", json={"data": [generate_citizen(citizen_id=1)]}).json()["data"]["import_id"]
+    url = f"/imports/{import_id}/citizens"
+    for patches in (
+        [],
+        [{"citizen_id": 1}],
+        [{"citizen_id": 1, "relatives": [2]}],
+    ):
+        response = client.patch(url, json={"data": patches})
+        assert response.status_code == 400
+
+
+def test_bulk_patch_of_missing_citizen(migrated_postgres, client):
+    # Пакет, в котором есть житель не из выгрузки, не применяется целиком.
+    citizen = generate_citizen(citizen_id=1)
+    import_id = client.post("/imports", json={"data": [citizen]}).json()["data"]["import_id"]
+    url = f"/imports/{import_id}/citizens"
+    patches = [{"citizen_id": 1, "name": "Петров Петр Петрович"}, {"citizen_id": 2, "name": "Иванов Иван Иванович"}]
+    response = client.patch(url, json={"data": patches})
+    assert response.status_code == 404
+    assert client.get(url).json()["data"] == [citizen]
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from api.pool import MonitoredDatabase
+from prometheus_client import REGISTRY
+
+
+def get_metric(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+async def run_queries(database, number, seconds=0.05):
+    # Каждый запрос выполняется в своей задаче и берет свое соединение из пула.
+    await asyncio.gather(*(database.execute(f"SELECT pg_sleep({seconds})") for _ in range(number)))
+
+
+@pytest.mark.asyncio
+async def test_pool_metrics(migrated_postgres, db_settings):
+    database = MonitoredDatabase(db_settings.dsn(), "test_metrics", min_size=1, max_size=2, interval=3600)
+    await database.connect()
+    try:
+        waits = get_metric("db_pool_wait_seconds_count", database="test_metrics")
+        await run_queries(database, 4)
+        # Пул выдает не больше max_size соединений, остальные запросы ждут.
+        assert database.pool.peak == 2
+        assert get_metric("db_pool_limit", database="test_metrics") == 2
+        assert get_metric("db_pool_in_use", database="test_metrics") == 0
+        assert get_metric("db_pool_wait_seconds_count", database="test_metrics") == waits + 4
+        assert max(database.pool.waits) >= 0.05
+
+        await database.adjust()
+        assert get_metric("db_pool_connections", database="test_metrics") == 2
+        assert database.pool.waits == []
+        assert database.pool.limit == 2
+    finally:
+        await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_adaptive_pool(migrated_postgres, db_settings):
+    database = MonitoredDatabase(
+        db_settings.dsn(), "test_adaptive", min_size=1, max_size=4, adaptive=True, target_wait=0.001, interval=3600
+    )
+    await database.connect()
+    try:
+        # Пул растет, пока запросы ждут соединений, но не больше max_size.
+        limits = []
+        for _ in range(4):
+            await run_queries(database, 4)
+            await database.adjust()
+            limits.append(database.pool.limit)
+        assert limits == [2, 3, 4, 4]
+
+        # Без ожиданий пул уменьшается по одному соединению до min_size.
+        limits = []
+        for _ in range(4):
+            await run_queries(database, 1, seconds=0)
+            await database.adjust()
+            limits.append(database.pool.limit)
+        assert limits == [3, 2, 1, 1]
+    finally:
+        await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_adaptive_pool_budget(migrated_postgres, db_settings):
+    # Соединения другого пула приложения занимают часть общего бюджета.
+    other = MonitoredDatabase(db_settings.dsn(), "test_other", min_size=2, max_size=2, interval=3600)
+    database = MonitoredDatabase(
+        db_settings.dsn(),
+        "test_budget",
+        min_size=1,
+        max_size=4,
+        adaptive=True,
+        budget=4,
+        target_wait=0.001,
+        interval=3600,
+    )
+    await other.connect()
+    await database.connect()
+    try:
+        for _ in range(3):
+            await run_queries(database, 4)
+            await database.adjust()
+        assert database.pool.limit == 2
+
+        # Когда другой пул закрывается, бюджет освобождается.
+        await other.disconnect()
+        await run_queries(database, 4)
+        await database.adjust()
+        assert database.pool.limit == 3
+    finally:
+        await database.disconnect()
+        if other.is_connected:
+            await other.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_pool_fairness(migrated_postgres, db_settings):
+    database = MonitoredDatabase(db_settings.dsn(), "test_fairness", min_size=1, max_size=1, interval=3600)
+    await database.connect()
+    order = []
+
+    async def task(task_id):
+        for _ in range(3):
+            await database.execute("SELECT pg_sleep(0.01)")
+            order.append(task_id)
+
+    try:
+        # Задача, которая сразу берет соединение снова, встает в очередь за ожидающими задачами.
+        await asyncio.gather(*(task(task_id) for task_id in range(3)))
+        assert order == [0, 1, 2] * 3
+    finally:
+        await database.disconnect()
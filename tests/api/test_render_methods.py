@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+import analyzer
+import pytest
+from api.dependencies import settings
+from api.settings import RenderMethod
+from utils import LONGEST_STR, MAX_INT, generate_citizen, generate_citizens
+
+URLS = ["citizens", "citizens/birthdays", "towns/stat/percentile/age", "towns/stat/percentile/age?as_of=2000-06-15"]
+
+
+def get_documents(client, import_id, method, monkeypatch):
+    monkeypatch.setattr(settings, "render_method", method)
+    documents = [client.get(f"/imports/{import_id}/{url}").json() for url in URLS]
+    # Порядок жителей в выгрузке не определен.
+    documents[0]["data"].sort(key=lambda citizen: citizen["citizen_id"])
+    return documents
+
+
+def test_same_documents(migrated_postgres, client, monkeypatch):
+    citizens = generate_citizens(citizens_num=200, relations_num=50, unique_towns=5)
+    # Строки, которые нужно экранировать в JSON.
+    citizens += [
+        generate_citizen(citizen_id=1000, name='"Кавычки" и \\слэши\\', town="Город\tс\nпереносом", relatives=[]),
+        generate_citizen(citizen_id=MAX_INT, name=LONGEST_STR, street="😀", relatives=[MAX_INT]),
+    ]
+    import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+    client.patch(f"/imports/{import_id}/citizens/1000", json={"relatives": [0]})
+    python_documents = get_documents(client, import_id, RenderMethod.python, monkeypatch)
+    database_documents = get_documents(client, import_id, RenderMethod.database, monkeypatch)
+    assert database_documents == python_documents
+
+
+def test_same_empty_documents(migrated_postgres, client, monkeypatch):
+    python_documents = get_documents(client, 100500, RenderMethod.python, monkeypatch)
+    assert get_documents(client, 100500, RenderMethod.database, monkeypatch) == python_documents
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100])
+def test_citizens_document_chunks(migrated_postgres, client, database, chunk_size):
+    citizens = generate_citizens(citizens_num=50, relations_num=10)
+    import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+
+    async def read_chunks():
+        return [chunk async for chunk in analyzer.iter_citizens_document(import_id, database, chunk_size=chunk_size)]
+
+    chunks = asyncio.get_event_loop().run_until_complete(read_chunks())
+    # Первый и последний фрагменты - начало и конец документа.
+    assert len(chunks) == -(-len(citizens) // chunk_size) + 2
+    document = json.loads(b"".join(chunks))
+    assert [citizen["citizen_id"] for citizen in document["data"]] == sorted(c["citizen_id"] for c in citizens)
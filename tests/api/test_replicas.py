@@ -0,0 +1,92 @@
+import asyncio
+import socket
+import time
+
+import analyzer
+import pytest
+from api import application
+from api.cache import ResponseCache
+from api.replicas import ReplicaRouter
+from api.scheme import CitizenPatch, Import
+from databases import Database
+from prometheus_client import REGISTRY
+from utils import generate_citizen
+
+
+def get_metric(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.asyncio
+async def test_choose_replica(migrated_postgres, database, db_settings):
+    # Та же БД выступает репликой, которая уже применила все изменения.
+    replica = Database(db_settings.dsn())
+    router = ReplicaRouter(replica, max_wait=0.05)
+    await router.connect()
+    try:
+        import_id = await analyzer.save_import(Import(data=[generate_citizen(citizen_id=1)]), database)
+        assert await router.choose(import_id, 0, database) is replica
+        # Реплика еще не применила версию, после ожидания чтение идет в основную БД.
+        started = time.monotonic()
+        assert await router.choose(import_id, 1, database) is database
+        assert time.monotonic() - started >= router.max_wait - router.poll_interval
+        # Выгрузки нет, ответ строится по основной БД.
+        assert await router.choose(import_id, None, database) is database
+    finally:
+        await router.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_unavailable_replica(migrated_postgres, database, db_settings):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    replica = Database(f"postgresql://{db_settings.user}@127.0.0.1:{port}/{db_settings.db}", min_size=0)
+    router = ReplicaRouter(replica, max_wait=5)
+    await router.connect()
+    try:
+        # Недоступная реплика не задерживает чтение.
+        started = time.monotonic()
+        assert await router.choose(1, 0, database) is database
+        assert time.monotonic() - started < 5
+    finally:
+        await router.disconnect()
+
+
+def test_read_your_writes(migrated_postgres, client, database, db_settings, monkeypatch):
+    loop = asyncio.get_event_loop()
+    router = ReplicaRouter(Database(db_settings.dsn()), max_wait=0)
+    cache = ResponseCache(max_size=1024 * 1024, check_interval=0.1)
+    monkeypatch.setattr(application, "replicas", router)
+    monkeypatch.setattr(application, "response_cache", cache)
+    loop.run_until_complete(router.connect())
+    loop.run_until_complete(cache.start(db_settings.dsn()))
+    try:
+        while not cache.listening:
+            loop.run_until_complete(asyncio.sleep(0.01))
+        dataset = [generate_citizen(citizen_id=1, relatives=[]), generate_citizen(citizen_id=2, relatives=[])]
+        response = client.post("/imports", json={"data": dataset})
+        import_id = response.json()["data"]["import_id"]
+        # Записи возвращают версию выгрузки, которую потом можно передать в чтения.
+        assert response.headers["Import-Version"] == "0"
+        response = client.patch(f"/imports/{import_id}/citizens/1", json={"name": "Иванов"})
+        assert response.headers["Import-Version"] == "1"
+        response = client.patch(f"/imports/{import_id}/citizens", json={"data": [{"citizen_id": 2, "name": "Петров"}]})
+        assert response.headers["Import-Version"] == "2"
+
+        url = f"/imports/{import_id}/citizens"
+        replica_reads = get_metric("routed_reads_total", database="replica")
+        assert [c["name"] for c in client.get(url, params={"min_version": 2}).json()["data"]] == ["Иванов", "Петров"]
+        assert get_metric("routed_reads_total", database="replica") == replica_reads + 1
+
+        # Изменение другим процессом: версия из кеша может отставать до уведомления, но переданная клиентом
+        # версия читается из основной БД.
+        loop.run_until_complete(analyzer.patch_citizen(import_id, 1, CitizenPatch(name="Сидоров"), database))
+        response = client.get(url, params={"min_version": 3})
+        assert [c["name"] for c in response.json()["data"]] == ["Сидоров", "Петров"]
+        assert response.headers["ETag"] == f'W/"{import_id}-3"'
+
+        assert client.get(url, params={"min_version": -1}).status_code == 400
+    finally:
+        loop.run_until_complete(cache.stop())
+        loop.run_until_complete(router.disconnect())
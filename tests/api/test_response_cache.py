@@ -0,0 +1,184 @@
+import asyncio
+import json
+
+import analyzer
+import pytest
+from api import application
+from api.cache import ResponseCache
+from api.scheme import CitizenPatch, Import
+from prometheus_client import REGISTRY
+from utils import compare_citizen_groups, generate_citizen, generate_citizens
+
+
+async def start_cache(cache, dsn):
+    await cache.start(dsn)
+    while not cache.listening:
+        await asyncio.sleep(0.01)
+
+
+async def wait_for_version(cache, import_id, version, attempts=500):
+    for _ in range(attempts):
+        if cache.version(import_id) == version and (version is not None or cache.is_dropped(import_id)):
+            return
+        await asyncio.sleep(0.01)
+    raise RuntimeError("Notification is not received in time")
+
+
+async def get_or_render(cache, import_id, render, database, *key):
+    version = await cache.get_version(import_id, database)
+    return await cache.get_or_render("citizens", import_id, version, render, *key)
+
+
+def get_metric(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.asyncio
+async def test_invalidation_by_notification(migrated_postgres, database, db_settings):
+    import_id = await analyzer.save_import(Import(data=[generate_citizen(citizen_id=1, relatives=[])]), database)
+    renders = []
+
+    async def render():
+        citizens = await analyzer.get_citizens(import_id, database)
+        renders.append(citizens)
+        return json.dumps(citizens, default=str).encode()
+
+    cache = ResponseCache(max_size=1024 * 1024, check_interval=0.1)
+    await start_cache(cache, db_settings.dsn())
+    try:
+        body = await get_or_render(cache, import_id, render, database)
+        assert await get_or_render(cache, import_id, render, database) == body
+        assert len(renders) == 1
+
+        # Выгрузку изменяет другой процесс, кэш узнает об этом из уведомления.
+        await analyzer.patch_citizen(import_id, 1, CitizenPatch(name="Петров Петр Петрович"), database)
+        await wait_for_version(cache, import_id, 1)
+        assert cache.size == 0
+        await get_or_render(cache, import_id, render, database)
+        assert len(renders) == 2
+        assert renders[-1][0]["name"] == "Петров Петр Петрович"
+
+        # После удаления выгрузки ее ответы вытесняются, а сама она считается
+        # несуществующей.
+        await analyzer.drop_import(import_id, database)
+        await wait_for_version(cache, import_id, None)
+        assert cache.size == 0
+        assert await cache.get_version(import_id, database) is None
+    finally:
+        await cache.stop()
+    assert not cache.listening
+
+
+@pytest.mark.asyncio
+async def test_eviction_by_size(migrated_postgres, database, db_settings):
+    import_ids = [
+        await analyzer.save_import(Import(data=[generate_citizen(citizen_id=1, relatives=[])]), database)
+        for _ in range(3)
+    ]
+    renders = []
+
+    def renderer(import_id):
+        async def render():
+            renders.append(import_id)
+            return b"12345"
+
+        return render
+
+    evictions = get_metric("response_cache_evictions_total", reason="size")
+    cache = ResponseCache(max_size=10, check_interval=0.1)
+    await start_cache(cache, db_settings.dsn())
+    try:
+        first, second, third = import_ids
+        for import_id in (first, second, first, third):
+            await get_or_render(cache, import_id, renderer(import_id), database)
+        # Вытесняется давно не использованный ответ.
+        assert renders == [first, second, third]
+        assert cache.size == 10
+        assert get_metric("response_cache_evictions_total", reason="size") == evictions + 1
+        await get_or_render(cache, second, renderer(second), database)
+        assert renders[-1] == second
+        # Ответ больше всего кэша не сохраняется.
+        await get_or_render(cache, first, lambda: asyncio.sleep(0, b"0" * 11), database, "other")
+        assert cache.size == 10
+    finally:
+        await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_eviction_of_versions(migrated_postgres, database, db_settings):
+    import_ids = [
+        await analyzer.save_import(Import(data=[generate_citizen(citizen_id=1, relatives=[])]), database)
+        for _ in range(3)
+    ]
+
+    async def render():
+        return b"12345"
+
+    evictions = get_metric("response_cache_evictions_total", reason="imports")
+    cache = ResponseCache(max_size=1024 * 1024, check_interval=0.1, max_imports=2)
+    await start_cache(cache, db_settings.dsn())
+    try:
+        first, second, third = import_ids
+        for import_id in (first, second):
+            await get_or_render(cache, import_id, render, database)
+        # Удаленная выгрузка остается в кэше до вытеснения, уведомление о ней
+        # тоже считается использованием.
+        await analyzer.drop_import(first, database)
+        await wait_for_version(cache, first, None)
+        # Версия давно не использованной выгрузки забывается вместе с ее ответами.
+        await get_or_render(cache, third, render, database)
+        assert cache.version(second) is None and not cache.is_dropped(second)
+        assert cache.is_dropped(first)
+        assert cache.version(third) == 0
+        assert cache.size == 5
+        assert get_metric("response_cache_evictions_total", reason="imports") == evictions + 1
+    finally:
+        await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_dropped_import_is_not_restored(migrated_postgres, database):
+    import_id = await analyzer.save_import(Import(data=[generate_citizen(citizen_id=1, relatives=[])]), database)
+    cache = ResponseCache(max_size=1024 * 1024)
+    cache.listening = True
+    assert await cache.get_version(import_id, database) == 0
+    cache.put("citizens", import_id, 0, b"[]")
+    await analyzer.drop_import(import_id, database)
+
+    # Уведомление об удалении приходит после версии, прочитанной до удаления.
+    cache._on_notification(None, 0, analyzer.IMPORTS_CHANNEL, f"{import_id}:{analyzer.IMPORT_DROPPED}")
+    cache._on_notification(None, 0, analyzer.IMPORTS_CHANNEL, f"{import_id}:1")
+    assert cache.is_dropped(import_id)
+    assert cache.size == 0
+    assert await cache.get_version(import_id, database) is None
+    assert await cache.refresh(import_id, database) is None
+    cache.put("citizens", import_id, 1, b"[]")
+    assert cache.size == 0
+
+
+def test_cached_responses(migrated_postgres, client, db_settings, monkeypatch):
+    loop = asyncio.get_event_loop()
+    cache = ResponseCache(max_size=1024 * 1024, check_interval=0.1)
+    monkeypatch.setattr(application, "response_cache", cache)
+    loop.run_until_complete(start_cache(cache, db_settings.dsn()))
+    try:
+        citizens = generate_citizens(citizens_num=20, relations_num=5, start_citizen_id=1)
+        import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+        urls = [f"/imports/{import_id}/{url}" for url in ("citizens", "citizens/birthdays", "towns/stat/percentile/age")]
+        hits = get_metric("response_cache_hits_total", endpoint="citizens")
+        first = [client.get(url).json() for url in urls]
+        assert [client.get(url).json() for url in urls] == first
+        assert get_metric("response_cache_hits_total", endpoint="citizens") == hits + 1
+        assert compare_citizen_groups(first[0]["data"], citizens)
+
+        # Изменение видно сразу в том же процессе, не дожидаясь уведомления.
+        citizens[0]["name"] = "Петров Петр Петрович"
+        client.patch(f"/imports/{import_id}/citizens/{citizens[0]['citizen_id']}", json={"name": citizens[0]["name"]})
+        assert compare_citizen_groups(client.get(urls[0]).json()["data"], citizens)
+
+        assert client.delete(f"/imports/{import_id}").status_code == 204
+        assert client.get(urls[0]).json() == {"data": []}
+        assert client.get(f"/imports/{import_id}/changes").status_code == 404
+        assert "response_cache_hits_total" in client.get("/metrics").text
+    finally:
+        loop.run_until_complete(cache.stop())
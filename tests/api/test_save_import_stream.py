@@ -0,0 +1,97 @@
+import json
+from datetime import date, timedelta
+
+import pytest
+from api.dependencies import settings
+from api.streaming import ImportStreamParser
+from utils import compare_citizen_groups, generate_citizen, generate_citizens
+
+
+def chunked(body: bytes, size: int):
+    for i in range(0, len(body), size):
+        yield body[i : i + size]
+
+
+def test_parser_byte_by_byte():
+    citizens = generate_citizens(citizens_num=10, relations_num=3)
+    body = json.dumps({"meta": [1, {"a": "b"}], "data": citizens, "other": 12}, ensure_ascii=False).encode()
+    parser = ImportStreamParser()
+    items = []
+    for chunk in chunked(body, 1):
+        items.extend(parser.feed(chunk))
+    items.extend(parser.close())
+    assert items == citizens
+    assert parser.data_found
+
+
+@pytest.mark.parametrize("body", [b"", b"{", b'{"data": [{"citizen_id": 1}', b'{"data": []} []', b"[]", b'{"data" []}'])
+def test_parser_malformed(body):
+    parser = ImportStreamParser()
+    with pytest.raises(ValueError):
+        parser.feed(body)
+        parser.close()
+
+
+def test_successful_stream(migrated_postgres, client, monkeypatch):
+    monkeypatch.setattr(settings, "import_batch_size", 7)
+    citizens = generate_citizens(citizens_num=100, relations_num=30)
+    body = json.dumps({"data": citizens}).encode()
+    response = client.post("/imports/stream", data=chunked(body, 1000))
+    assert response.status_code == 201
+    import_id = response.json()["data"]["import_id"]
+
+    response = client.get(f"/imports/{import_id}/citizens")
+    assert compare_citizen_groups(response.json()["data"], citizens)
+
+    # Агрегаты совпадают с агрегатами обычной выгрузки.
+    other_import_id = client.post("/imports", json={"data": citizens}).json()["data"]["import_id"]
+    for url in ("citizens/birthdays", "towns/stat/percentile/age"):
+        expected = client.get(f"/imports/{other_import_id}/{url}").json()
+        assert client.get(f"/imports/{import_id}/{url}").json() == expected
+
+
+def test_empty_stream(migrated_postgres, client):
+    response = client.post("/imports/stream", json={"data": []})
+    assert response.status_code == 201
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"data": [generate_citizen(birth_date=(date.today() + timedelta(days=1)).strftime("%Y-%m-%d"))]},
+        {"data": [generate_citizen(citizen_id=1), generate_citizen(citizen_id=1)]},
+        {"data": [generate_citizen(citizen_id=1, relatives=[2]), generate_citizen(citizen_id=2, relatives=[])]},
+        {"data": [generate_citizen(citizen_id=1, relatives=[3])]},
+        {"citizens": []},
+    ],
+)
+def test_wrong_stream(migrated_postgres, client, body):
+    response = client.post("/imports/stream", json=body)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("relatives", [None, "missing"])
+def test_stream_without_relatives(migrated_postgres, client, relatives):
+    # Житель без родственников отклоняется так же, как при обычной загрузке.
+    citizen = generate_citizen(citizen_id=1)
+    if relatives == "missing":
+        del citizen["relatives"]
+    else:
+        citizen["relatives"] = relatives
+    for url in ("/imports", "/imports/stream"):
+        response = client.post(url, json={"data": [citizen]})
+        assert response.status_code == 400
+
+
+def test_malformed_stream(migrated_postgres, client):
+    response = client.post("/imports/stream", data=b'{"data": [')
+    assert response.status_code == 400
+
+
+def test_too_large_import(migrated_postgres, client, monkeypatch):
+    monkeypatch.setattr(settings, "max_import_size", 100)
+    body = {"data": generate_citizens(citizens_num=10)}
+    assert client.post("/imports/stream", json=body).status_code == 413
+    assert client.post("/imports", json=body).status_code == 413
+    # Body without Content-Length is checked while it is read.
+    assert client.post("/imports/stream", data=chunked(json.dumps(body).encode(), 10)).status_code == 413
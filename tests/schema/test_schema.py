@@ -1,6 +1,7 @@
 from datetime import date, timedelta
 
 import pytest
+from api.columns import ImportColumns
 from api.scheme import BaseCitizen, Citizen, CitizenPatch, Import
 from pydantic import ValidationError
 from utils import generate_citizen
@@ -81,3 +82,33 @@ def test_import():
             generate_citizen(citizen_id=3, relatives=[]),
         ]
         Import(data=dataset)
+
+
+def test_import_columns():
+    dataset = [
+        generate_citizen(citizen_id=1, relatives=[2, 3]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+        generate_citizen(citizen_id=3, relatives=[1]),
+        generate_citizen(citizen_id=4, relatives=[]),
+        generate_citizen(citizen_id=5, relatives=[5]),
+    ]
+    columns = ImportColumns.from_citizens(Import(data=dataset).data)
+    assert list(columns.citizen_ids) == [1, 2, 3, 4, 5]
+    assert list(columns.relatives_offsets) == [0, 2, 3, 4, 4, 5]
+    assert list(columns.relatives) == [2, 3, 1, 1, 5]
+    assert list(columns.relation_citizens) == [1, 1, 2, 3, 5]
+
+
+@pytest.mark.parametrize(
+    "dataset, message",
+    [
+        ([dict(citizen_id=1, relatives=[]), dict(citizen_id=1, relatives=[])], "not unique"),
+        ([dict(citizen_id=1, relatives=[2]), dict(citizen_id=2, relatives=[])], "does not have relation"),
+        ([dict(citizen_id=1, relatives=[3])], "not in import"),
+        ([dict(citizen_id=-2147483648, relatives=[2147483647]), dict(citizen_id=2147483647, relatives=[])], "relation"),
+    ],
+)
+def test_import_columns_validation(dataset, message):
+    columns = ImportColumns.from_citizens(Citizen.construct(**citizen) for citizen in dataset)
+    with pytest.raises(ValueError, match=message):
+        columns.validate()